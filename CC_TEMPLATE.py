@@ -1,35 +1,15 @@
-from CC import db_cc_df_expanded
-from google_sheet_processor import GoogleSheetUtils, DataFrameUtils
-from dotenv import load_dotenv
-import os
-import time
-import pandas as pd
+from google_sheet_processor import GoogleSheetUtils, DataFrameUtils, SheetsSession
+from tax_engine import TaxEngine
+from group_scheduler import GroupScheduler, NoteNumbers
+from pdf_store import PdfStore
+from tab_archive import TabArchive
+from stage_profiler import profile_stage
+from functools import partial
 from datetime import datetime
 
-# Load environment variables from .env
-load_dotenv()
-
-# Retrieve the spreadsheet ID from the .env file
-spreadsheet_id = os.getenv("SPREADSHEET_ID")
-
 gsheet_utils = GoogleSheetUtils()
 dataframe_utils = DataFrameUtils()
 
-# Get the path to the service account JSON file
-credentials = gsheet_utils.load_credentials("inv-cn-creation.json")
-
-# Build the Sheets API service
-service_api = gsheet_utils.build_service(credentials)
-
-# Fetch data from the Google Sheet
-sheet_data = gsheet_utils.fetch_sheet_data(service_api, spreadsheet_id, "DB-CC_2", range_="A:AN")
-
-# Process the data into a DataFrame
-df_raw = dataframe_utils.process_data_to_dataframe(sheet_data)
-
-# Initialize the starting credit note number
-credit_note_counter = 1426
-
 # Define the cell mapping for the "Template-CC"
 cell_mapping = {
     "A4": "full_name",
@@ -60,6 +40,8 @@ def get_dynamic_value(cell, group):
     """
     Determine the value to populate for a specific cell dynamically.
     """
+    import pandas as pd
+
     if cell == "G7":  # Example: Today's date
         return datetime.today().strftime("%Y-%m-%d")
     elif cell == "G8":  # Example: Extract month from "Created Date" column
@@ -74,144 +56,139 @@ def get_dynamic_value(cell, group):
     return None  # Default for unmapped cells
 
 
-# Function to update a cell with a delay to avoid rate limits
-def update_cell_with_delay(sheet_id, cell_range, value, credentials):
-    service = gsheet_utils.build_service(credentials)
-    body = {"range": cell_range, "values": [[value]], "majorDimension": "ROWS"}
-    service.spreadsheets().values().update(
-        spreadsheetId=sheet_id,
-        range=cell_range,
-        valueInputOption="USER_ENTERED",
-        body=body
-    ).execute()
-    time.sleep(2)  # Add a delay of 2 seconds to avoid rate limits
-
-df_raw = df_raw[df_raw['invoicing_date'] == "December 31st, 2024"]
-# Group the DataFrame by "email_address"
-grouped = df_raw.groupby("email_address")
-
-for email_address, group in grouped:
-    print(f"Processing group for email_address: {email_address}")
-
-    if group["Invoice: Invoice No."].notnull().all():
-        # Generate credit note number
-        credit_note_number = f"CN-CC-{credit_note_counter:06}"
-        credit_note_counter += 1
-        print(f"Generated credit note number: {credit_note_number}")
-
-        # Copy the template sheet
-        sheet_copy_name = f"{credit_note_number}"
-        gsheet_utils.copy_sheet(service_api, spreadsheet_id, "Template-CC", sheet_copy_name)
-        print(f"Copied template to: {sheet_copy_name}")
-
-        # Update G6 with the credit note number
-        print(f"Updating G6 in {sheet_copy_name} with credit note number 'CN.{credit_note_number}'")
-        update_cell_with_delay(
-            spreadsheet_id,
-            f"{sheet_copy_name}!G6",
-            credit_note_number,
-            credentials
-        )
-
-        # Update fixed fields (static mappings) in the template
-        first_row = group.iloc[0]
-        for template_cell, db_column in cell_mapping.items():
-            if db_column in first_row.index:  # Ensure the column exists in the DataFrame
-                value = first_row[db_column]
-                print(f"Updating {template_cell} in {sheet_copy_name} with value '{value}' from column '{db_column}'")
+# Update a single cell; requests are paced by the rate limiter shared with every worker thread
+def update_cell_with_delay(session, cell_range, value):
+    gsheet_utils.update_cell_with_delay(session.service, session.spreadsheet_id, cell_range, value)
+
+
+def create_credit_note(session, pdf_store, tab_archive, note_numbers, email_address, group, tax_row):
+    """Copy the template into a new tab and fill in the credit note for one group."""
+    import pandas as pd
+
+    # A group whose amounts could not be read fails here, before it takes a number or creates its tab
+    tax_row = TaxEngine.check(tax_row)
+    credit_note_number = note_numbers.take(email_address)
+
+    # Copy the template sheet
+    sheet_copy_name = f"{credit_note_number}"
+    # The note is filled in and exported where it is created: the working spreadsheet, or the
+    # current period's archive shard with SHARD_NEW_NOTES (see tab_archive.py)
+    session, new_sheet_id = tab_archive.create_note_tab(session, "Template-CC", sheet_copy_name)
+    print(f"Copied template to: {sheet_copy_name}")
+
+    # Update G6 with the credit note number
+    print(f"Updating G6 in {sheet_copy_name} with credit note number 'CN.{credit_note_number}'")
+    update_cell_with_delay(
+        session,
+        f"{sheet_copy_name}!G6",
+        credit_note_number
+    )
+
+    # Update fixed fields (static mappings) in the template
+    # The computed totals win over any tax columns the DB tab already has
+    first_row = pd.concat([group.iloc[0].drop(tax_row.index, errors="ignore"), tax_row])
+    for template_cell, db_column in cell_mapping.items():
+        if db_column in first_row.index:  # Ensure the column exists in the DataFrame
+            value = first_row[db_column]
+            print(f"Updating {template_cell} in {sheet_copy_name} with value '{value}' from column '{db_column}'")
+            update_cell_with_delay(
+                session,
+                f"{sheet_copy_name}!{template_cell}",
+                value
+            )
+
+    # Update dynamic fields
+    dynamic_cells = ["G7", "G8"]  # Example: Add cells requiring dynamic values
+    for cell in dynamic_cells:
+        value = get_dynamic_value(cell, group)
+        if value:
+            print(f"Updating {cell} in {sheet_copy_name} with dynamic value '{value}'")
+            update_cell_with_delay(
+                session,
+                f"{sheet_copy_name}!{cell}",
+                value
+            )
+
+    for field, start_cell in multi_row_fields.items():
+        if field in group.columns:
+            print(f"Updating multi-row field: {field} (starting at {start_cell})")
+            for i, (_, row) in enumerate(group.iterrows()):
+                target_cell = f"{start_cell[0]}{int(start_cell[1:]) + i}"
+                value = row[field]
+                print(f"Updating {target_cell} with value '{value}' for field '{field}'")
                 update_cell_with_delay(
-                    spreadsheet_id,
-                    f"{sheet_copy_name}!{template_cell}",
-                    value,
-                    credentials
+                    session,
+                    f"{sheet_copy_name}!{target_cell}",
+                    value
                 )
 
-        # Update dynamic fields
-        dynamic_cells = ["G7", "G8"]  # Example: Add cells requiring dynamic values
-        for cell in dynamic_cells:
-            value = get_dynamic_value(cell, group)
-            if value:
-                print(f"Updating {cell} in {sheet_copy_name} with dynamic value '{value}'")
-                update_cell_with_delay(
-                    spreadsheet_id,
-                    f"{sheet_copy_name}!{cell}",
-                    value,
-                    credentials
-                )
+    # Export the finished tab as PDF; identical bytes are only stored once
+    pdf_bytes = gsheet_utils.export_sheet_pdf(session.service, session.credentials, session.spreadsheet_id,
+                                              new_sheet_id)
+    if pdf_bytes:  # nothing was created in a dry run
+        pdf_store.add_bytes(pdf_bytes, f"{sheet_copy_name}.pdf")
+        print(f"Stored {sheet_copy_name}.pdf ({len(pdf_bytes)} bytes)")
 
-        for field, start_cell in multi_row_fields.items():
-            if field in group.columns:
-                print(f"Updating multi-row field: {field} (starting at {start_cell})")
-                for i, (_, row) in enumerate(group.iterrows()):
-                    target_cell = f"{start_cell[0]}{int(start_cell[1:]) + i}"
-                    value = row[field]
-                    print(f"Updating {target_cell} with value '{value}' for field '{field}'")
-                    update_cell_with_delay(
-                        spreadsheet_id,
-                        f"{sheet_copy_name}!{target_cell}",
-                        value,
-                        credentials
-                    )
-
-
-def locate_and_calculate_tax(template_data, cell_mapping):
-    """
-    Calculate tax dynamically based on the country and net total.
+    return sheet_copy_name
 
-    :param template_data: Dictionary with template data, e.g., cell values.
-    :param cell_mapping: Mapping of template cells to data fields.
-    """
-    # Extract country from the template
-    country_cell = cell_mapping.get("A7", None)
-    country = template_data.get(country_cell, "").strip().lower()
-
-    # Locate the base amount next to "Net Total"
-    base_amount = None
-    for cell, value in template_data.items():
-        if value == "Net Total":  # Look for the "Net Total" label
-            adjacent_cell = get_adjacent_cell(cell, direction="right")  # Define this helper function
-            base_amount = template_data.get(adjacent_cell, 0)
-            break
-
-    # If base amount is found, calculate tax
-    if base_amount is not None and isinstance(base_amount, (int, float)):
-        tax_value = base_amount * 0.19 if country == "Germany" or "Deutschland" else 0
-        # Update the calculated tax in cell A32
-        template_data["A32"] = tax_value
-        print(f"Calculated tax for {country}: {tax_value} written to A32")
-    else:
-        print("Base amount not found or invalid. Cannot calculate tax.")
-
-
-def get_adjacent_cell(current_cell, direction="right"):
-    """
-    Get the adjacent cell reference based on direction (right, left, up, down).
-    :param current_cell: Current cell reference, e.g., "G31".
-    :param direction: Direction to find the adjacent cell.
-    :return: Adjacent cell reference, e.g., "H31".
-    """
-    import re
-    match = re.match(r"([A-Z]+)(\d+)", current_cell)
-    if not match:
-        return None
-    col, row = match.groups()
-    row = int(row)
-    if direction == "right":
-        col = chr(ord(col) + 1)
-    elif direction == "left":
-        col = chr(ord(col) - 1)
-    elif direction == "down":
-        row += 1
-    elif direction == "up":
-        row -= 1
-    return f"{col}{row}"
-
-
-# Example Usage
-template_data = {
-    "A7": "Germany",
-    "G31": "Net Total",
-    "H31": 1000,  # Base amount is in H31
-    "A32": None
-}
-locate_and_calculate_tax(template_data, cell_mapping)
\ No newline at end of file
+
+def create_credit_notes(session):
+    """Build one credit note per eligible group and store the PDFs."""
+    service_api, spreadsheet_id = session.service, session.spreadsheet_id
+
+    # Finished credit notes are exported as PDF into the content-addressed store shared with the invoice downloader
+    pdf_store = PdfStore()
+
+    # Knows which archive shard new notes go to and records where each one is created
+    tab_archive = TabArchive()
+
+    # Fetch data from the Google Sheet
+    with profile_stage("fetch"):
+        sheet_data = gsheet_utils.fetch_sheet_data(service_api, spreadsheet_id, "DB-CC_2", range_="A:AN")
+
+    # Process the data into a DataFrame
+    with profile_stage("build"):
+        df_raw = dataframe_utils.process_data_to_dataframe(sheet_data)
+
+    # Credit note numbers start here; each group takes the next one when it creates its note
+    note_numbers = NoteNumbers(1426, "CN-CC-{:06}")
+
+    df_raw = df_raw[df_raw['invoicing_date'] == "December 31st, 2024"]
+
+    # Net, VAT and gross per note, computed once for every group
+    with profile_stage("tax"):
+        tax_df = TaxEngine.to_sheet_values(
+            TaxEngine.compute(df_raw, group_by="email_address", amount_column="Amount", country_column="country")
+        )
+
+    # Group the DataFrame by "email_address"
+    with profile_stage("select-groups"):
+        grouped = df_raw.groupby("email_address")
+
+        # Only the eligible groups become jobs
+        jobs = []
+        for email_address, group in grouped:
+            print(f"Processing group for email_address: {email_address}")
+
+            if group["Invoice: Invoice No."].notnull().all():
+                jobs.append((email_address, (group, tax_df.loc[email_address])))
+
+    # Build the notes across the worker pool; a failing group does not stop the others
+    with profile_stage("create-notes"):
+        results = GroupScheduler().run(jobs, partial(create_credit_note, session, pdf_store, tab_archive,
+                                                     note_numbers))
+        note_numbers.report(results)
+
+    # Persist the PDF index once for the whole run
+    with profile_stage("write-back"):
+        pdf_store.save()
+
+    return results
+
+
+def main(session=None):
+    return create_credit_notes(session or SheetsSession.from_env())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,19 @@
-from google_sheet_processor import GoogleSheetUtils, DataFrameUtils
-from dotenv import load_dotenv
-import os
-import time
-import pandas as pd
+from google_sheet_processor import GoogleSheetUtils, DataFrameUtils, SheetsSession
+from tax_engine import ERROR_COLUMN, TaxEngine
+from status_tracker import STATUS_FLUSH_EVERY, StatusTracker
+from group_scheduler import GroupScheduler, NoteNumbers
+from pdf_store import PdfStore
+from tab_archive import TabArchive
+from stage_profiler import profile_stage
+from functools import partial
 from datetime import datetime
 
-# Load environment variables from .env
-load_dotenv()
-
-# Retrieve the spreadsheet ID from the .env file
-spreadsheet_id = os.getenv("SPREADSHEET_ID")
-
 gsheet_utils = GoogleSheetUtils()
 dataframe_utils = DataFrameUtils()
 
-# Get the path to the service account JSON file
-credentials = gsheet_utils.load_credentials("inv-cn-creation.json")
-
-# Build the Sheets API service
-service_api = gsheet_utils.build_service(credentials)
-
-# Fetch data from the Google Sheet
-sheet_data = gsheet_utils.fetch_sheet_data(service_api, spreadsheet_id, "InvDB", range_="A:Z")
-
-# Process the data into a DataFrame
-df_raw = dataframe_utils.process_data_to_dataframe(sheet_data)
-
-# Function to update a cell with a delay to avoid rate limits
-def update_cell_with_delay(sheet_id, cell_range, value, credentials):
-    service = gsheet_utils.build_service(credentials)
-    body = {"range": cell_range, "values": [[value]], "majorDimension": "ROWS"}
-    service.spreadsheets().values().update(
-        spreadsheetId=sheet_id,
-        range=cell_range,
-        valueInputOption="USER_ENTERED",
-        body=body
-    ).execute()
-    time.sleep(2)  # Add a delay of 2 seconds to avoid rate limits
+# Update a single cell; requests are paced by the rate limiter shared with every worker thread
+def update_cell_with_delay(session, cell_range, value):
+    gsheet_utils.update_cell_with_delay(session.service, session.spreadsheet_id, cell_range, value)
 
 # Define the cell mappings
 cell_mapping = {
@@ -62,99 +39,44 @@ multi_row_fields = {
     "Unit Price": "E21",
 }
 
-# Function to mark rows as "Done" in RINV and InvDB tabs
-def mark_as_done(sheet_id, tab_name, row_index, credentials):
-    cell_range = f"{tab_name}!Status{row_index + 2}"  # Assuming "Status" is in the correct column
-    update_cell_with_delay(sheet_id, cell_range, "Done", credentials)
+
+def rinv_row_of(invoice_data):
+    """Sheet row in RINV of the response an InvDB row came from (see RINV.py), or None when unknown."""
+    value = str(invoice_data.get("RINV Row", "")).strip()
+    return int(value) if value.isdigit() else None
+
 
 # Modified function to create and update invoices
-def create_invoice(df_raw, row_idx, last_invoice_number, credentials):
-    # Skip rows already marked as "Done"
-    if df_raw.iloc[row_idx]["Status"] == "Done":
-        print(f"Row {row_idx + 1} already processed. Skipping...")
-        return last_invoice_number
+def create_invoice(session, pdf_store, tab_archive, status_tracker, pending_products, note_numbers, row_idx,
+                   invoice_data):
+    # A row whose amounts could not be read fails here, before it takes a number or creates its tab
+    invoice_data = TaxEngine.check(invoice_data)
+    invoice_number = note_numbers.take(row_idx)
 
     # Copy the "Inv-Template" tab
-    sheet_copy_name = f"Invoice-{last_invoice_number}"
-    gsheet_utils.copy_sheet(service_api, spreadsheet_id, "Inv-Template", sheet_copy_name)
+    sheet_copy_name = f"Invoice-{invoice_number}"
+    # The note is filled in and exported where it is created: the working spreadsheet, or the
+    # current period's archive shard with SHARD_NEW_NOTES (see tab_archive.py)
+    session, new_sheet_id = tab_archive.create_note_tab(session, "Inv-Template", sheet_copy_name)
     print(f"Copied 'Inv-Template' to: {sheet_copy_name}")
 
-    # Get the data for the invoice from the dataframe (use the current row)
-    invoice_data = df_raw.iloc[row_idx]  # Get data for the current row
-
     # Fill out static fields based on the cell_mapping
     for template_cell, db_column in cell_mapping.items():
         if db_column in invoice_data.index:
             value = invoice_data[db_column]
             print(f"Updating {template_cell} in {sheet_copy_name} with value '{value}' from column '{db_column}'")
             update_cell_with_delay(
-                spreadsheet_id,
+                session,
                 f"{sheet_copy_name}!{template_cell}",
-                value,
-                credentials
+                value
             )
-    # Sum values from F21 (row 21, column 'F') and F22 (row 22, column 'F')
-    subtotal = float(invoice_data.iloc[20, invoice_data.columns.get_loc('F')]) + float(
-        invoice_data.iloc[21, invoice_data.columns.get_loc('F')])
-
-    # Assuming df_raw is the DataFrame and invoice_data is a row in that DataFrame
-    invoice_data = df_raw.iloc[row_idx]  # Get the row of interest as a Series
-
-    # Calculate subtotal: sum of F21 and F22
-    subtotal = float(invoice_data['F21']) + float(invoice_data['F22'])
-
-    # Output the subtotal value
-    print(f"Setting Subtotal (F25) to {subtotal} in {sheet_copy_name}")
-    update_cell_with_delay(
-        spreadsheet_id,
-        f"{sheet_copy_name}!F25",
-        subtotal,
-        credentials
-    )
-
-    # Handle VAT logic
-    tax_status = invoice_data["Tax Status"]
-    if tax_status == "Within Germany":
-        vat_percentage = "VAT 19%"
-        vat_amount = subtotal * 19 / 100  # Calculate VAT based on subtotal
-    else:
-        vat_percentage = "VAT 0%"
-        vat_amount = 0
-
     # Set today's date in cell F9 as the billing date
     today_date = datetime.today().strftime('%Y-%m-%d')
     print(f"Setting billing date (F9) in {sheet_copy_name} to {today_date}")
     update_cell_with_delay(
-        spreadsheet_id,
+        session,
         f"{sheet_copy_name}!F9",
-        today_date,
-        credentials
-    )
-
-    # Handle VAT logic
-    tax_status = invoice_data["Tax Status"]
-    if tax_status == "Within Germany":
-        vat_percentage = "VAT 19%"
-        vat_amount = float(invoice_data["F25"]) * 19 / 100  # Assuming amount is in F25
-    else:
-        vat_percentage = "VAT 0%"
-        vat_amount = 0
-
-    # Update VAT percentage and amount
-    print(f"Setting VAT percentage (A26) to {vat_percentage} in {sheet_copy_name}")
-    update_cell_with_delay(
-        spreadsheet_id,
-        f"{sheet_copy_name}!A26",
-        vat_percentage,
-        credentials
-    )
-
-    print(f"Setting VAT amount (F25) to {vat_amount} in {sheet_copy_name}")
-    update_cell_with_delay(
-        spreadsheet_id,
-        f"{sheet_copy_name}!F26",
-        vat_amount,
-        credentials
+        today_date
     )
 
     # Fill out multi-row fields (e.g., Product, Quantity, Unit Price)
@@ -163,23 +85,109 @@ def create_invoice(df_raw, row_idx, last_invoice_number, credentials):
             value = invoice_data[field]
             print(f"Updating {start_cell} in {sheet_copy_name} with value '{value}' for {field}")
             update_cell_with_delay(
-                spreadsheet_id,
+                session,
                 f"{sheet_copy_name}!{start_cell}",
-                value,
-                credentials
+                value
             )
 
-    # Mark the row as "Done" in both RINV and InvDB tabs
-    mark_as_done(spreadsheet_id, "RINV", row_idx, credentials)
-    mark_as_done(spreadsheet_id, "InvDB", row_idx, credentials)
-
-    # Return the next invoice number
-    return generate_invoice_number(last_invoice_number)
-
-# Start with the first invoice number
-last_invoice_number = "RE-240171"
-
-# Create invoices, updating the invoice number sequentially for each row in the 'InvDB' tab
-for row_idx in range(len(df_raw)):  # Loop through each row in the DataFrame
-    print(f"Processing row {row_idx + 1}...")
-    last_invoice_number = create_invoice(df_raw, row_idx, last_invoice_number, credentials)
\ No newline at end of file
+    # Export the finished tab as PDF; identical bytes are only stored once
+    pdf_bytes = gsheet_utils.export_sheet_pdf(session.service, session.credentials, session.spreadsheet_id,
+                                              new_sheet_id)
+    if pdf_bytes:  # nothing was created in a dry run
+        pdf_store.add_bytes(pdf_bytes, f"{sheet_copy_name}.pdf")
+        print(f"Stored {sheet_copy_name}.pdf ({len(pdf_bytes)} bytes)")
+
+    # Queue the row to be marked as "Done" once the invoice is complete. InvDB has one row per
+    # product and RINV one per response, so the response is marked with its last pending product.
+    rinv_row = rinv_row_of(invoice_data)
+    with status_tracker.lock:
+        products = pending_products.get(rinv_row, set())
+        products.discard(row_idx)
+        response_done = rinv_row is not None and not products
+        status_tracker.mark(row_idx, ["InvDB"], sheet_rows={"RINV": rinv_row} if response_done else None)
+
+    return sheet_copy_name
+
+
+def create_invoices(session):
+    """Create an invoice for every pending InvDB row, store the PDFs and mark the rows "Done"."""
+    service_api, spreadsheet_id = session.service, session.spreadsheet_id
+
+    # Finished invoices are exported as PDF into the content-addressed store shared with the invoice downloader
+    pdf_store = PdfStore()
+
+    # Knows which archive shard new notes go to and records where each one is created
+    tab_archive = TabArchive()
+
+    # Fetch data from the Google Sheet
+    with profile_stage("fetch"):
+        sheet_data = gsheet_utils.fetch_sheet_data(service_api, spreadsheet_id, "InvDB", range_="A:Z")
+
+    # Process the data into a DataFrame
+    with profile_stage("build"):
+        df_raw = dataframe_utils.process_data_to_dataframe(sheet_data)
+
+    # Subtotal and VAT for every invoice row, computed once up front
+    with profile_stage("tax"):
+        tax_df = TaxEngine.to_sheet_values(
+            # Invoices charge VAT by tax status alone ("Within Germany"), not by country
+            TaxEngine.compute(df_raw, group_by=None, amount_column="Unit Price", quantity_column="Quantity",
+                              tax_status_column="Tax Status")
+        )
+        tax_columns = ["Subtotal", "Vat Percentage", "Vat Amount", ERROR_COLUMN]
+        df_raw = df_raw.drop(columns=tax_columns, errors="ignore").join(tax_df.rename(columns={
+            "net_total": "Subtotal",
+            "vat_percentage": "Vat Percentage",
+            "vat_amount": "Vat Amount",
+        })[tax_columns])
+
+    # Processed rows are marked "Done" in RINV and InvDB in bulk at the end of the run, and every
+    # STATUS_FLUSH_EVERY invoices when that is set
+    status_tracker = StatusTracker(service_api, spreadsheet_id, ["RINV", "InvDB"], flush_every=STATUS_FLUSH_EVERY)
+
+    # Invoice numbers start here; each row takes the next one when it creates its invoice
+    note_numbers = NoteNumbers(240171, "RE-{:06}")
+
+    # Every pending row of the 'InvDB' tab becomes a job
+    with profile_stage("select-rows"):
+        jobs = []
+        # Pending InvDB rows of every RINV response: {RINV sheet row: {InvDB row index}}
+        pending_products = {}
+        for row_idx in range(len(df_raw)):  # Loop through each row in the DataFrame
+            print(f"Processing row {row_idx + 1}...")
+            # Skip rows already marked as "Done"
+            if df_raw.iloc[row_idx]["Status"] == "Done":
+                print(f"Row {row_idx + 1} already processed. Skipping...")
+                continue
+            jobs.append((row_idx, (df_raw.iloc[row_idx],)))
+            rinv_row = rinv_row_of(df_raw.iloc[row_idx])
+            if rinv_row is not None:
+                pending_products.setdefault(rinv_row, set()).add(row_idx)
+        if jobs and len(pending_products) == 0:
+            print('InvDB has no "RINV Row" values; only InvDB rows are marked "Done". '
+                  'Rebuild InvDB (run inv --rebuild) to add them.')
+
+    # Create the invoices across the worker pool; a failing row does not stop the others
+    with profile_stage("create-invoices"):
+        results = GroupScheduler().run(
+            jobs, partial(create_invoice, session, pdf_store, tab_archive, status_tracker, pending_products,
+                          note_numbers)
+        )
+        note_numbers.report(results)
+
+    # Persist the PDF index once for the whole run
+    with profile_stage("write-back"):
+        pdf_store.save()
+
+        # Write the remaining "Done" statuses in one request
+        status_tracker.flush()
+
+    return results
+
+
+def main(session=None):
+    return create_invoices(session or SheetsSession.from_env())
+
+
+if __name__ == "__main__":
+    main()
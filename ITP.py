@@ -1,69 +1,165 @@
-from google_sheet_processor import GoogleSheetUtils, DataFrameUtils
-from dotenv import load_dotenv
-import os
-import pandas as pd
-
-# Load environment variables
-load_dotenv()
-spreadsheet_id = os.getenv("SPREADSHEET_ID")
+from google_sheet_processor import GoogleSheetUtils, DataFrameUtils, SheetsSession
+from salesforce_source import refresh_trip_index
+from stage_profiler import profile_stage
+from submitter_profiles import SubmitterProfiles
+from sheet_mirror import SheetMirror, quote
+import sys
 
 gsheet_utils = GoogleSheetUtils()
 dataframe_utils = DataFrameUtils()
 
-# Load service account credentials and initialize Sheets API
-credentials = gsheet_utils.load_credentials("inv-cn-creation.json")
-service_api = gsheet_utils.build_service(credentials)
-
-### **Step 1: Fetch Data from Performance Tab** ###
-performance_data = gsheet_utils.fetch_sheet_data(service_api, spreadsheet_id, "Performance", range_="A4:I")
-df_performance = dataframe_utils.process_data_to_dataframe(performance_data)
-
-# Standardize column names
-df_performance.columns = df_performance.columns.str.strip().str.lower().str.replace(" ", "_")
-
-# Fetch data from "RITP" tab
-ritp_data = gsheet_utils.fetch_sheet_data(service_api, spreadsheet_id, "RITP", range_="A:AA")
-df_ritp = dataframe_utils.process_data_to_dataframe(ritp_data)
-
-# Standardize column names
-df_ritp.columns = df_ritp.columns.str.strip().str.lower().str.replace(" ", "_")
-
-# Ensure 'agent_code' exists in both DataFrames before merging
-if 'agent_code' not in df_performance.columns or 'agent_code' not in df_ritp.columns:
-    raise ValueError("Missing 'agent_code' column in either Performance or RITP tab.")
-
-# Select required columns from RITP
+# Columns taken from the RITP form responses for every agent
 columns_needed = [
     'email_address', 'location', 'address_line_1', 'city', 'post_code/zip_code', 'country',
     'file_of_contract', 'signed_date', 'tax_status', 'taxpayer_identification_number_(tin)',
     'vat_id', 'iban', 'bic', 'account_number', 'swift', 'sales_agent', 'agent_code'
 ]
 
-df_ritp_filtered = df_ritp[columns_needed].copy()
-
-# Merge based on 'agent_code'
-df_db_updated = df_performance.merge(df_ritp_filtered, on="agent_code", how="left")
-
-### **Step 2: Fetch "Trip" Column from "Opportunities ID + Invoice ID" Tab** ###
-opportunities_data = gsheet_utils.fetch_sheet_data(service_api, spreadsheet_id, "Opportunties ID + Invoice ID", range_="A2:R")
-df_opportunities = dataframe_utils.process_data_to_dataframe(opportunities_data)
-
-# Standardize column names
-df_opportunities.columns = df_opportunities.columns.str.strip().str.lower().str.replace(" ", "_")
-
-# Ensure required columns exist
-if "opportunity_id" not in df_db_updated.columns or "opportunity_id" not in df_opportunities.columns:
-    raise ValueError("Missing 'Opportunity ID' column in either DB or Opportunities tab.")
 
-# Select only the "Trip" column and drop duplicates
-df_opportunities_filtered = df_opportunities[["opportunity_id", "trip"]].drop_duplicates(subset=["opportunity_id"], keep="first")
+def join_performance_ritp(mirror):
+    """
+    The Performance x RITP merge on agent_code as one SQL query against the local mirror.
+
+    Returns the same rows and columns as the pandas merge: missing cells read "N/A", unmatched
+    RITP columns are empty, and columns both tabs have get the _x/_y suffixes.
+    """
+    performance_columns = mirror.columns("Performance") or []
+    ritp_columns = mirror.columns("RITP") or []
+    if 'agent_code' not in performance_columns or 'agent_code' not in ritp_columns:
+        raise ValueError("Missing 'agent_code' column in either Performance or RITP tab.")
+    missing = [column for column in columns_needed if column not in ritp_columns]
+    if missing:
+        raise KeyError(f"Columns missing from the RITP tab: {missing}")
+
+    ritp_needed = [column for column in columns_needed if column != 'agent_code']
+    selected = []
+    for column in performance_columns:
+        name = f"{column}_x" if column in ritp_needed else column
+        selected.append(f"COALESCE(p.{quote(column)}, 'N/A') AS {quote(name)}")
+    for column in ritp_needed:
+        name = f"{column}_y" if column in performance_columns else column
+        selected.append(f"CASE WHEN r._row IS NULL THEN NULL ELSE COALESCE(r.{quote(column)}, 'N/A') END AS {quote(name)}")
+    selected.append(f"{'r.timestamp' if 'timestamp' in ritp_columns else 'NULL'} AS _submitted_at")
+
+    return mirror.query_frame(
+        f"SELECT {', '.join(selected)} FROM performance p "
+        f"LEFT JOIN ritp r ON r.agent_code = p.agent_code ORDER BY p._row, r._row"
+    )
+
+
+def build_db(session, mirror=False):
+    """
+    Merge the Performance tab with the RITP partner details and the opportunity trips, then write DB.
+
+    With mirror, the two tabs are synced into the local SQLite mirror (see sheet_mirror.py) and
+    joined there, so only the joined rows are loaded instead of both tabs.
+    """
+    if mirror:
+        with profile_stage("sync-mirror"):
+            sheet_mirror = SheetMirror()
+            sheet_mirror.sync(session, ["Performance", "RITP"])
+        with profile_stage("merge"):
+            df_db_updated = join_performance_ritp(sheet_mirror)
+
+        # Keep the submitter profiles up to date with the joined RITP rows, then fill in the details
+        # returning partners left blank from their latest earlier submission
+        with profile_stage("submitter-profiles"):
+            profiles = SubmitterProfiles()
+            profiles.record(df_db_updated, email_column="email_address", timestamp_column="_submitted_at")
+            profiles.fill(df_db_updated, email_column="email_address")
+            df_db_updated = df_db_updated.drop(columns=["_submitted_at"])
+    else:
+        df_db_updated = join_performance_ritp_sheets(session)
+
+    return add_opportunity_trips(session, df_db_updated)
+
+
+def join_performance_ritp_sheets(session):
+    """The Performance x RITP merge on agent_code, with both tabs read from Sheets."""
+    service_api, spreadsheet_id = session.service, session.spreadsheet_id
+
+    ### **Step 1: Fetch Data from Performance Tab** ###
+    with profile_stage("fetch"):
+        performance_data = gsheet_utils.fetch_sheet_data(service_api, spreadsheet_id, "Performance", range_="A4:I")
+    with profile_stage("build"):
+        df_performance = dataframe_utils.process_data_to_dataframe(performance_data)
+
+        # Standardize column names
+        df_performance.columns = df_performance.columns.str.strip().str.lower().str.replace(" ", "_")
+
+    # Fetch data from "RITP" tab
+    with profile_stage("fetch"):
+        ritp_data = gsheet_utils.fetch_sheet_data(service_api, spreadsheet_id, "RITP", range_="A:AA")
+    with profile_stage("build"):
+        df_ritp = dataframe_utils.process_data_to_dataframe(ritp_data)
+
+        # Standardize column names
+        df_ritp.columns = df_ritp.columns.str.strip().str.lower().str.replace(" ", "_")
+
+    # Ensure 'agent_code' exists in both DataFrames before merging
+    if 'agent_code' not in df_performance.columns or 'agent_code' not in df_ritp.columns:
+        raise ValueError("Missing 'agent_code' column in either Performance or RITP tab.")
+
+    # Select required columns from RITP
+    with profile_stage("merge"):
+        df_ritp_filtered = df_ritp[columns_needed].copy()
+
+        # Merge based on 'agent_code'
+        df_db_updated = df_performance.merge(df_ritp_filtered, on="agent_code", how="left")
+
+    # Keep the submitter profiles up to date with the RITP rows, then fill in the details returning
+    # partners left blank from their latest earlier submission
+    with profile_stage("submitter-profiles"):
+        profiles = SubmitterProfiles()
+        profiles.record(df_ritp, email_column="email_address", timestamp_column="timestamp")
+        profiles.fill(df_db_updated, email_column="email_address")
+    return df_db_updated
+
+
+def add_opportunity_trips(session, df_db_updated):
+    """Add the trip of every opportunity and write the result to the DB tab."""
+    service_api, spreadsheet_id = session.service, session.spreadsheet_id
+
+    ### **Step 2: Fetch "Trip" Column from "Opportunities ID + Invoice ID" Tab** ###
+    if "opportunity_id" not in df_db_updated.columns:
+        raise ValueError("Missing 'Opportunity ID' column in the Performance tab.")
+
+    # Look up only these opportunities in the trip index (fed from Salesforce when configured,
+    # otherwise from the exported tab)
+    with profile_stage("fetch-reference"):
+        trip_index = refresh_trip_index("opportunities", gsheet_utils, service_api, spreadsheet_id)
+        df_opportunities = trip_index.opportunity_frame("opportunities", df_db_updated["opportunity_id"])
+
+    # Standardize column names
+    df_opportunities.columns = df_opportunities.columns.str.strip().str.lower().str.replace(" ", "_")
+
+    # Ensure required columns exist
+    if "opportunity_id" not in df_opportunities.columns:
+        raise ValueError("Missing 'Opportunity ID' column in the Opportunities tab.")
+
+    # Select only the "Trip" column and drop duplicates
+    with profile_stage("merge"):
+        df_opportunities_filtered = df_opportunities[["opportunity_id", "trip"]].drop_duplicates(subset=["opportunity_id"], keep="first")
 
-# Merge based on 'opportunity_id'
-df_db_updated = df_db_updated.merge(df_opportunities_filtered, on="opportunity_id", how="left")
+        # Merge based on 'opportunity_id'
+        df_db_updated = df_db_updated.merge(df_opportunities_filtered, on="opportunity_id", how="left")
+
+    # Replace NaN values with empty strings
+    df_db_updated.fillna("", inplace=True)
+
+    # Upload the updated data back to Google Sheets. DB follows Performance, so it is rewritten
+    # whole; RITP appends its rows to a tab of its own (RITP.RITP_DB_TAB) that this never touches.
+    with profile_stage("write-back"):
+        gsheet_utils.update_sheet_with_dataframe(service_api, df_db_updated, spreadsheet_id, "DB")
+    print("Updated the DB tab successfully with RITP and Opportunities data.")
+    return df_db_updated
+
+
+def main(session=None, mirror=None):
+    if mirror is None:
+        mirror = "--mirror" in sys.argv
+    return build_db(session or SheetsSession.from_env(), mirror=mirror)
 
-# Replace NaN values with empty strings
-df_db_updated.fillna("", inplace=True)
 
-# Upload the updated data back to Google Sheets
-gsheet_utils.update_sheet_with_dataframe(service_api, df_db_updated, spreadsheet_id, "DB")
-print("Updated the DB tab successfully with RITP and Opportunities data.")
+if __name__ == "__main__":
+    main()
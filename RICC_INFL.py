@@ -1,85 +1,129 @@
-from google_sheet_processor import GoogleSheetUtils, DataFrameUtils
-from dotenv import load_dotenv
-import os
-import pandas as pd
-import re
-
-# Load environment variables
-load_dotenv()
-
-# Retrieve the spreadsheet ID
-spreadsheet_id = os.getenv("SPREADSHEET_ID")
+from google_sheet_processor import GoogleSheetUtils, DataFrameUtils, SheetsSession
+from salesforce_source import refresh_trip_index
+from form_watermark import FormWatermark
+from trip_index import merge_on_trip
+from stage_profiler import profile_iter, profile_stage
+import sys
 
 gsheet_utils = GoogleSheetUtils()
 dataframe_utils = DataFrameUtils()
 
-# Load credentials and initialize service
-credentials = gsheet_utils.load_credentials("inv-cn-creation.json")
-service_api = gsheet_utils.build_service(credentials)
-
-# Fetch data from "RICC" tab
-ricc_data = gsheet_utils.fetch_sheet_data(service_api, spreadsheet_id, "RICC", range_="A:BJ")
-ricc_df = dataframe_utils.process_data_to_dataframe(ricc_data)
-
-# Check which columns have values
-ricc_df = ricc_df.loc[:, ricc_df.notna().any(axis=0)]
-print(f"Columns with values: {ricc_df.columns.tolist()}")
-
-# Remove duplicate columns
-ricc_df = ricc_df.loc[:, ~ricc_df.columns.duplicated()]
-
-# Save cleaned data to "DB-INFL"
-gsheet_utils.update_sheet_with_dataframe(service_api, ricc_df, spreadsheet_id, "DB-INFL")
-print("Updated DB-INFL with cleaned data.")
-
-# Fetch data from "SF-INFL" tab
-sf_data = gsheet_utils.fetch_sheet_data(service_api, spreadsheet_id, "SF-INFL", range_="A2:F")
-
-# Convert to DataFrame
-sf_df = dataframe_utils.process_data_to_dataframe(sf_data)
-
-# Check the column names after setting the header
-print(f"SF-INFL columns after setting header: {sf_df.columns.tolist()}")
-
-# Standardize column names for matching
-sf_df.rename(columns={"Invoice: Trip Detail: Trip Confirmation: Trip": "trip_id"}, inplace=True)
-ricc_df.rename(columns={"Trip ID": "trip_id"}, inplace=True)
-
-# Check the column names after renaming
-print(f"SF-INFL columns after renaming: {sf_df.columns.tolist()}")
-
-
-
-# Merge SF-INFL data into DB-INFL
-db_infl_combined = ricc_df.merge(
-    sf_df,
-    on="trip_id",
-    how="left",
-    suffixes=("", "_sf")
-)
-
-# Expand rows for multiple "Invoice: Invoice No." values
-def expand_invoice_rows(row):
-    invoice_nos = str(row["Invoice: Invoice No."]).split(",")  # Split on commas
-    if len(invoice_nos) == 1:
-        return [row]
-    expanded = []
-    for invoice in invoice_nos:
-        new_row = row.copy()
-        new_row["Invoice: Invoice No."] = invoice.strip()
-        expanded.append(new_row)
-    return expanded
-
-expanded_rows = []
-for _, row in db_infl_combined.iterrows():
-    expanded_rows.extend(expand_invoice_rows(row))
-
-db_infl_expanded = pd.DataFrame(expanded_rows)
-
-# Remove duplicates and fill missing values
-db_infl_expanded.drop_duplicates(subset=["trip_id", "Invoice: Invoice No."], inplace=True)
-db_infl_expanded.fillna("", inplace=True)
 
-# Update "DB-INFL" with final data
-gsheet_utils.update_sheet_with_dataframe(service_api, db_infl_expanded, spreadsheet_id, "DB-INFL")
-print("Updated DB-INFL with matched and expanded data.")
+def build_db_infl(session, incremental=False, rebuild=False):
+    """
+    Clean the RICC form responses, merge them with the SF-INFL data and append the new rows to DB-INFL.
+
+    A full run reads the tab in fixed row windows (see GoogleSheetUtils.iter_sheet_windows) and
+    merges and appends one window at a time, so memory stays flat as the tab grows. The DB-INFL
+    fingerprints keep a row that shows up in two windows from being written twice. RICC is wide
+    and mostly empty, so the windows are read column by column and built without transposing.
+    Every window keeps every RICC header column, so DB-INFL gets the same layout whatever the
+    window size.
+
+    With incremental, only the responses submitted since the last incremental run are processed
+    (see form_watermark.py). Rows already in DB-INFL are never written again; rebuild clears the
+    tab and writes every row.
+
+    Returns:
+        int: Number of rows appended to DB-INFL.
+    """
+    service_api, spreadsheet_id = session.service, session.spreadsheet_id
+    watermark = FormWatermark()
+    mark = None
+
+    # Fetch data from "RICC" tab
+    if incremental:
+        with profile_stage("fetch"):
+            header, new_rows, mark = watermark.read_new_rows(
+                lambda range_: gsheet_utils.fetch_sheet_data(service_api, spreadsheet_id, "RICC", range_=range_),
+                spreadsheet_id, "RICC", "A", "BJ"
+            )
+            if not new_rows:
+                print("No new RICC responses; DB-INFL is up to date.")
+                return 0
+        with profile_stage("build"):
+            chunks = [dataframe_utils.process_data_to_dataframe([header] + new_rows)]
+    else:
+        chunks = profile_iter("fetch", dataframe_utils.iter_dataframes(
+            gsheet_utils.iter_sheet_windows(service_api, spreadsheet_id, "RICC", "A", "BJ", major_dimension="COLUMNS"),
+            major_dimension="COLUMNS"
+        ))
+
+    # Bring the SF-INFL trip index up to date once (fed from Salesforce when configured, otherwise
+    # from the "SF-INFL" tab); every window then only looks its trips up
+    with profile_stage("fetch-reference"):
+        trip_index = refresh_trip_index("sf_infl", gsheet_utils, service_api, spreadsheet_id)
+
+    written = 0
+    for chunk_number, ricc_df in enumerate(chunks):
+        db_infl_expanded = build_db_infl_rows(ricc_df, trip_index)
+
+        # Append the rows DB-INFL does not have yet, keyed like the dedupe; a rebuild clears it
+        # before the first window
+        with profile_stage("write-back"):
+            written += gsheet_utils.append_new_rows(service_api, db_infl_expanded, spreadsheet_id, "DB-INFL",
+                                                    key_columns=["trip_id", "Invoice: Invoice No."],
+                                                    rebuild=rebuild and chunk_number == 0)
+
+    # Advance only once the rows are written; a dry run writes nothing, so keeps the watermark
+    if incremental and not GoogleSheetUtils.dry_run:
+        watermark.commit(mark)
+    elif rebuild and not GoogleSheetUtils.dry_run:
+        # The next incremental run starts over; the fingerprints skip what is already written
+        watermark.reset(spreadsheet_id, "RICC")
+    print("Updated DB-INFL with matched and expanded data.")
+    return written
+
+
+def build_db_infl_rows(ricc_df, trip_index):
+    """
+    Turn one chunk of RICC responses into DB-INFL rows: merge SF-INFL and expand the invoices.
+
+    Args:
+        ricc_df (pd.DataFrame): Responses, as process_data_to_dataframe or columns_to_dataframe
+            builds them, with every RICC header column.
+        trip_index (TripIndex): SF-INFL index, already refreshed for this run.
+    """
+    print(f"RICC columns: {ricc_df.columns.tolist()}")
+
+    # Remove duplicate columns
+    with profile_stage("drop-duplicate-columns"):
+        ricc_df = ricc_df.loc[:, ~ricc_df.columns.duplicated()]
+
+    # Standardize column names for matching
+    ricc_df = ricc_df.rename(columns={"Trip ID": "trip_id"})
+
+    # Look up the SF-INFL rows of these trips in the trip index
+    with profile_stage("lookup-reference"):
+        sf_df = trip_index.lookup_frame("sf_infl", ricc_df["trip_id"])
+
+    # Check the column names of the matched rows
+    print(f"SF-INFL columns: {sf_df.columns.tolist()}")
+
+    # Merge SF-INFL data into DB-INFL on the normalized trip ID; trip_id keeps the form's spelling
+    with profile_stage("merge"):
+        db_infl_combined = merge_on_trip(ricc_df, sf_df, "trip_id")
+
+    # Expand rows for multiple "Invoice: Invoice No." values
+    with profile_stage("expand"):
+        db_infl_expanded = dataframe_utils.expand_comma_separated(db_infl_combined, "Invoice: Invoice No.")
+
+    # Remove duplicates and fill missing values
+    with profile_stage("dedupe"):
+        db_infl_expanded = dataframe_utils.drop_duplicate_rows(db_infl_expanded, ["trip_id", "Invoice: Invoice No."])
+        db_infl_expanded.fillna("", inplace=True)
+    return db_infl_expanded
+
+
+def main(session=None, incremental=None, rebuild=None):
+    if incremental is None:
+        incremental = "--incremental" in sys.argv
+    if rebuild is None:
+        rebuild = "--rebuild" in sys.argv
+    # A rebuild always reads every response
+    return build_db_infl(session or SheetsSession.from_env(), incremental=incremental and not rebuild,
+                         rebuild=rebuild)
+
+
+if __name__ == "__main__":
+    main()
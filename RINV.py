@@ -1,94 +1,177 @@
-import gspread
-import pandas as pd
-from oauth2client.service_account import ServiceAccountCredentials
-
-def clean_rinv_to_invdb():
-    # Authenticate and connect to Google Sheets
-    scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-    creds = ServiceAccountCredentials.from_json_keyfile_name('inv-cn-creation.json', scope)
-    client = gspread.authorize(creds)
-
-    # Open the sheet and get data
-    spreadsheet = client.open('Inv/CN Creation')
-    rinv_sheet = spreadsheet.worksheet('RINV')
-    invdb_sheet = spreadsheet.worksheet('InvDB')
-
-    # Get the raw data from the worksheet
-    rinv_data = rinv_sheet.get_all_values()
-
-    # Define the headers manually
-    headers = [
-        'Timestamp', 'Email Address', 'First Name', 'Last Name', 'Title/Position',
-        'Which entity should generate the invoice?', 'Customer Name', 'Address Line 1',
-        'City', 'Post Code/ZIP Code', 'Country', "Customer's Email Address",
-        'Tax Status', 'Taxpayer Identification Number (TIN)', 'VAT ID',
-        'Name of service / product', 'Service Period', 'Quantity', 'Price per quantity', 'Currency',
-        'More than one service or products?', 'Name of service / product.1', 'Service Period.1',
-        'Quantity.1', 'Price per quantity.1', 'Currency.1', 'Status'
-    ]
-
-    # Convert the raw data into a DataFrame with the manually defined headers
-    # Convert the raw data into a DataFrame with the manually defined headers
-    rinv_df = pd.DataFrame(rinv_data[1:], columns=headers)  # Skip the header row in the raw data
-
-    # Combine First Name and Last Name into Requester Name
-    rinv_df['Requester Name'] = rinv_df['First Name'] + ' ' + rinv_df['Last Name']
-
-    # Combine City and Post Code/ZIP Code into City Postal
-    rinv_df['City Postal'] = rinv_df['City'] + ' ' + rinv_df['Post Code/ZIP Code']
-
-    # Prepare the main part of the DataFrame for InvDB
-    base_columns = [
-        'Timestamp', 'Email Address', 'Requester Name', 'Title/Position',
-        'Which entity should generate the invoice?', 'Customer Name', 'Address Line 1',
-        'City Postal', 'Country', "Customer's Email Address", 'Tax Status',
-        'Taxpayer Identification Number (TIN)', 'VAT ID', 'Status'
-    ]
-    invdb_df = rinv_df[base_columns].copy()
-
-    # Rename columns to match InvDB format
-    invdb_df.rename(columns={
-        'Which entity should generate the invoice?': 'Entity'
-    }, inplace=True)
-
-    # Handle Single Service Data
-    single_service_df = rinv_df[rinv_df['More than one service or products?'] != 'Yes'][[
-        'Timestamp', 'Name of service / product', 'Service Period', 'Quantity', 'Price per quantity', 'Currency' , 'Status'
-    ]]
-
-    # Handle Multi-Service Data
-    multi_service_base = rinv_df[rinv_df['More than one service or products?'] == 'Yes']
-
-    additional_products = multi_service_base[[
-        'Timestamp', 'Name of service / product.1', 'Service Period.1', 'Quantity.1', 'Price per quantity.1', 'Currency.1'
-    ]].rename(columns={
-        'Name of service / product.1': 'Name of service / product',
-        'Service Period.1': 'Service Period',
-        'Quantity.1': 'Quantity',
-        'Price per quantity.1': 'Price per quantity',
-        'Currency.1': 'Currency'
-    })
-
-    # Combine Single and Multi-Service Data
-    product_df = pd.concat([single_service_df, additional_products], ignore_index=True)
-
-    # Rename product-related columns to match the desired output
-    product_df.rename(columns={
-        'Name of service / product': 'Product',
-        'Price per quantity': 'Unit Price'
-    }, inplace=True)
-
-    # Merge product data with base invoice details
-    final_df = pd.merge(
-        invdb_df,
-        product_df,
-        on='Timestamp',
-        how='outer'
-    )
-
-    # Write the cleaned data back to InvDB in Google Sheets
-    invdb_sheet.clear()
-    invdb_sheet.update([final_df.columns.values.tolist()] + final_df.fillna('').values.tolist())
-
-# Run the function
-clean_rinv_to_invdb()
+from form_watermark import FormWatermark
+from google_sheet_processor import GoogleSheetUtils, SheetsSession
+from stage_profiler import profile_stage
+import re
+import sys
+
+gsheet_utils = GoogleSheetUtils()
+
+# Fields of one product; the form repeats them for every further product, so pandas-style
+# numbering tells the groups apart ("Quantity", "Quantity.1", "Quantity.2", ...)
+PRODUCT_FIELDS = ['Name of service / product', 'Service Period', 'Quantity', 'Price per quantity', 'Currency']
+
+# Columns read from RINV; wide enough for further product groups added to the form
+RINV_COLUMNS = ('A', 'AZ')
+
+# Synthetic key of one form response (Timestamps are not unique) and the product number within it
+SUBMISSION_ID = '_submission'
+PRODUCT_NUMBER = '_product'
+
+# Columns that identify an InvDB row, for the append-only write
+INVDB_KEY = ['Timestamp', 'Email Address', 'Product No.']
+
+
+def unique_headers(header):
+    """The form header with repeated names numbered the way pandas numbers them: "Quantity", "Quantity.1", ..."""
+    seen, columns = {}, []
+    for name in header:
+        name = str(name).strip()
+        columns.append(name if name not in seen else f"{name}.{seen[name]}")
+        seen[name] = seen.get(name, 0) + 1
+    return columns
+
+
+def product_numbers(columns):
+    """Numbers of the product column groups present: 0 for the unnumbered first product, then 1, 2, ..."""
+    numbers = {0} if any(field in columns for field in PRODUCT_FIELDS) else set()
+    for column in columns:
+        match = re.fullmatch(r'(.+)\.(\d+)', column)
+        if match and match.group(1) in PRODUCT_FIELDS:
+            numbers.add(int(match.group(2)))
+    return sorted(numbers)
+
+
+def products_to_long(rinv_df):
+    """
+    Melt every product column group into one row per (submission, product) in a single wide_to_long pass.
+
+    Returns:
+        pd.DataFrame: SUBMISSION_ID, PRODUCT_NUMBER and PRODUCT_FIELDS, in form order.
+    """
+    import pandas as pd
+
+    wide = {SUBMISSION_ID: rinv_df[SUBMISSION_ID]}
+    for number in product_numbers(rinv_df.columns):
+        for field in PRODUCT_FIELDS:
+            column = field if number == 0 else f"{field}.{number}"
+            wide[f"{field}.{number}"] = rinv_df[column] if column in rinv_df.columns else ""
+    long_df = pd.wide_to_long(pd.DataFrame(wide), stubnames=PRODUCT_FIELDS, i=SUBMISSION_ID, j=PRODUCT_NUMBER,
+                              sep='.', suffix=r'\d+')
+    return long_df.reset_index().sort_values([SUBMISSION_ID, PRODUCT_NUMBER], kind='stable')
+
+
+def clean_rinv_to_invdb(session, incremental=False, rebuild=False):
+    """
+    Reshape the RINV form responses into one InvDB row per product.
+
+    The first product of every response is kept; the further products only when the response
+    answered "Yes" to "More than one service or products?" and filled them in.
+
+    With incremental, only the responses submitted since the last run are processed (see
+    form_watermark.py). Products already in InvDB are never written again; rebuild clears the
+    tab and writes every row.
+    """
+    import pandas as pd
+
+    service_api, spreadsheet_id = session.service, session.spreadsheet_id
+
+    # Get the raw data from the "RINV" tab
+    watermark = FormWatermark()
+    mark = None
+    with profile_stage("fetch"):
+        if incremental:
+            header, new_rows, mark = watermark.read_new_rows(
+                lambda range_: gsheet_utils.fetch_sheet_data(service_api, spreadsheet_id, "RINV", range_=range_),
+                spreadsheet_id, 'RINV', *RINV_COLUMNS
+            )
+            if not new_rows:
+                print("No new RINV responses; InvDB is up to date.")
+                return None
+            rinv_data = [header] + new_rows
+        else:
+            rinv_data = gsheet_utils.fetch_sheet_data(service_api, spreadsheet_id, "RINV",
+                                                      range_=":".join(RINV_COLUMNS))
+            if rinv_data:
+                # Every response was read, so the next incremental run starts after the last one
+                mark = watermark.mark_after(spreadsheet_id, 'RINV', rinv_data[0], rinv_data[1:])
+        if not rinv_data:
+            raise ValueError("No data available to process into DataFrame.")
+
+    # Name the columns after the form header; repeated product questions get .1, .2, ...
+    with profile_stage("build"):
+        headers = unique_headers(rinv_data[0])
+        width = len(headers)
+        # The API leaves out empty cells at the end of a row
+        rinv_df = pd.DataFrame([row[:width] + [''] * (width - len(row)) for row in rinv_data[1:]], columns=headers)
+        rinv_df[SUBMISSION_ID] = range(len(rinv_df))
+
+        # Sheet row of every response, so INV_TEMPLATE can mark it "Done" in RINV; InvDB has one
+        # row per product, so its own row numbers do not line up with RINV's
+        rinv_df['RINV Row'] = mark['sheet_rows'] if incremental else range(2, 2 + len(rinv_df))
+
+        # Combine First Name and Last Name into Requester Name
+        rinv_df['Requester Name'] = rinv_df['First Name'] + ' ' + rinv_df['Last Name']
+
+        # Combine City and Post Code/ZIP Code into City Postal
+        rinv_df['City Postal'] = rinv_df['City'] + ' ' + rinv_df['Post Code/ZIP Code']
+
+        # Prepare the main part of the DataFrame for InvDB
+        base_columns = [
+            'Timestamp', 'Email Address', 'Requester Name', 'Title/Position',
+            'Which entity should generate the invoice?', 'Customer Name', 'Address Line 1',
+            'City Postal', 'Country', "Customer's Email Address", 'Tax Status',
+            'Taxpayer Identification Number (TIN)', 'VAT ID', 'Status', 'RINV Row'
+        ]
+        invdb_df = rinv_df[[SUBMISSION_ID] + base_columns].copy()
+
+        # Rename columns to match InvDB format
+        invdb_df.rename(columns={
+            'Which entity should generate the invoice?': 'Entity'
+        }, inplace=True)
+
+    # One row per product, for any number of product groups on the form
+    with profile_stage("reshape-products"):
+        product_df = products_to_long(rinv_df)
+
+        more_products = rinv_df.set_index(SUBMISSION_ID)['More than one service or products?'] == 'Yes'
+        filled_in = product_df[PRODUCT_FIELDS].fillna('').astype(str).apply(lambda column: column.str.strip()).ne('')
+        product_df = product_df[(product_df[PRODUCT_NUMBER] == 0)
+                                | (product_df[SUBMISSION_ID].map(more_products) & filled_in.any(axis=1))]
+
+        # Rename product-related columns to match the desired output; products are numbered from 1
+        product_df = product_df.assign(**{PRODUCT_NUMBER: product_df[PRODUCT_NUMBER] + 1})
+        product_df = product_df.rename(columns={
+            PRODUCT_NUMBER: 'Product No.',
+            'Name of service / product': 'Product',
+            'Price per quantity': 'Unit Price'
+        })
+
+    # Attach the invoice details to every product of the same submission
+    with profile_stage("merge"):
+        final_df = invdb_df.merge(product_df, on=SUBMISSION_ID, how='inner', validate='one_to_many')
+        final_df = final_df.drop(columns=[SUBMISSION_ID]).fillna('')
+
+    # Append the products InvDB does not have yet; a rebuild clears it first
+    with profile_stage("write-back"):
+        gsheet_utils.append_new_rows(service_api, final_df, spreadsheet_id, "InvDB", key_columns=INVDB_KEY,
+                                     rebuild=rebuild)
+
+    # Advance only once the rows are written; a dry run writes nothing, so keeps the watermark
+    if not GoogleSheetUtils.dry_run:
+        watermark.commit(mark)
+    print(f"InvDB: {len(final_df)} product rows from {len(rinv_df)} responses.")
+    return final_df
+
+
+def main(session=None, incremental=None, rebuild=None):
+    if incremental is None:
+        incremental = "--incremental" in sys.argv
+    if rebuild is None:
+        rebuild = "--rebuild" in sys.argv
+    # A rebuild always reads every response
+    return clean_rinv_to_invdb(session or SheetsSession.from_env(), incremental=incremental and not rebuild,
+                               rebuild=rebuild)
+
+
+if __name__ == "__main__":
+    main()
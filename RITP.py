@@ -1,211 +1,241 @@
-from google_sheet_processor import GoogleSheetUtils, DataFrameUtils
-from dotenv import load_dotenv
-import os
-import pandas as pd
-import re
-
-# Load environment variables from .env
-load_dotenv()
-
-# Retrieve the spreadsheet ID
-spreadsheet_id = os.getenv("SPREADSHEET_ID")
+from google_sheet_processor import GoogleSheetUtils, DataFrameUtils, SheetsSession
+from salesforce_source import refresh_trip_index
+from form_watermark import FormWatermark
+from trip_index import merge_on_trip, normalize_trip_series
+from stage_profiler import profile_iter, profile_stage
+from submitter_profiles import PROFILE_FIELDS, SubmitterProfiles
+import sys
 
 gsheet_utils = GoogleSheetUtils()
 dataframe_utils = DataFrameUtils()
 
-# Load service account credentials and build the Sheets API service
-credentials = gsheet_utils.load_credentials("inv-cn-creation.json")
-service_api = gsheet_utils.build_service(credentials)
-
-# Fetch data from "RITP" tab
-sheet_data = gsheet_utils.fetch_sheet_data(service_api, spreadsheet_id, "RITP", range_="A:Y")
-print(f"Fetched {len(sheet_data)} rows from the RITP sheet.")
-
-# Convert to DataFrame
-df_raw = dataframe_utils.process_data_to_dataframe(sheet_data)
-print(f"DataFrame shape: {df_raw.shape}")
-
-# Standardize column names
-df_raw.columns = df_raw.columns.str.strip().str.lower().str.replace(" ", "_")
-print("Standardized columns:", df_raw.columns.tolist())
-
-# Dynamically rename columns if they exist (prevent misalignment)
-column_names = df_raw.columns.tolist()
-
-if len(df_raw.columns) > 17:  # Ensure the column exists
-    df_raw.columns.values[17] = 'trip_id_2'
-    df_raw.columns.values[8] = 'first_name_2'
-    df_raw.columns.values[9] = 'last_name_2'
-
-# Dynamically rename columns if they exist (prevent misalignment)
-column_names = df_raw.columns.tolist()
-
-# Merge 'First Name', 'Last Name', and 'Trip ID' based on the condition
-df_raw['first_name'] = df_raw.apply(
-    lambda row: row['first_name_2'] if row['is_this_your_first_time_submitting_this_form_for_a_credit_note?'] == "Yes" else row['first_name'], axis=1
-)
-
-df_raw['last_name'] = df_raw.apply(
-    lambda row: row['last_name_2'] if row['is_this_your_first_time_submitting_this_form_for_a_credit_note?'] == "Yes" else row['last_name'], axis=1
-)
-
-df_raw['trip_id'] = df_raw.apply(
-    lambda row: row['trip_id_2'] if row['is_this_your_first_time_submitting_this_form_for_a_credit_note?'] == "Yes" else row['trip_id'], axis=1
-)
-
-# Drop the duplicate columns
-df_raw.drop(columns=['first_name_2', 'last_name_2', 'trip_id_2'], inplace=True)
-
-# Function to expand rows based on Trip IDs
-def expand_trip_id_rows(row):
-    trip_ids = re.findall(r'T-\d{6}-\d+', str(row['trip_id']))  # Regex to find trip_id
-    if not trip_ids:
-        return [row]
-    expanded_rows = []
-    for trip_id in trip_ids:
-        new_row = row.copy()
-        new_row['trip_id'] = trip_id
-        expanded_rows.append(new_row)
-    return expanded_rows
-
-# Ensure 'trip_id' contains all possible trip_ids by splitting and expanding them
-expanded_rows = []
-for _, row in df_raw.iterrows():
-    expanded_rows.extend(expand_trip_id_rows(row))
-
-# Create the expanded DataFrame
-df_raw_expanded = pd.DataFrame(expanded_rows)
-
-# Normalize the trip_id by stripping spaces and converting to lowercase
-df_raw_expanded['trip_id'] = df_raw_expanded['trip_id'].str.strip().str.lower()
-
-# Remove rows where trip_id is 'None' or empty
-df_raw_expanded = df_raw_expanded[df_raw_expanded['trip_id'].notna()]
-df_raw_expanded = df_raw_expanded[df_raw_expanded['trip_id'] != '']
-df_raw_expanded = df_raw_expanded[df_raw_expanded['trip_id'] != 'none']  # Ensure 'None' is removed
-
-# Remove duplicates based on 'trip_id'
-df_raw_expanded = df_raw_expanded.drop_duplicates(subset=['trip_id'])
-
-# Normalize the trip_id by stripping spaces and converting to lowercase
-df_raw_expanded['trip_id'] = df_raw_expanded['trip_id'].str.strip().str.lower()
-
-# Replace any internal spaces or unwanted characters (e.g., commas or extra spaces) in trip_id
-df_raw_expanded['trip_id'] = df_raw_expanded['trip_id'].apply(lambda x: re.sub(r'\s+', '', x))
-
-# Remove rows where trip_id is 'None' or empty
-df_raw_expanded = df_raw_expanded[df_raw_expanded['trip_id'].notna()]
-df_raw_expanded = df_raw_expanded[df_raw_expanded['trip_id'] != '']
-df_raw_expanded = df_raw_expanded[df_raw_expanded['trip_id'] != 'none']  # Ensure 'None' is removed
-
-# Remove duplicates based on 'trip_id'
-df_raw_expanded = df_raw_expanded.drop_duplicates(subset=['trip_id'])
-
-# Check the shape and unique trip_ids
-print(f"DataFrame shape after cleaning: {df_raw_expanded.shape}")
-print(df_raw_expanded['trip_id'].unique())  # To see unique trip_ids remaining
-
-# Ensure 'trip_id' contains all possible trip_ids by splitting and expanding them
-expanded_rows = []
-for _, row in df_raw.iterrows():
-    expanded_rows.extend(expand_trip_id_rows(row))
-
-# Create the expanded DataFrame
-df_raw_expanded = pd.DataFrame(expanded_rows)
-print(f"Expanded DataFrame shape: {df_raw_expanded.shape}")
-
-
-# Fetch Salesforce data
-try:
-    sf_data = gsheet_utils.fetch_sheet_data(service_api, spreadsheet_id, "Opportunties ID + Invoice ID", range_="A2:R")
-except Exception as e:
-    print("Failed to fetch data from 'Opportunities ID + Invoice ID'. Please check the range or sheet name.")
-    print(e)
-    exit(1)
-
-sf_df = dataframe_utils.process_data_to_dataframe(sf_data)
-
-# Rename column 'Trip' in sf_df to match 'trip_id' in df_raw_expanded
-sf_df.rename(columns={"Trip": "trip_id"}, inplace=True)
-
-# Check for the existence of 'trip_id'
-if 'trip_id' not in df_raw_expanded.columns or 'trip_id' not in sf_df.columns:
-    raise ValueError('Required columns "trip_id" are missing in one or both DataFrames.')
-
-print("Columns in df_raw_expanded:", df_raw_expanded.columns)
-print("Columns in sf_df:", sf_df.columns)
-
-
-df_combined = df_raw_expanded.merge(
-    sf_df,
-    on="trip_id",  # Replace with the appropriate join key if different
-    how="left",
-    suffixes=('', '_sf')  # To distinguish columns from "Opportunities ID + Invoice ID"
-)
-
-
-# Debugging: Print column names to verify renaming
-print("Updated 'Opportunities ID + Invoice ID' columns:", sf_df.columns.tolist())
-
-
-# Remove duplicates based on 'trip_id' before updating DB
-df_combined = df_combined.drop_duplicates(subset=['trip_id'])
-
-
-# Debugging: Check merge output
-print("Combined DataFrame shape:", df_combined.shape)
-print(df_combined.head())
+# Columns to retrieve when 'is_this_your_first_time_submitting_this_form_for_a_credit_note?' is 'No'
+columns_to_update = PROFILE_FIELDS
+
+# Tab the cleaned responses are appended to. ITP rewrites the DB tab from Performance on every
+# run, so RITP keeps its rows (and their fingerprints) in a tab of its own.
+RITP_DB_TAB = "DB-RITP"
+
+
+def build_db(session, incremental=False, rebuild=False):
+    """
+    Clean the RITP form responses, expand multi-trip rows, merge the opportunities and append the new rows to
+    RITP_DB_TAB.
+
+    A full run reads the tab in fixed row windows (see GoogleSheetUtils.iter_sheet_windows) and
+    cleans, merges and appends one window at a time, so memory stays flat as the tab grows. The
+    fingerprints keep a trip that shows up in two windows from being written twice.
+
+    With incremental, only the responses submitted since the last incremental run are processed
+    (see form_watermark.py). Rows already in RITP_DB_TAB are never written again; rebuild clears the tab
+    and writes every row.
+
+    Returns:
+        int: Number of rows appended to RITP_DB_TAB.
+    """
+    service_api, spreadsheet_id = session.service, session.spreadsheet_id
+    watermark = FormWatermark()
+    mark = None
+
+    # Fetch data from "RITP" tab
+    if incremental:
+        with profile_stage("fetch"):
+            header, new_rows, mark = watermark.read_new_rows(
+                lambda range_: gsheet_utils.fetch_sheet_data(service_api, spreadsheet_id, "RITP", range_=range_),
+                spreadsheet_id, "RITP", "A", "Y"
+            )
+            if not new_rows:
+                print(f"No new RITP responses; {RITP_DB_TAB} is up to date.")
+                return 0
+            print(f"Fetched {len(new_rows)} new rows from the RITP sheet.")
+        with profile_stage("build"):
+            chunks = [dataframe_utils.process_data_to_dataframe([header] + new_rows)]
+    else:
+        chunks = profile_iter("fetch", dataframe_utils.iter_dataframes(
+            gsheet_utils.iter_sheet_windows(service_api, spreadsheet_id, "RITP", "A", "Y")
+        ))
+
+    profiles = SubmitterProfiles()
+    seeded_from_db = []
+
+    def seed_profiles_from_db():
+        """Record the details in RITP_DB_TAB, once per run, for addresses the store does not know yet."""
+        if seeded_from_db:
+            return False
+        seeded_from_db.append(True)
+        with profile_stage("fetch-submitters"):
+            for db_chunk in dataframe_utils.iter_dataframes(
+                    gsheet_utils.iter_sheet_windows(service_api, spreadsheet_id, RITP_DB_TAB, "A", "ZZ")):
+                profiles.record(db_chunk, email_column='email_address', timestamp_column='timestamp',
+                                fields=columns_to_update)
+        return True
+
+    # Bring the opportunity trip index up to date once (fed from Salesforce when configured,
+    # otherwise from the exported tab); every window then only looks its trips up
+    with profile_stage("fetch-reference"):
+        trip_index = refresh_trip_index("opportunities", gsheet_utils, service_api, spreadsheet_id)
+
+    gsheet_utils.ensure_sheet(service_api, spreadsheet_id, RITP_DB_TAB)
+    written = 0
+    for chunk_number, df_raw in enumerate(chunks):
+        df_combined_copy = build_db_rows(df_raw, trip_index, profiles, seed_profiles_from_db)
+
+        # Append the trips RITP_DB_TAB does not have yet; a rebuild clears it before the first window
+        with profile_stage("write-back"):
+            written += gsheet_utils.append_new_rows(service_api, df_combined_copy, spreadsheet_id, RITP_DB_TAB,
+                                                    key_columns=["trip_id"], rebuild=rebuild and chunk_number == 0)
+
+    # Advance only once the rows are written; a dry run writes nothing, so keeps the watermark
+    if incremental and not GoogleSheetUtils.dry_run:
+        watermark.commit(mark)
+    elif rebuild and not GoogleSheetUtils.dry_run:
+        # The next incremental run starts over; the fingerprints skip what is already written
+        watermark.reset(spreadsheet_id, "RITP")
+    print(f"Updated the {RITP_DB_TAB} tab successfully.")
+    return written
+
+
+def build_db_rows(df_raw, trip_index, profiles, seed_profiles):
+    """
+    Turn one chunk of RITP responses into RITP_DB_TAB rows: expand the trips, merge the opportunities and
+    fill in returning submitters' details.
+
+    Args:
+        df_raw (pd.DataFrame): Responses, as process_data_to_dataframe builds them.
+        trip_index (TripIndex): Opportunity index, already refreshed for this run.
+        profiles (SubmitterProfiles): Store the details are recorded in and filled from.
+        seed_profiles (callable): Records more details (from RITP_DB_TAB) and returns True when it did.
+    """
+    import pandas as pd
+
+    # Convert to DataFrame
+    with profile_stage("build"):
+        print(f"DataFrame shape: {df_raw.shape}")
+
+        # Standardize column names
+        df_raw.columns = df_raw.columns.str.strip().str.lower().str.replace(" ", "_")
+        print("Standardized columns:", df_raw.columns.tolist())
+
+        # Dynamically rename columns if they exist (prevent misalignment)
+        if len(df_raw.columns) > 17:  # Ensure the column exists
+            df_raw.columns.values[17] = 'trip_id_2'
+            df_raw.columns.values[8] = 'first_name_2'
+            df_raw.columns.values[9] = 'last_name_2'
+
+        # Merge 'First Name', 'Last Name', and 'Trip ID' based on the condition
+        df_raw['first_name'] = df_raw.apply(
+            lambda row: row['first_name_2'] if row['is_this_your_first_time_submitting_this_form_for_a_credit_note?'] == "Yes" else row['first_name'], axis=1
+        )
+
+        df_raw['last_name'] = df_raw.apply(
+            lambda row: row['last_name_2'] if row['is_this_your_first_time_submitting_this_form_for_a_credit_note?'] == "Yes" else row['last_name'], axis=1
+        )
+
+        df_raw['trip_id'] = df_raw.apply(
+            lambda row: row['trip_id_2'] if row['is_this_your_first_time_submitting_this_form_for_a_credit_note?'] == "Yes" else row['trip_id'], axis=1
+        )
+
+        # Drop the duplicate columns
+        df_raw.drop(columns=['first_name_2', 'last_name_2', 'trip_id_2'], inplace=True)
+
+    # Ensure 'trip_id' contains all possible trip_ids by splitting and expanding them
+    with profile_stage("expand"):
+        df_raw_expanded = dataframe_utils.explode_trip_ids(df_raw, 'trip_id')
+
+    # Normalize the trip_id with the rule shared by every pipeline (see trip_index.py)
+    with profile_stage("dedupe"):
+        df_raw_expanded['trip_id'] = normalize_trip_series(df_raw_expanded['trip_id'])
+
+        # Remove rows where trip_id is 'None' or empty
+        df_raw_expanded = df_raw_expanded[df_raw_expanded['trip_id'] != '']
+
+        # Remove duplicates based on 'trip_id'
+        df_raw_expanded = dataframe_utils.drop_duplicate_rows(df_raw_expanded, ['trip_id'])
+
+    # Check the shape and unique trip_ids
+    print(f"DataFrame shape after cleaning: {df_raw_expanded.shape}")
+    print(df_raw_expanded['trip_id'].unique())  # To see unique trip_ids remaining
+
+    # Ensure 'trip_id' contains all possible trip_ids by splitting and expanding them
+    with profile_stage("re-expand"):
+        df_raw_expanded = dataframe_utils.explode_trip_ids(df_raw, 'trip_id')
+        print(f"Expanded DataFrame shape: {df_raw_expanded.shape}")
+
+
+    # Look up the opportunity rows of these trips in the trip index
+    with profile_stage("lookup-reference"):
+        if 'trip_id' not in df_raw_expanded.columns:
+            raise ValueError('Required column "trip_id" is missing from the RITP responses.')
+        sf_df = trip_index.lookup_frame("opportunities", df_raw_expanded['trip_id'])
+
+    # Merge on the normalized trip ID; trip_id keeps the spelling from the form
+    with profile_stage("merge"):
+        print("Columns in df_raw_expanded:", df_raw_expanded.columns)
+        print("Columns in sf_df:", sf_df.columns)
 
-# Remove leading single quotes and convert to proper datetime format
-if 'timestamp' in df_combined.columns:
-    df_combined['timestamp'] = df_combined['timestamp'].str.lstrip("'")  # Remove leading single quotes
-    df_combined['timestamp'] = pd.to_datetime(df_combined['timestamp'], errors='coerce')  # Ensure it's in datetime format
-    df_combined['timestamp'] = df_combined['timestamp'].dt.strftime('%m/%d/%Y %H:%M:%S')  # Convert back to string format
+        df_combined = merge_on_trip(df_raw_expanded, sf_df, "trip_id")
 
 
+    # Debugging: Print column names to verify renaming
+    print("Updated 'Opportunities ID + Invoice ID' columns:", sf_df.columns.tolist())
+
 
-# Check the shape and unique trip_ids after deduplication
-print(f"Combined DataFrame shape after deduplication: {df_combined.shape}")
-print(df_combined['trip_id'].unique())  # To see unique trip_ids remaining
-df_combined = df_combined.fillna("")
+    # Remove duplicates based on 'trip_id' before updating DB
+    with profile_stage("dedupe-merged"):
+        df_combined = dataframe_utils.drop_duplicate_rows(df_combined, ['trip_id'])
 
-# Now update the "DB" tab with the cleaned and deduplicated data
-gsheet_utils.update_sheet_with_dataframe(service_api, df_combined, spreadsheet_id, "DB")
-print("Updated the DB tab successfully.")
 
+    # Debugging: Check merge output
+    print("Combined DataFrame shape:", df_combined.shape)
+    print(df_combined.head())
 
+    # Remove leading single quotes and convert to proper datetime format
+    with profile_stage("normalize-timestamps"):
+        if 'timestamp' in df_combined.columns:
+            df_combined['timestamp'] = df_combined['timestamp'].str.lstrip("'")  # Remove leading single quotes
+            df_combined['timestamp'] = pd.to_datetime(df_combined['timestamp'], errors='coerce')  # Ensure it's in datetime format
+            df_combined['timestamp'] = df_combined['timestamp'].dt.strftime('%m/%d/%Y %H:%M:%S')  # Convert back to string format
 
-# Columns to retrieve when 'is_this_your_first_time_submitting_this_form_for_a_credit_note?' is 'No'
-columns_to_update = [
-    'location', 'address_line_1', 'city', 'post_code/zip_code', 'country',
-    'file_of_contract', 'signed_date', 'tax_status',
-    'taxpayer_identification_number_(tin)', 'vat_id', 'iban', 'bic', 'account_number', 'swift'
-]
 
-# Create a copy of the DataFrame to avoid modifying the original
-df_combined_copy = df_combined.copy()
+    # Check the shape and unique trip_ids after deduplication
+    print(f"Combined DataFrame shape after deduplication: {df_combined.shape}")
+    print(df_combined['trip_id'].unique())  # To see unique trip_ids remaining
+    df_combined = df_combined.fillna("")
 
-# Iterate through rows where 'is_this_your_first_time_submitting_this_form_for_a_credit_note?' is 'No'
-for index, row in df_combined_copy.iterrows():
-    if row['is_this_your_first_time_submitting_this_form_for_a_credit_note?'] == 'No':
-        email = row['email_address']  # Get the email address
-        # Find the first matching row in DB with the same email
-        matching_row = df_combined_copy[df_combined_copy['email_address'] == email].iloc[0]
 
-        # Update the corresponding columns in the current row
-        for col in columns_to_update:
-            if col in matching_row:
-                df_combined_copy.at[index, col] = matching_row[col]
+    # Create a copy of the DataFrame to avoid modifying the original
+    df_combined_copy = df_combined.copy()
 
-# Verify the updated DataFrame
-print(df_combined_copy.head())
+    # Returning submitters take their details from the profile store, which every run feeds with
+    # the details it reads (see submitter_profiles.py), so their first submission can be long gone
+    with profile_stage("record-submitters"):
+        profiles.record(df_combined_copy, email_column='email_address', timestamp_column='timestamp',
+                        fields=columns_to_update)
 
-# Save the updated combined DataFrame to Google Sheets or CSV
+    with profile_stage("backfill-returning"):
+        returning = df_combined_copy['is_this_your_first_time_submitting_this_form_for_a_credit_note?'] == 'No'
+        missing = profiles.fill(df_combined_copy, email_column='email_address', rows=returning, overwrite=True,
+                                fields=columns_to_update)
+        # Addresses the store does not know yet (e.g. its first run): look in RITP_DB_TAB as well
+        if missing and seed_profiles():
+            missing = profiles.fill(df_combined_copy, email_column='email_address', rows=returning,
+                                    overwrite=True, fields=columns_to_update)
+        if missing:
+            print(f"No earlier details found for {len(missing)} returning submitters: {', '.join(missing)}")
 
-# Update the "DB" tab with combined data
-gsheet_utils.update_sheet_with_dataframe(service_api, df_combined_copy, spreadsheet_id, "DB")
-print("Updated the DB tab successfully.")
+    # Verify the updated DataFrame
+    print(df_combined_copy.head())
+    return df_combined_copy
 
 
+def main(session=None, incremental=None, rebuild=None):
+    if incremental is None:
+        incremental = "--incremental" in sys.argv
+    if rebuild is None:
+        rebuild = "--rebuild" in sys.argv
+    # A rebuild always reads every response
+    return build_db(session or SheetsSession.from_env(), incremental=incremental and not rebuild, rebuild=rebuild)
 
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""Counts and times every outgoing API call, tagged by pipeline stage, operation and tab.
+
+GoogleSheetUtils.execute, the invoice DownloadEngine, the Salesforce REST queries and the Bulk
+API client all report here. Each HTTP attempt is one call, so retries and 429s show up next to
+the quota they cost. When the process exits, a JSON report is written to API_METRICS_DIR
+(default "metrics/") and a short summary is printed, busiest operations first:
+
+    with api_metrics.track("salesforce", "bulk.submit") as call:
+        response = session.post(url, json=job)
+        call.status = response.status_code
+
+Set API_METRICS=0 to switch reporting off. The stage tag defaults to the script name and can be
+changed with set_stage().
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+import atexit
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+API_METRICS_ENABLED = os.getenv("API_METRICS", "1").lower() not in {"0", "false", "no"}
+API_METRICS_DIR = os.getenv("API_METRICS_DIR", "metrics")
+
+# Upper bounds (milliseconds) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+class CallRecord:
+    """Details of one call, filled in by the caller inside track()."""
+
+    def __init__(self):
+        self.status = None
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retry = False
+
+
+class ApiMetrics:
+    """Thread-safe aggregate of API calls keyed by (stage, service, operation, tab)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.stage = os.getenv("PIPELINE_STAGE") or os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0]
+        self.started_at = time.time()
+        self.report_registered = False
+
+    @staticmethod
+    def _empty_stats():
+        return {
+            "calls": 0,
+            "errors": 0,
+            "retries": 0,
+            "throttled": 0,
+            "total_s": 0.0,
+            "max_s": 0.0,
+            "bytes_sent": 0,
+            "bytes_received": 0,
+            "latency_histogram": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+            "status_codes": defaultdict(int),
+        }
+
+    def record(self, service, operation, duration_s, tab=None, status=None, bytes_sent=0, bytes_received=0,
+               retry=False):
+        """Add one call to the aggregate."""
+        if not API_METRICS_ENABLED:
+            return
+        # One key per generated tab would drown the report, so "CN-CC-001426" is counted as "CN-CC-#"
+        tab = re.sub(r"\d{3,}", "#", tab) if tab else ""
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if duration_s * 1000 <= bound),
+                      len(LATENCY_BUCKETS_MS))
+        with self.lock:
+            stats = self.stats.setdefault((self.stage, service, operation, tab), self._empty_stats())
+            stats["calls"] += 1
+            stats["total_s"] += duration_s
+            stats["max_s"] = max(stats["max_s"], duration_s)
+            stats["bytes_sent"] += bytes_sent or 0
+            stats["bytes_received"] += bytes_received or 0
+            stats["latency_histogram"][bucket] += 1
+            stats["status_codes"][str(status or "error")] += 1
+            if retry:
+                stats["retries"] += 1
+            if status == 429:
+                stats["throttled"] += 1
+            if status is None or status >= 400:
+                stats["errors"] += 1
+
+            if not self.report_registered:
+                self.report_registered = True
+                atexit.register(self.finish)
+
+    @contextmanager
+    def track(self, service, operation, tab=None):
+        """Time the block as one call; exceptions are recorded as errors and re-raised."""
+        call = CallRecord()
+        started = time.perf_counter()
+        try:
+            yield call
+        finally:
+            self.record(service, operation, time.perf_counter() - started, tab=tab, status=call.status,
+                        bytes_sent=call.bytes_sent, bytes_received=call.bytes_received, retry=call.retry)
+
+    @staticmethod
+    def percentile(histogram, fraction):
+        """Upper bound (ms) of the bucket holding the given fraction of calls; None for the open bucket."""
+        target = sum(histogram) * fraction
+        running = 0
+        for i, count in enumerate(histogram):
+            running += count
+            if count and running >= target:
+                return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else None
+        return None
+
+    def report(self):
+        """Return the aggregate as a JSON-serialisable dict, busiest operations first."""
+        with self.lock:
+            items = sorted(self.stats.items(), key=lambda item: item[1]["total_s"], reverse=True)
+            calls = []
+            for (stage, service, operation, tab), stats in items:
+                entry = dict(stats, stage=stage, service=service, operation=operation, tab=tab)
+                entry["status_codes"] = dict(stats["status_codes"])
+                entry["total_s"] = round(stats["total_s"], 4)
+                entry["max_s"] = round(stats["max_s"], 4)
+                entry["p50_ms"] = self.percentile(stats["latency_histogram"], 0.5)
+                entry["p95_ms"] = self.percentile(stats["latency_histogram"], 0.95)
+                calls.append(entry)
+
+        totals = defaultdict(lambda: {"calls": 0, "retries": 0, "throttled": 0, "errors": 0, "total_s": 0.0,
+                                      "bytes_sent": 0, "bytes_received": 0})
+        for entry in calls:
+            for field in totals[entry["service"]]:
+                totals[entry["service"]][field] += entry[field]
+        return {
+            "stage": self.stage,
+            "started_at": datetime.fromtimestamp(self.started_at).isoformat(timespec="seconds"),
+            "wall_time_s": round(time.time() - self.started_at, 3),
+            "latency_buckets_ms": LATENCY_BUCKETS_MS,
+            "totals": {service: dict(values, total_s=round(values["total_s"], 4)) for service, values in totals.items()},
+            "calls": calls,
+        }
+
+    def write_report(self, folder=API_METRICS_DIR):
+        """Write the report as <stage>_<timestamp>.json and return its path."""
+        os.makedirs(folder, exist_ok=True)
+        report = self.report()
+        report_path = os.path.join(folder, f"{self.stage}_{datetime.now():%Y%m%d-%H%M%S}.json")
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+        return report_path
+
+    def print_summary(self, report=None, top=10):
+        report = report or self.report()
+        print(f"\nAPI calls for stage '{report['stage']}' ({report['wall_time_s']:.1f}s wall):")
+        for service, totals in report["totals"].items():
+            print(f"  {service}: {totals['calls']} calls, {totals['total_s']:.1f}s, {totals['retries']} retries, "
+                  f"{totals['throttled']} throttled (429), {totals['errors']} errors, "
+                  f"{totals['bytes_sent'] / 1024:.0f} KB sent, {totals['bytes_received'] / 1024:.0f} KB received")
+        print(f"  {'calls':>7} {'total s':>9} {'p50 ms':>7} {'p95 ms':>7}  operation [tab]")
+        for entry in report["calls"][:top]:
+            p50 = entry["p50_ms"] if entry["p50_ms"] is not None else f">{LATENCY_BUCKETS_MS[-1]}"
+            p95 = entry["p95_ms"] if entry["p95_ms"] is not None else f">{LATENCY_BUCKETS_MS[-1]}"
+            tab = f" [{entry['tab']}]" if entry["tab"] else ""
+            print(f"  {entry['calls']:>7} {entry['total_s']:>9.2f} {p50:>7} {p95:>7}  "
+                  f"{entry['service']} {entry['operation']}{tab}")
+
+    def finish(self):
+        """Write the JSON report and print the summary (registered at exit once a call was recorded)."""
+        if not self.stats:
+            return None
+        report_path = self.write_report()
+        self.print_summary()
+        print(f"API metrics report: {report_path}")
+        return report_path
+
+
+# Shared by every module of a run
+METRICS = ApiMetrics()
+
+
+def set_stage(stage):
+    """Tag the calls that follow with another pipeline stage name."""
+    METRICS.stage = stage
+
+
+def record(service, operation, duration_s, **details):
+    METRICS.record(service, operation, duration_s, **details)
+
+
+def track(service, operation, tab=None):
+    return METRICS.track(service, operation, tab=tab)
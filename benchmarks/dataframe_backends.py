@@ -0,0 +1,181 @@
+"""Parity check and benchmark of the DataFrame backends (see dataframe_backend.py).
+
+The DataFrameUtils hot paths run on the synthetic RITP and RICC data with every backend. Each
+result is compared with the row-by-row implementation the pipelines used before (legacy) and
+with the pandas backend, and every operation is timed:
+
+    python benchmarks/dataframe_backends.py
+    python benchmarks/dataframe_backends.py --rows 100k --repeat 5
+
+Exits non-zero when a backend's result differs, so it can gate a scheduled job or CI. The
+arrow backend is skipped when pyarrow is not installed.
+"""
+import argparse
+import os
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+from dataframe_backend import BACKENDS, resolve_backend  # noqa: E402
+from google_sheet_processor import DataFrameUtils  # noqa: E402
+from run_benchmarks import parse_size  # noqa: E402
+from synthetic_data import ricc_form, ritp_form, sf_infl_tab  # noqa: E402
+from trip_index import (SOURCE_FIELDS, TRIP_KEY, extract_trip_ids, merge_on_trip, normalize_trip_id,  # noqa: E402
+                        normalize_trip_series)
+
+INVOICE_COLUMN = "Invoice: Invoice No."
+
+
+# --- the row-by-row implementations the vectorized ones replaced ---
+
+def legacy_explode_trip_ids(df, column):
+    import pandas as pd
+
+    rows = []
+    for _, row in df.iterrows():
+        trip_ids = extract_trip_ids(row[column])
+        if not trip_ids:
+            rows.append(row)
+        for trip_id in trip_ids:
+            new_row = row.copy()
+            new_row[column] = trip_id
+            rows.append(new_row)
+    return pd.DataFrame(rows)
+
+
+def legacy_expand_comma_separated(df, column):
+    import pandas as pd
+
+    rows = []
+    for _, row in df.iterrows():
+        values = str(row[column]).split(",")
+        if len(values) == 1:
+            rows.append(row)
+            continue
+        for value in values:
+            new_row = row.copy()
+            new_row[column] = value.strip()
+            rows.append(new_row)
+    return pd.DataFrame(rows)
+
+
+def legacy_normalize_trip_series(series):
+    keys = series.fillna("").astype(str).str.replace(r'\s+', '', regex=True).str.lstrip("'").str.lower()
+    return keys.where(~keys.isin({"", "none", "nan", "n/a"}), "")
+
+
+# --- synthetic inputs, shaped the way the pipelines hand them to DataFrameUtils ---
+
+def ritp_frame(rows):
+    """RITP responses after RITP.build_db_rows' renaming: one trip_id column."""
+    df = DataFrameUtils.process_data_to_dataframe(ritp_form(rows))
+    df.columns = df.columns.str.strip().str.lower().str.replace(" ", "_")
+    df.columns.values[8], df.columns.values[9], df.columns.values[17] = "first_name_2", "last_name_2", "trip_id_2"
+    first_time = df["is_this_your_first_time_submitting_this_form_for_a_credit_note?"] == "Yes"
+    df["trip_id"] = df["trip_id"].where(~first_time, df["trip_id_2"])
+    return df.drop(columns=["first_name_2", "last_name_2", "trip_id_2"])
+
+
+def ricc_frames(rows):
+    """RICC responses and the SF-INFL rows as TripIndex.lookup_frame returns them."""
+    import pandas as pd
+
+    ricc = DataFrameUtils.process_data_to_dataframe(ricc_form(rows))
+    ricc = ricc.loc[:, ~ricc.columns.duplicated()].rename(columns={"Trip ID": "trip_id"})
+    sf_rows = sf_infl_tab(rows)
+    trip_column = SOURCE_FIELDS["sf_infl"]["trip"]
+    reference = pd.DataFrame(sf_rows[2:], columns=sf_rows[1])
+    reference[TRIP_KEY] = [normalize_trip_id(trip_id) for trip_id in reference[trip_column]]
+    return ricc, reference.drop(columns=[trip_column])
+
+
+def best_of(repeat, function):
+    """(fastest wall time in ms, result of the last run)"""
+    timings = []
+    for _ in range(max(1, repeat)):
+        started = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return min(timings), result
+
+
+def compare(expected, actual, check_dtype=True):
+    """None when equal, else the first line of the difference."""
+    import pandas as pd
+
+    try:
+        if isinstance(expected, pd.Series):
+            pd.testing.assert_series_equal(expected, actual, check_dtype=check_dtype, check_names=False)
+        else:
+            pd.testing.assert_frame_equal(expected, actual, check_dtype=check_dtype)
+    except AssertionError as e:
+        return str(e).strip().splitlines()[0]
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rows", type=parse_size, default=parse_size("20k"), help="Form rows (e.g. 20k)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per operation; the fastest counts")
+    args = parser.parse_args()
+
+    backends = [backend for backend in BACKENDS if resolve_backend(backend) == backend]
+    skipped = [backend for backend in BACKENDS if backend not in backends]
+
+    ritp = ritp_frame(args.rows)
+    ricc, reference = ricc_frames(args.rows)
+    merged = merge_on_trip(ricc, reference, "trip_id", backend="pandas")
+    expanded = DataFrameUtils.expand_comma_separated(merged, INVOICE_COLUMN, backend="pandas")
+    dedupe_columns = ["trip_id", INVOICE_COLUMN]
+
+    # Operation -> (legacy implementation or None, implementation taking a backend)
+    operations = {
+        "explode-trip-ids": (lambda: legacy_explode_trip_ids(ritp, "trip_id"),
+                             lambda backend: DataFrameUtils.explode_trip_ids(ritp, "trip_id", backend=backend)),
+        "normalize-trip-ids": (lambda: legacy_normalize_trip_series(ritp["trip_id"]),
+                               lambda backend: normalize_trip_series(ritp["trip_id"], backend=backend)),
+        "merge-on-trip": (None, lambda backend: merge_on_trip(ricc, reference, "trip_id", backend=backend)),
+        "expand-invoices": (lambda: legacy_expand_comma_separated(merged, INVOICE_COLUMN),
+                            lambda backend: DataFrameUtils.expand_comma_separated(merged, INVOICE_COLUMN,
+                                                                                  backend=backend)),
+        "dedupe": (lambda: expanded.drop_duplicates(subset=dedupe_columns),
+                   lambda backend: DataFrameUtils.drop_duplicate_rows(expanded, dedupe_columns, backend=backend)),
+    }
+
+    failures = 0
+    note = f" ({', '.join(skipped)} skipped: pyarrow is not installed)" if skipped else ""
+    print(f"{args.rows} RITP/RICC rows, best of {args.repeat}{note}")
+    print(f"{'operation':<20}{'legacy ms':>11}" + "".join(f"{backend + ' ms':>12}" for backend in backends)
+          + "  parity")
+    for name, (legacy, implementation) in operations.items():
+        legacy_ms, legacy_result = best_of(args.repeat, legacy) if legacy else (None, None)
+        timings, results = {}, {}
+        for backend in backends:
+            timings[backend], results[backend] = best_of(args.repeat, lambda: implementation(backend))
+
+        problems = []
+        if legacy_result is not None:
+            # The legacy frames were rebuilt from rows, so only the values have to match
+            difference = compare(legacy_result, results["pandas"], check_dtype=False)
+            if difference:
+                problems.append(f"pandas vs legacy: {difference}")
+        for backend in backends[1:]:
+            difference = compare(results["pandas"], results[backend])
+            if difference:
+                problems.append(f"{backend} vs pandas: {difference}")
+        failures += bool(problems)
+
+        print(f"{name:<20}{legacy_ms if legacy_ms is not None else float('nan'):>11.1f}"
+              + "".join(f"{timings[backend]:>12.1f}" for backend in backends)
+              + f"  {'; '.join(problems) if problems else 'ok'}")
+
+    if failures:
+        print(f"{failures} operations differ between backends.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
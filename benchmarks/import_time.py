@@ -0,0 +1,100 @@
+"""Import-time budget for the CLI and the pipeline modules.
+
+Every module is imported in a fresh interpreter with -X importtime. The check fails when the
+cumulative import time is over budget, or when the import pulled in one of the heavy
+libraries that should only be loaded once a pipeline actually runs:
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --budget-ms 150 --repeat 5 cn_creation CC
+
+Exits non-zero on any breach, so it can gate a scheduled job or CI.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARK_DIR)
+
+MODULES = [
+    "cn_creation",
+    "google_sheet_processor",
+    "tax_engine",
+    "CC",
+    "RICC_INFL",
+    "RITP",
+    "ITP",
+    "RINV",
+    "CC_TEMPLATE",
+    "INFL_TEMPLATE",
+    "RITP_TEMPLATE",
+    "INV_TEMPLATE",
+    "invoice_downloader",
+]
+
+# Milliseconds, cumulative over the module and everything it imports (best of --repeat runs)
+DEFAULT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "250"))
+
+# Must not be imported until a pipeline runs
+HEAVY_MODULES = ["pandas", "numpy", "pyarrow", "googleapiclient", "google.oauth2", "gspread", "oauth2client",
+                 "simple_salesforce", "requests", "dotenv"]
+
+# A plain import statement: importlib.import_module bypasses the -X importtime report
+PROBE = "import sys; import {module}; print(','.join(name for name in {heavy!r} if name in sys.modules))"
+
+
+def measure(module):
+    """Import module in a fresh interpreter; return (cumulative ms, heavy modules loaded, error)."""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+        cwd=REPO_ROOT, capture_output=True, text=True,
+    )
+    if process.returncode != 0:
+        return None, [], process.stderr.strip().splitlines()[-1]
+
+    # "import time: self [us] | cumulative | imported package"; the top-level line has no indent
+    cumulative_us = 0
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == module and not parts[2].startswith("  "):
+            cumulative_us = int(parts[1])
+    heavy = [name for name in process.stdout.strip().split(",") if name]
+    return cumulative_us / 1000, heavy, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("modules", nargs="*", default=MODULES, help="Modules to check (default: all)")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="Per-module budget")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per module; the fastest counts")
+    args = parser.parse_args()
+
+    breaches = 0
+    print(f"{'import ms':>10}  module (budget {args.budget_ms:.0f} ms)")
+    for module in args.modules:
+        runs = [measure(module) for _ in range(max(1, args.repeat))]
+        error = next((run[2] for run in runs if run[2]), None)
+        if error:
+            breaches += 1
+            print(f"{'error':>10}  {module}: {error}")
+            continue
+        best_ms = min(run[0] for run in runs)
+        heavy = sorted(set(name for run in runs for name in run[1]))
+        problems = []
+        if best_ms > args.budget_ms:
+            problems.append("over budget")
+        if heavy:
+            problems.append(f"imports {', '.join(heavy)}")
+        breaches += bool(problems)
+        print(f"{best_ms:>10.1f}  {module}{'  <- ' + '; '.join(problems) if problems else ''}")
+
+    if breaches:
+        print(f"{breaches} modules breached the import budget.")
+    return 1 if breaches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
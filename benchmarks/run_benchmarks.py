@@ -0,0 +1,196 @@
+"""End-to-end benchmark of the pipeline scripts against the Sheets emulator.
+
+For every dataset size the emulator is seeded with synthetic tabs (see synthetic_data.py), then
+each stage runs as its own process so wall time and peak RSS are measured per stage. API calls
+are read from the emulator's per-operation counters. Results are written to benchmarks/results/
+and compared with the previous run:
+
+    python benchmarks/run_benchmarks.py --sizes 1k,10k
+    python benchmarks/run_benchmarks.py --sizes 100k --stages RITP,ITP --latency 0.02
+"""
+from datetime import datetime
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARK_DIR)
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, "results")
+sys.path.insert(0, REPO_ROOT)
+
+from sheets_emulator import SheetsEmulator  # noqa: E402
+from synthetic_data import build_workbook  # noqa: E402
+
+SPREADSHEET_ID = "benchmark-spreadsheet"
+
+# Stage name -> script, in pipeline order
+STAGES = {
+    "RICC_INFL": "RICC_INFL.py",
+    "CC": "CC.py",
+    "RITP": "RITP.py",
+    "ITP": "ITP.py",
+    "RINV": "RINV.py",
+    "CC_TEMPLATE": "CC_TEMPLATE.py",
+    "INFL_TEMPLATE": "INFL_TEMPLATE.py",
+    "RITP_TEMPLATE": "RITP_TEMPLATE.py",
+    "INV_TEMPLATE": "INV_TEMPLATE.py",
+}
+
+# Stages that cannot run against the emulator yet, with the reason reported instead of numbers
+UNSUPPORTED_STAGES = {}
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    multiplier = {"k": 1_000, "m": 1_000_000}.get(text[-1], 1)
+    return int(float(text.rstrip("km")) * multiplier)
+
+
+def seed_state(state_file, rows):
+    emulator = SheetsEmulator(state_file=None)
+    for tab_name, values in build_workbook(rows).items():
+        emulator.add_tab(SPREADSHEET_ID, tab_name, values)
+    emulator.save(state_file)
+
+
+def read_call_counts(state_file):
+    with open(state_file, "r") as f:
+        return json.load(f).get("call_counts", {})
+
+
+def run_stage(script, state_file, latency, workers):
+    """Run one script in a child process; returns wall time, peak RSS, API calls and the exit code."""
+    metrics_dir = os.path.join(os.path.dirname(state_file), "metrics", os.path.splitext(script)[0])
+    env = dict(
+        os.environ,
+        SPREADSHEET_ID=SPREADSHEET_ID,
+        SHEETS_EMULATOR=state_file,
+        SHEETS_EMULATOR_LATENCY=str(latency),
+        SHEETS_REQUESTS_PER_MINUTE=str(10 ** 9),
+        CN_MAX_WORKERS=str(workers),
+        SF_SOURCE="sheets",
+        CN_CACHE_DIR=os.path.join(os.path.dirname(state_file), "cache"),
+        API_METRICS_DIR=metrics_dir,
+    )
+    calls_before = read_call_counts(state_file)
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, script], cwd=REPO_ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = process.stderr.read()
+    _, status, rusage = os.wait4(process.pid, 0)
+    wall_time = time.perf_counter() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    calls_after = read_call_counts(state_file)
+    api_calls = {op: calls_after.get(op, 0) - calls_before.get(op, 0) for op in calls_after}
+    api_calls = {op: count for op, count in api_calls.items() if count}
+
+    # ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+    peak_rss_mb = rusage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    result = {
+        "wall_time_s": round(wall_time, 3),
+        "peak_rss_mb": round(peak_rss_mb, 1),
+        "api_calls": api_calls,
+        "api_calls_total": sum(count for op, count in api_calls.items() if op != "429"),
+        "returncode": process.returncode,
+    }
+    # Latency and payload totals from the stage's own api_metrics report
+    reports = sorted(glob.glob(os.path.join(metrics_dir, "*.json")))
+    if reports:
+        with open(reports[-1], "r") as f:
+            result["api_metrics"] = json.load(f)["totals"]
+    if process.returncode != 0:
+        result["error"] = stderr.decode(errors="replace").strip().splitlines()[-1:] or ["unknown error"]
+    return result
+
+
+def git_version():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def previous_results():
+    files = sorted(glob.glob(os.path.join(RESULTS_DIR, "*.json")))
+    if not files:
+        return None
+    with open(files[-1], "r") as f:
+        return json.load(f)
+
+
+def print_report(results, baseline):
+    print(f"\n{'size':>8} {'stage':<14} {'wall s':>9} {'RSS MB':>8} {'API calls':>10}  vs previous")
+    for size, stages in results["sizes"].items():
+        for stage, numbers in stages.items():
+            if "skipped" in numbers:
+                print(f"{size:>8} {stage:<14} {'skipped: ' + numbers['skipped']}")
+                continue
+            delta = ""
+            previous = (baseline or {}).get("sizes", {}).get(size, {}).get(stage, {})
+            if previous.get("wall_time_s"):
+                change = (numbers["wall_time_s"] - previous["wall_time_s"]) / previous["wall_time_s"] * 100
+                delta = f"{change:+.1f}% wall, {numbers['api_calls_total'] - previous.get('api_calls_total', 0):+d} calls"
+            status = "" if numbers["returncode"] == 0 else f"  FAILED: {numbers['error'][0]}"
+            print(f"{size:>8} {stage:<14} {numbers['wall_time_s']:>9.2f} {numbers['peak_rss_mb']:>8.1f} "
+                  f"{numbers['api_calls_total']:>10}  {delta}{status}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1k,10k", help="Comma-separated row counts, e.g. 1k,10k,100k,1m")
+    parser.add_argument("--stages", default=",".join(STAGES), help="Comma-separated stage names")
+    parser.add_argument("--latency", type=float, default=0.0, help="Emulated seconds per API request")
+    parser.add_argument("--workers", type=int, default=4, help="CN_MAX_WORKERS for the template stages")
+    parser.add_argument("--no-save", action="store_true", help="Do not write a results file")
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(unknown)}")
+
+    baseline = previous_results()
+    results = {
+        "version": git_version(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "latency_s": args.latency,
+        "workers": args.workers,
+        "sizes": {},
+    }
+
+    for size_label in args.sizes.split(","):
+        rows = parse_size(size_label)
+        print(f"Seeding emulator with {rows} rows per tab...")
+        with tempfile.TemporaryDirectory() as temp_dir:
+            state_file = os.path.join(temp_dir, "sheets_state.json")
+            seed_state(state_file, rows)
+            results["sizes"][size_label] = {}
+            for stage in stages:
+                if stage in UNSUPPORTED_STAGES:
+                    results["sizes"][size_label][stage] = {"skipped": UNSUPPORTED_STAGES[stage]}
+                    continue
+                print(f"  {stage}...")
+                results["sizes"][size_label][stage] = run_stage(
+                    STAGES[stage], state_file, args.latency, args.workers
+                )
+
+    print_report(results, baseline)
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        result_file = os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}_{results['version']}.json")
+        with open(result_file, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved results to {result_file}")
+
+
+if __name__ == "__main__":
+    main()
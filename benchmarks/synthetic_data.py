@@ -0,0 +1,254 @@
+"""Synthetic form exports and Salesforce tables shaped like the real tabs.
+
+Each generator returns the tab as a list of rows (header row(s) first), ready to be loaded into
+the SheetsEmulator. Only a bounded number of rows is left "pending" for the template generators
+(PENDING_NOTES), so note creation stays comparable across dataset sizes while the merge stages
+scale with the row count.
+"""
+from datetime import datetime, timedelta
+import random
+
+
+PENDING_NOTES = 25
+
+FIRST_NAMES = ["Anna", "Lukas", "Sofia", "Jonas", "Mia", "Felix", "Emma", "Noah", "Lea", "Paul"]
+LAST_NAMES = ["Schmidt", "Müller", "Weber", "Fischer", "Meyer", "Wagner", "Becker", "Hoffmann"]
+CITIES = [("Berlin", "10115", "Germany"), ("Hamburg", "20095", "Germany"), ("Vienna", "1010", "Austria"),
+          ("Zurich", "8001", "Switzerland"), ("Amsterdam", "1012", "Netherlands"), ("Lisbon", "1100", "Portugal")]
+RECORD_TYPES = ["Influencer", "Marketing", "Cooperation"]
+PRODUCT_HEADER = ["Name of service / product", "Service Period", "Quantity", "Price per quantity", "Currency"]
+
+
+def _timestamp(rng, start=datetime(2024, 1, 1)):
+    return (start + timedelta(seconds=rng.randint(0, 365 * 24 * 3600))).strftime("%m/%d/%Y %H:%M:%S")
+
+
+def _trip_id(index):
+    return f"T-{240000 + index % 100000:06d}-{index // 100000 + 1}"
+
+
+def _iban(rng):
+    return "DE" + "".join(str(rng.randint(0, 9)) for _ in range(20))
+
+
+def _person(rng):
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    return first, last, f"{first}.{last}{rng.randint(1, 999)}@example.com".lower()
+
+
+def ritp_form(rows, seed=1):
+    """RITP form export (A:Y) with the duplicated First Name / Last Name / Trip ID columns at 8, 9 and 17."""
+    rng = random.Random(seed)
+    header = [
+        "Timestamp", "Email Address", "Is this your first time submitting this form for a credit note?",
+        "First Name", "Last Name", "Trip ID", "Location", "Address Line 1", "First Name", "Last Name",
+        "City", "Post Code/ZIP Code", "Country", "File of Contract", "Signed Date", "Tax Status",
+        "Taxpayer Identification Number (TIN)", "Trip ID", "VAT ID", "IBAN", "BIC", "Account Number",
+        "SWIFT", "Sales Agent", "Agent Code",
+    ]
+    data = [header]
+    for i in range(rows):
+        first, last, email = _person(rng)
+        city, postal, country = rng.choice(CITIES)
+        first_time = "Yes" if i % 4 == 0 else "No"
+        trips = ", ".join(_trip_id(i * 3 + k) for k in range(rng.randint(1, 3)))
+        agent_code = f"AG{i:05d}"  # one form per agent; Performance covers the first rows // 5 agents
+        data.append([
+            _timestamp(rng), email, first_time,
+            "" if first_time == "Yes" else first, "" if first_time == "Yes" else last,
+            "" if first_time == "Yes" else trips,
+            city, f"{rng.randint(1, 200)} Hauptstraße", first if first_time == "Yes" else "",
+            last if first_time == "Yes" else "", city, postal, country, "contract.pdf", "01/15/2024",
+            "Within Germany" if country == "Germany" else "Outside Germany", f"{rng.randint(10**9, 10**10 - 1)}",
+            trips if first_time == "Yes" else "", f"DE{rng.randint(10**8, 10**9 - 1)}", _iban(rng), "COBADEFFXXX",
+            "", "", f"{first} {last}", agent_code,
+        ])
+    return data
+
+
+def ricc_form(rows, seed=2, width=62):
+    """RICC form export (A:BJ): about twenty used columns padded with mostly empty ones."""
+    rng = random.Random(seed)
+    used = [
+        "Timestamp", "Email Address", "full_name", "Address Line 1", "city_postal", "Country",
+        "Taxpayer Identification Number (TIN)", "VAT ID", "IBAN", "BIC", "Signed Date", "IG Handle",
+        "Reason for refund (Hotel change, car rental, etc)", "Refund Amount", "Trip ID", "Created Date",
+    ]
+    header = used + [f"Question {i}" for i in range(len(used), width)]
+    data = [header]
+    for i in range(rows):
+        first, last, email = _person(rng)
+        if i < PENDING_NOTES:
+            first, last = "Yulia", "Slavinskaya"
+        city, postal, country = rng.choice(CITIES)
+        row = [
+            _timestamp(rng), email, f"{first} {last}", f"{rng.randint(1, 200)} Hauptstraße", f"{city} {postal}",
+            country, f"{rng.randint(10**9, 10**10 - 1)}", f"DE{rng.randint(10**8, 10**9 - 1)}", _iban(rng),
+            "COBADEFFXXX", "01/15/2024", f"@{first.lower()}{i}", rng.choice(["Hotel change", "Car rental", ""]),
+            f"{rng.randint(20, 900)}.{rng.randint(0, 99):02d}", _trip_id(i), "2024-12-31",
+        ]
+        # Sparse tail: a few answers in otherwise empty columns
+        row += [("x" if rng.random() < 0.02 else "") for _ in range(len(used), width)]
+        data.append(row)
+    return data
+
+
+def rinv_form(rows, seed=3, extra_products=1):
+    """RINV form export with extra_products optional product groups after the first product."""
+    rng = random.Random(seed)
+    header = [
+        "Timestamp", "Email Address", "First Name", "Last Name", "Title/Position",
+        "Which entity should generate the invoice?", "Customer Name", "Address Line 1", "City",
+        "Post Code/ZIP Code", "Country", "Customer's Email Address", "Tax Status",
+        "Taxpayer Identification Number (TIN)", "VAT ID", "Name of service / product", "Service Period",
+        "Quantity", "Price per quantity", "Currency", "More than one service or products?",
+        *PRODUCT_HEADER * extra_products, "Status",
+    ]
+    data = [header]
+    for i in range(rows):
+        first, last, email = _person(rng)
+        city, postal, country = rng.choice(CITIES)
+        more = "Yes" if rng.random() < 0.3 else "No"
+        product = [f"Service {rng.randint(1, 40)}", "2024-12", str(rng.randint(1, 5)), f"{rng.randint(50, 2000)}.00", "EUR"]
+        extra = []
+        for number in range(extra_products):
+            # Later groups are left blank more often, the way requesters fill the form in
+            filled = more == "Yes" and (number == 0 or rng.random() < 0.5)
+            extra += [f"Service {rng.randint(1, 40)}", "2024-12", str(rng.randint(1, 5)), f"{rng.randint(50, 2000)}.00",
+                      "EUR"] if filled else [""] * 5
+        data.append([
+            _timestamp(rng), email, first, last, "Partner Manager", "Tourlane GmbH", f"Customer {i}",
+            f"{rng.randint(1, 200)} Hauptstraße", city, postal, country, f"billing{i}@example.com",
+            "Within Germany" if country == "Germany" else "Outside Germany",
+            f"{rng.randint(10**9, 10**10 - 1)}", f"DE{rng.randint(10**8, 10**9 - 1)}",
+            *product, more, *extra, "" if i < PENDING_NOTES else "Done",
+        ])
+    return data
+
+
+def invdb_tab(rows, seed=4):
+    """InvDB as written by RINV.py; all but PENDING_NOTES rows are already "Done"."""
+    rng = random.Random(seed)
+    header = [
+        "Timestamp", "Email Address", "Requester Name", "Title/Position", "Entity", "Customer Name",
+        "Address Line 1", "City Postal", "Country", "Customer's Email Address", "Tax Status",
+        "Taxpayer Identification Number (TIN)", "VAT ID", "Status", "RINV Row", "Product No.", "Product",
+        "Service Period", "Quantity", "Unit Price", "Currency",
+    ]
+    data = [header]
+    for i in range(rows):
+        first, last, email = _person(rng)
+        city, postal, country = rng.choice(CITIES)
+        data.append([
+            _timestamp(rng), email, f"{first} {last}", "Partner Manager", "Tourlane GmbH", f"Customer {i}",
+            f"{rng.randint(1, 200)} Hauptstraße", f"{city} {postal}", country, f"billing{i}@example.com",
+            "Within Germany" if country == "Germany" else "Outside Germany", f"{rng.randint(10**9, 10**10 - 1)}",
+            f"DE{rng.randint(10**8, 10**9 - 1)}", "" if i < PENDING_NOTES else "Done", str(i + 2), "1",
+            f"Service {rng.randint(1, 40)}", "2024-12", str(rng.randint(1, 5)), f"{rng.randint(50, 2000)}.00", "EUR",
+        ])
+    return data
+
+
+def db_cc_tab(rows, seed=5):
+    """DB-CC (A:AI) read by CC.py."""
+    rng = random.Random(seed)
+    header = [
+        "trip_id", "email_address", "full_name", "address_line_1", "city_postal", "country", "tin", "vat_id",
+        "iban", "bic", "signed_date", "invoicing_date", "Number of Affliates", "Affliatee Service",
+        "One-time compensations", "Created Date",
+    ]
+    data = [header]
+    for i in range(rows):
+        first, last, email = _person(rng)
+        city, postal, country = rng.choice(CITIES)
+        data.append([
+            _trip_id(i).upper() if i % 2 else _trip_id(i), email, f"{first} {last}",
+            f"{rng.randint(1, 200)} Hauptstraße", f"{city} {postal}", country, f"{rng.randint(10**9, 10**10 - 1)}",
+            f"DE{rng.randint(10**8, 10**9 - 1)}", _iban(rng), "COBADEFFXXX", "01/15/2024",
+            "December 31st, 2024" if i < PENDING_NOTES else "November 30th, 2024",
+            str(rng.randint(1, 20)), "Affiliate marketing", f"{rng.randint(0, 500)}", "2024-12-31",
+        ])
+    return data
+
+
+def sf_infl_tab(rows, seed=6):
+    """SF-INFL report export: a title row, then the header on row 2 (read as A2:F)."""
+    rng = random.Random(seed)
+    header = [
+        "Invoice: Trip Detail: Trip Confirmation: Trip", "Invoice: Trip Detail: Record Type",
+        "Invoice: Invoice No.", "Amount", "Invoice: Payment Method", "Created Date",
+    ]
+    data = [["SF-INFL export"], header]
+    for i in range(rows):
+        invoices = ", ".join(f"INV-{i * 2 + k:07d}" for k in range(1 if rng.random() < 0.8 else 2))
+        data.append([
+            _trip_id(i), rng.choice(RECORD_TYPES), invoices, f"{rng.randint(20, 900)}.{rng.randint(0, 99):02d}",
+            rng.choice(["Influencer Invoice", "Marketing"]), "2024-12-31",
+        ])
+    return data
+
+
+def opportunities_tab(rows, seed=7):
+    """"Opportunties ID + Invoice ID" export: a title row, then an 18 column header (A2:R)."""
+    rng = random.Random(seed)
+    header = [
+        "Opportunity ID", "Opportunity Name", "Trip", "Invoice ID", "Invoice: Invoice No.", "Stage",
+        "Close Date", "Amount", "Currency", "Account Name", "Owner", "Record Type", "Lead Source",
+        "Destination", "Travel Start", "Travel End", "Created Date", "Last Modified Date",
+    ]
+    data = [["Opportunities export"], header]
+    for i in range(rows):
+        data.append([
+            f"006{i:012d}", f"Trip {i}", _trip_id(i), f"a0B{i:012d}", f"INV-{i:07d}", "Closed Won", "2024-12-01",
+            f"{rng.randint(500, 15000)}.00", "EUR", f"Account {i % 997}", "Sales Team", "Travel", "Partner",
+            rng.choice(["Iceland", "Japan", "Peru", "Namibia"]), "2025-01-10", "2025-01-24", "2024-11-01",
+            "2024-12-15",
+        ])
+    return data
+
+
+def performance_tab(rows, seed=8):
+    """Performance tab: three summary rows, header on row 4 (read as A4:I)."""
+    rng = random.Random(seed)
+    header = [
+        "Agent Code", "Opportunity ID", "Land BV", "Land Commission", "Flight Commission", "Total Commission",
+        "CN Number", "Trustpilot Review", "Traning Day Attendance",
+    ]
+    data = [["Performance"], [""], [""], header]
+    agents = max(1, rows // 5)
+    for i in range(rows):
+        agent = i % agents
+        land = rng.randint(1000, 20000)
+        data.append([
+            f"AG{agent:05d}", f"006{i:012d}", str(land), f"{land * 0.1:.2f}", f"{rng.randint(0, 300)}.00",
+            f"{land * 0.1 + 50:.2f}", "#N/A" if agent < PENDING_NOTES else f"CN-ITP_{agent:06d}",
+            rng.choice(["Yes", "No"]), rng.choice(["Yes", "No"]),
+        ])
+    return data
+
+
+def template_tab(rows=45, columns=8):
+    """A note template: labels in column A, the rest empty."""
+    return [[f"Label {r}"] + [""] * (columns - 1) for r in range(rows)]
+
+
+def build_workbook(rows, seed=0):
+    """Every tab the pipelines read or write, keyed by tab name."""
+    return {
+        "RITP": ritp_form(rows, seed + 1),
+        "RICC": ricc_form(rows, seed + 2),
+        "RINV": rinv_form(rows, seed + 3),
+        "InvDB": invdb_tab(rows, seed + 4),
+        "DB-CC": db_cc_tab(rows, seed + 5),
+        "SF-INFL": sf_infl_tab(rows, seed + 6),
+        "Opportunties ID + Invoice ID": opportunities_tab(rows, seed + 7),
+        "Performance": performance_tab(rows, seed + 8),
+        "DB": [],
+        "DB-RITP": [],
+        "DB-INFL": [],
+        "DB-CC_2": [],
+        "Template-CC": template_tab(),
+        "Template-INFL": template_tab(),
+        "Template-ITP": template_tab(),
+        "Inv-Template": template_tab(),
+    }
@@ -0,0 +1,218 @@
+"""Command line entry point for the credit note and invoice pipelines.
+
+    python cn_creation.py run cc              # CC.py, then CC_TEMPLATE.py
+    python cn_creation.py run inv --dry-run   # read everything, write nothing
+    python cn_creation.py run infl --incremental
+    python cn_creation.py run download --since 2025-01-01
+    python cn_creation.py sync                # mirror the pipeline tabs into SQLite
+    python cn_creation.py query "SELECT agent_code, COUNT(*) FROM ritp GROUP BY agent_code"
+    python cn_creation.py archive             # move exported note tabs into the period shards
+
+Each pipeline is a list of step modules whose main() is called in order with one shared
+Sheets session. The step modules, pandas and the Google client libraries are only imported
+once a pipeline runs, so --help and scheduled runs start fast
+(see benchmarks/import_time.py for the import-time budget).
+"""
+import argparse
+import importlib
+import sys
+
+# Pipeline name -> step modules, run in order
+PIPELINES = {
+    "cc": ["CC", "CC_TEMPLATE"],
+    "infl": ["RICC_INFL", "INFL_TEMPLATE"],
+    "itp": ["RITP", "ITP", "RITP_TEMPLATE"],
+    "inv": ["RINV", "INV_TEMPLATE"],
+    "download": ["invoice_downloader"],
+}
+
+# Steps that can process only the form responses submitted since their last run
+INCREMENTAL_STEPS = {"RICC_INFL", "RITP", "RINV"}
+
+# Steps that append only new rows to their DB tab, unless told to rebuild it
+APPEND_ONLY_STEPS = {"RICC_INFL", "RITP", "RINV"}
+
+# Steps that can run their joins against the local SQLite mirror (see sheet_mirror.py)
+MIRROR_STEPS = {"ITP"}
+
+
+def soql_since(text):
+    """Accept "2025-01-31" or a full SOQL datetime ("2025-01-31T09:15:00Z") for --since."""
+    from datetime import datetime
+
+    try:
+        if "T" in text:
+            datetime.strptime(text, "%Y-%m-%dT%H:%M:%SZ")
+            return text
+        return datetime.strptime(text, "%Y-%m-%d").strftime("%Y-%m-%dT00:00:00Z")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM-DD or YYYY-MM-DDTHH:MM:SSZ, got {text!r}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="cn-creation", description="Credit note and invoice pipelines")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Run one pipeline")
+    run.add_argument("pipeline", choices=sorted(PIPELINES), help="Pipeline to run")
+    run.add_argument("--dry-run", action="store_true",
+                     help="Read from Sheets and Salesforce but skip every write, copy and download")
+    run.add_argument("--incremental", action="store_true",
+                     help="Only process form responses submitted since the last incremental run and append them")
+    run.add_argument("--rebuild", action="store_true",
+                     help="Clear DB-INFL/DB-RITP/InvDB and write every row again instead of appending only new rows")
+    run.add_argument("--mirror", action="store_true",
+                     help="Sync the tabs ITP joins into the local SQLite mirror and join them there")
+    run.add_argument("--since", type=soql_since,
+                     help="Only process records modified after this date (download only)")
+    run.add_argument("--full", action="store_true", help="download: ignore the watermark and re-query every invoice")
+    run.add_argument("--refresh-reference", action="store_true",
+                     help="download: refresh the trip/invoice reference data instead of downloading invoices")
+    run.add_argument("--shard-notes", action="store_true",
+                     help="Create new notes in the current period's archive spreadsheet (see tab_archive.py)")
+    run.add_argument("--profile", action="store_true", help="Print and save wall/CPU/memory per stage")
+    run.add_argument("--profile-stage", metavar="STAGE", help="Also run this stage under cProfile")
+
+    sync = commands.add_parser("sync", help="Mirror the pipeline tabs into the local SQLite database")
+    sync.add_argument("--tabs", type=lambda text: [tab.strip() for tab in text.split(",") if tab.strip()],
+                      help="Comma-separated tabs to sync (default: all mirrored tabs)")
+    sync.add_argument("--full", action="store_true", help="Read every tab whole, even the form-response tabs")
+
+    query = commands.add_parser("query", help="Run SQL against the local mirror and print the result as CSV")
+    query.add_argument("sql", help='e.g. "SELECT trip_id, email_address FROM db WHERE agent_code = \'A-12\'"')
+    query.add_argument("--output", help="Write the CSV to this file instead of stdout")
+
+    archive = commands.add_parser("archive", help="Move exported CN-*/Invoice-* tabs into per-period spreadsheets")
+    archive.add_argument("--period", choices=["month", "quarter"], help="Shard size (default: ARCHIVE_PERIOD or month)")
+    archive.add_argument("--dry-run", action="store_true", help="Print which tabs would move, move nothing")
+    archive.add_argument("--locate", metavar="TAB", help="Print where one note tab is instead of archiving")
+    return parser
+
+
+def run_pipeline(args):
+    """Run the steps of one pipeline; returns the number of groups that failed."""
+    from dotenv import load_dotenv
+
+    # Load .env before the step modules read their settings at import
+    load_dotenv()
+
+    import api_metrics
+    import stage_profiler
+    from google_sheet_processor import GoogleSheetUtils, SheetsSession
+    from stage_profiler import profile_stage
+
+    if args.since and args.pipeline != "download":
+        raise SystemExit("--since is only supported by the download pipeline")
+    if args.dry_run:
+        GoogleSheetUtils.set_dry_run()
+    if args.shard_notes:
+        import tab_archive
+        tab_archive.SHARD_NEW_NOTES = True
+    if args.profile or args.profile_stage:
+        stage_profiler.PROFILING_ENABLED = True
+        stage_profiler.CPROFILE_STAGE = args.profile_stage or stage_profiler.CPROFILE_STAGE
+
+    session = None
+    failed = 0
+    for step in PIPELINES[args.pipeline]:
+        module = importlib.import_module(step)
+        api_metrics.set_stage(step)
+        print(f"=== {step}")
+        with profile_stage(step):
+            if step == "invoice_downloader":
+                result = module.main(full=args.full, refresh_reference=args.refresh_reference,
+                                     since=args.since, dry_run=args.dry_run)
+            else:
+                session = session or SheetsSession.from_env()
+                options = {}
+                if step in INCREMENTAL_STEPS:
+                    options["incremental"] = args.incremental
+                if step in APPEND_ONLY_STEPS:
+                    options["rebuild"] = args.rebuild
+                if step in MIRROR_STEPS:
+                    options["mirror"] = args.mirror
+                result = module.main(session, **options)
+        # The template steps return one GroupResult per note
+        if isinstance(result, list):
+            failed += sum(1 for group_result in result if not getattr(group_result, "ok", True))
+    return failed
+
+
+def sync_mirror(args):
+    """Sync the mirrored tabs and print what each one holds."""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    from google_sheet_processor import SheetsSession
+    from sheet_mirror import MIRRORED_TABS, SheetMirror
+
+    unknown = [tab for tab in args.tabs or [] if tab not in MIRRORED_TABS]
+    if unknown:
+        raise SystemExit(f"Unknown tabs {unknown}; mirrored tabs are {sorted(MIRRORED_TABS)}")
+    mirror = SheetMirror()
+    mirror.sync(SheetsSession.from_env(), args.tabs, full=args.full)
+    for tab, status in sorted(mirror.status().items()):
+        print(f"{status['rows']:>10}  {tab} -> {status['table']}")
+
+
+def run_query(args):
+    """Run one query against the mirror and write the result set as CSV."""
+    import csv
+    from sheet_mirror import SheetMirror
+
+    columns, rows = SheetMirror().query(args.sql)
+    output = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        writer = csv.writer(output)
+        writer.writerow(columns)
+        writer.writerows(rows)
+    finally:
+        if args.output:
+            output.close()
+            print(f"Wrote {len(rows)} rows to {args.output}")
+
+
+def archive_tabs(args):
+    """Archive the finished note tabs, or print where one of them is."""
+    from tab_archive import TabArchive
+
+    archive = TabArchive(period=args.period)
+    if args.locate:
+        location = archive.locate(args.locate)
+        if location is None:
+            raise SystemExit(f"{args.locate} is not in the archive index.")
+        print(f"{args.locate}: {location['period']} {location['url']}")
+        return
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    from google_sheet_processor import GoogleSheetUtils, SheetsSession
+    from pdf_store import PdfStore
+
+    if args.dry_run:
+        GoogleSheetUtils.set_dry_run()
+    plan = archive.archive(SheetsSession.from_env(), PdfStore())
+    print(f"{sum(len(tabs) for tabs in plan.values())} tabs {'to archive' if args.dry_run else 'archived'}.")
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "run":
+        failed = run_pipeline(args)
+        if failed:
+            print(f"{failed} groups failed.")
+            return 1
+    elif args.command == "sync":
+        sync_mirror(args)
+    elif args.command == "query":
+        run_query(args)
+    elif args.command == "archive":
+        archive_tabs(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+"""Service account credentials with an access token cache shared across processes.
+
+Every pipeline script used to exchange the service account key for a fresh access token. The
+credentials built here look in a small cache file first and only go to the token endpoint when
+the cached token is missing or about to expire. A file lock keeps scripts that start at the same
+time from refreshing twice. The same credentials serve the Sheets client and the PDF export:
+
+    credentials = load_credentials("inv-cn-creation.json")
+    service = build("sheets", "v4", credentials=credentials)
+
+The cache lives in CN_TOKEN_CACHE_DIR (default ".cache/tokens") and is written owner-only.
+"""
+from datetime import datetime, timedelta
+import hashlib
+import json
+import os
+import threading
+
+import api_metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+TOKEN_CACHE_DIR = os.getenv("CN_TOKEN_CACHE_DIR", os.path.join(os.getenv("CN_CACHE_DIR", ".cache"), "tokens"))
+
+# Scopes for the Sheets API and the Drive calls (PDF export URL, new archive spreadsheets)
+SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive",
+]
+
+# Cached tokens with less time left than this are refreshed. Must stay above google-auth's own
+# refresh threshold, or a token read from the cache would count as expired straight away.
+REFRESH_MARGIN = timedelta(minutes=5)
+
+
+class FileLock:
+    """Exclusive lock on a lock file, held across processes (fcntl on POSIX, msvcrt on Windows)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.file = open(self.path, "a+")
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        else:
+            self.file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK gives up after ~10s; keep waiting
+                    continue
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            else:
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self.file.close()
+        return False
+
+
+class TokenCache:
+    """Access tokens on disk, one JSON file per service account and scope set."""
+
+    def __init__(self, folder=TOKEN_CACHE_DIR):
+        self.folder = folder
+        self.lock = threading.Lock()
+
+    def _path(self, client_email, scopes):
+        key = hashlib.sha256(f"{client_email}|{' '.join(sorted(scopes or []))}".encode()).hexdigest()[:16]
+        return os.path.join(self.folder, f"{key}.json")
+
+    def read(self, path):
+        """Return (token, expiry) from a cache file, or (None, None) when it is missing or unreadable."""
+        try:
+            with open(path, "r") as f:
+                cached = json.load(f)
+            return cached["token"], datetime.fromisoformat(cached["expiry"])
+        except (OSError, ValueError, KeyError):
+            return None, None
+
+    def write(self, path, token, expiry, client_email):
+        temp_path = f"{path}.tmp"
+        descriptor = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, "w") as f:
+            json.dump({"token": token, "expiry": expiry.isoformat(), "client_email": client_email}, f)
+        os.replace(temp_path, path)
+
+    def refresh(self, credentials, request, exchange):
+        """
+        Give credentials a token from the cache, or call exchange(request) and cache what it returns.
+
+        Runs under a thread lock and the cache file lock, so only one caller refreshes at a time
+        and everybody else picks up its token.
+        """
+        path = self._path(credentials.service_account_email, credentials.scopes)
+        with self.lock, FileLock(f"{path}.lock"):
+            # google-auth keeps expiry as naive UTC
+            token, expiry = self.read(path)
+            if token and expiry - REFRESH_MARGIN > datetime.utcnow():
+                credentials.token, credentials.expiry = token, expiry
+                return
+
+            with api_metrics.track("google", "oauth.token") as call:
+                exchange(request)
+                call.status = 200
+            self.write(path, credentials.token, credentials.expiry, credentials.service_account_email)
+
+
+TOKEN_CACHE = TokenCache()
+
+_credentials_class = None
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def cached_credentials_class():
+    """The google-auth service account Credentials class, with refresh() going through TOKEN_CACHE."""
+    global _credentials_class
+    if _credentials_class is None:
+        from google.oauth2 import service_account
+
+        class CachedServiceAccountCredentials(service_account.Credentials):
+            # Copies made by with_scopes() and friends keep this class, and so keep the cache
+            def refresh(self, request):
+                if getattr(self, "_jwt_credentials", None) is not None:
+                    # Self-signed JWTs are made locally per audience; there is no exchange to save
+                    return super().refresh(request)
+                TOKEN_CACHE.refresh(self, request, super().refresh)
+
+        _credentials_class = CachedServiceAccountCredentials
+    return _credentials_class
+
+
+def load_credentials(service_account_file, scopes=None):
+    """
+    Load the service account key once per process and return credentials backed by the token cache.
+
+    Args:
+        service_account_file (str): Path to the service account JSON key.
+        scopes (list, optional): OAuth scopes; defaults to SCOPES.
+
+    Returns:
+        google.oauth2.service_account.Credentials: shared by every caller asking for the same file and scopes.
+    """
+    scopes = list(scopes or SCOPES)
+    key = (os.path.abspath(service_account_file), tuple(scopes))
+    with _loaded_lock:
+        if key not in _loaded:
+            if not os.path.exists(service_account_file):
+                raise FileNotFoundError(f"Service account file not found: {service_account_file}")
+            with open(service_account_file, "r") as f:
+                service_account_info = json.load(f)
+            _loaded[key] = cached_credentials_class().from_service_account_info(service_account_info, scopes=scopes)
+        return _loaded[key]
+
@@ -0,0 +1,52 @@
+"""String backend of the DataFrameUtils hot paths (trip ID explosion, invoice expansion, dedupe, trip ID normalization, joins).
+
+The form and reference tabs are all text, so these operations are string work on pandas
+object columns. DATAFRAME_BACKEND=arrow runs the string steps on pyarrow-backed columns
+(pandas' "string[pyarrow]" dtype) instead:
+
+    DATAFRAME_BACKEND=arrow python cn_creation.py run itp
+
+Only the intermediate key and text columns change dtype; every function hands back the
+caller's columns in their original dtype, so the DataFrames the pipelines write are the same
+with either backend. pyarrow is optional: without it, "arrow" falls back to "pandas".
+`python -m pytest tests` checks that both backends give the same results, and
+`python benchmarks/dataframe_backends.py` checks it again while timing them on the synthetic RITP/RICC data.
+"""
+import importlib.util
+import os
+
+BACKENDS = ("pandas", "arrow")
+DATAFRAME_BACKEND = os.getenv("DATAFRAME_BACKEND", "pandas").lower()
+
+_warned = []
+
+
+def resolve_backend(backend=None):
+    """The backend to use: the given one, else DATAFRAME_BACKEND; "pandas" when pyarrow is missing."""
+    backend = (backend or DATAFRAME_BACKEND).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown DataFrame backend {backend!r}; expected one of {', '.join(BACKENDS)}.")
+    if backend == "arrow" and importlib.util.find_spec("pyarrow") is None:
+        if not _warned:
+            _warned.append(True)
+            print("pyarrow is not installed; using the pandas backend.")
+        return "pandas"
+    return backend
+
+
+def as_strings(series, backend=None, na_value="nan"):
+    """
+    The values of a Series as text in the backend's string dtype.
+
+    Missing values become na_value ("nan" by default, like str() of a NaN cell).
+    """
+    if resolve_backend(backend) == "arrow":
+        return series.astype("string[pyarrow]").fillna(na_value)
+    return series.fillna(na_value).astype(str)
+
+
+def as_objects(series):
+    """A backend string Series back as an object Series (missing values as NaN), the dtype the pipelines use."""
+    import numpy as np
+
+    return series.astype(object).where(series.notna(), np.nan)
@@ -0,0 +1,103 @@
+"""Local index of the row fingerprints already written to a DB tab, for append-only writes.
+
+Every row GoogleSheetUtils.append_new_rows writes carries a fingerprint of its key columns
+in a hidden last column, FINGERPRINT_COLUMN. The fingerprints are also kept locally in
+CN_CACHE_DIR/fingerprints/, so a run can tell which rows are new without reading the tab.
+Before the index is trusted, the fingerprint cell of the last row it wrote is read back:
+one cell, one request. If that cell differs (the tab was cleared, rewritten or sorted),
+the index is rebuilt from the tab's fingerprint column.
+"""
+import json
+import os
+import re
+
+from form_watermark import row_fingerprint
+
+FINGERPRINT_COLUMN = "_row_fingerprint"
+FINGERPRINT_DIR = os.path.join(os.getenv("CN_CACHE_DIR", ".cache"), "fingerprints")
+
+
+def key_fingerprint(values):
+    """Fingerprint of a row's key column values."""
+    return row_fingerprint(["" if value is None else str(value).strip() for value in values])
+
+
+class FingerprintIndex:
+    """Fingerprints of the rows in one tab, plus where the last one was written."""
+
+    def __init__(self, spreadsheet_id, tab_name, folder=FINGERPRINT_DIR):
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]+", "_", f"{spreadsheet_id}_{tab_name}")
+        self.path = os.path.join(folder, f"{safe_name}.json")
+        self.column = None
+        self.last_row = None
+        self.last_fingerprint = None
+        self.fingerprints = set()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, "r") as f:
+            state = json.load(f)
+        self.column = state.get("column")
+        self.last_row = state.get("last_row")
+        self.last_fingerprint = state.get("last_fingerprint")
+        self.fingerprints = set(state.get("fingerprints", []))
+        return True
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({
+                "column": self.column,
+                "last_row": self.last_row,
+                "last_fingerprint": self.last_fingerprint,
+                "fingerprints": sorted(self.fingerprints),
+            }, f)
+        os.replace(temp_path, self.path)
+
+    def reset(self):
+        self.column = self.last_row = self.last_fingerprint = None
+        self.fingerprints = set()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def rebuild(self, read_range, column_letter):
+        """Reload the fingerprints from the tab's fingerprint column (two reads)."""
+        header_rows = read_range("1:1")
+        header = [str(cell) for cell in header_rows[0]] if header_rows else []
+        self.reset()
+        if FINGERPRINT_COLUMN not in header:
+            return
+        self.column = column_letter(header.index(FINGERPRINT_COLUMN))
+        values = [row[0] if row else "" for row in read_range(f"{self.column}2:{self.column}")]
+        self.fingerprints = {value for value in values if value}
+        filled = [row_number for row_number, value in enumerate(values, start=2) if value]
+        if filled:
+            self.last_row = filled[-1]
+            self.last_fingerprint = values[self.last_row - 2]
+        print(f"Rebuilt the fingerprint index of {len(self.fingerprints)} rows from the tab.")
+
+    def known(self, read_range, column_letter):
+        """
+        Return the fingerprints already in the tab.
+
+        Args:
+            read_range (callable): Returns the rows of an A1 range within the tab.
+            column_letter (callable): Zero-based column index -> A1 letter.
+        """
+        if self.load() and self.column and self.last_row:
+            cell = read_range(f"{self.column}{self.last_row}")
+            if cell and cell[0] and cell[0][0] == self.last_fingerprint:
+                return self.fingerprints
+            print(f"Fingerprint index of {os.path.basename(self.path)} is out of date.")
+        self.rebuild(read_range, column_letter)
+        return self.fingerprints
+
+    def record(self, fingerprints, last_row):
+        """Add the fingerprints of rows just appended; last_row is the sheet row of the last one."""
+        fingerprints = list(fingerprints)
+        self.fingerprints.update(fingerprints)
+        if fingerprints:
+            self.last_row = last_row
+            self.last_fingerprint = fingerprints[-1]
@@ -0,0 +1,182 @@
+"""Per-tab watermark for form-response tabs, so a run only reads the rows submitted since the last one.
+
+Google Forms only ever appends to its response tab, so the watermark is the sheet row of the
+last processed submission plus its Timestamp and a fingerprint of its cells:
+
+    watermark = FormWatermark()
+    header, rows, mark = watermark.read_new_rows(read_range, spreadsheet_id, "RICC", "A", "BJ")
+    ...clean, merge and append the rows...
+    watermark.commit(mark)
+
+The next run reads the header and the sheet from the watermark row on. The watermark row
+itself is read again so its fingerprint can be checked. If it no longer matches (rows were
+sorted, deleted or edited), the whole tab is read and the rows submitted after the watermark's
+Timestamp are picked, wherever they now sit; mark["sheet_rows"] has the sheet row of each.
+State lives in CN_CACHE_DIR/watermarks.json. Commit only after the results are written, so a
+failed run is simply repeated.
+"""
+from datetime import datetime
+import hashlib
+import json
+import os
+import threading
+
+WATERMARK_FILE = os.path.join(os.getenv("CN_CACHE_DIR", ".cache"), "watermarks.json")
+
+# Timestamp formats written by Google Forms in the locales we use
+TIMESTAMP_FORMATS = ["%m/%d/%Y %H:%M:%S", "%d/%m/%Y %H:%M:%S", "%Y-%m-%d %H:%M:%S", "%d.%m.%Y %H:%M:%S"]
+
+
+def row_fingerprint(row):
+    """Hash of a row's cells; trailing blanks are ignored because the API drops them."""
+    cells = [str(cell).strip() for cell in row]
+    while cells and not cells[-1]:
+        cells.pop()
+    return hashlib.sha256("\x1f".join(cells).encode("utf-8")).hexdigest()[:16]
+
+
+def parse_timestamp(value):
+    value = str(value).strip().lstrip("'")
+    for timestamp_format in TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(value, timestamp_format)
+        except ValueError:
+            continue
+    return None
+
+
+class FormWatermark:
+    """Watermarks of every form-response tab, keyed by spreadsheet and tab."""
+
+    def __init__(self, path=WATERMARK_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r") as f:
+            return json.load(f)
+
+    def get(self, spreadsheet_id, tab_name):
+        return self.load().get(f"{spreadsheet_id}/{tab_name}")
+
+    def commit(self, mark):
+        """Store the watermark returned by read_new_rows (None means there was nothing new)."""
+        if not mark:
+            return
+        with self.lock:
+            state = self.load()
+            state[mark["key"]] = {field: mark[field] for field in ("row", "timestamp", "fingerprint")}
+            self.save(state)
+
+    def reset(self, spreadsheet_id, tab_name):
+        """Forget a tab's watermark so the next incremental run starts from the first row."""
+        with self.lock:
+            state = self.load()
+            if state.pop(f"{spreadsheet_id}/{tab_name}", None) is not None:
+                self.save(state)
+
+    def save(self, state):
+        """Write the state atomically so an interrupted run never leaves it half written."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(state, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+    @staticmethod
+    def _row_times(header, rows):
+        """Parsed Timestamp of every row (None when it cannot be read)."""
+        timestamp_index = header.index("Timestamp") if "Timestamp" in header else 0
+        return [parse_timestamp(row[timestamp_index]) if len(row) > timestamp_index else None for row in rows]
+
+    @staticmethod
+    def _new_row_indexes(header, rows, previous):
+        """
+        Indexes into rows of the unprocessed rows, for a tab whose watermark row has moved.
+
+        Sorting can put old rows after the watermark row, so the rows submitted after the
+        watermark's Timestamp are picked wherever they are; blank rows are skipped and rows without
+        a readable Timestamp count as new. Without a watermark Timestamp, the rows after the
+        watermark row's fingerprint are new, or else every row.
+        """
+        watermark_time = parse_timestamp(previous.get("timestamp") or "")
+        if watermark_time is not None:
+            return [
+                index for index, (row, row_time) in enumerate(zip(rows, FormWatermark._row_times(header, rows)))
+                if any(str(cell).strip() for cell in row) and (row_time is None or row_time > watermark_time)
+            ]
+        for index in range(len(rows) - 1, -1, -1):
+            if row_fingerprint(rows[index]) == previous["fingerprint"]:
+                return list(range(index + 1, len(rows)))
+        return list(range(len(rows)))
+
+    def read_new_rows(self, read_range, spreadsheet_id, tab_name, first_column="A", last_column="ZZ"):
+        """
+        Read the header and the rows submitted after the tab's watermark.
+
+        Args:
+            read_range (callable): Returns the rows of an A1 range within the tab, e.g. "A1:BJ1".
+            spreadsheet_id (str): Spreadsheet the tab belongs to (part of the watermark key).
+            tab_name (str): Form-response tab.
+            first_column, last_column (str): Columns to read.
+
+        Returns:
+            tuple: (header, new rows, mark). Pass mark to commit() once the rows are written.
+        """
+        previous = self.get(spreadsheet_id, tab_name)
+
+        if previous:
+            header_rows = read_range(f"{first_column}1:{last_column}1")
+            header = header_rows[0] if header_rows else []
+            block = read_range(f"{first_column}{previous['row']}:{last_column}")
+            if block and row_fingerprint(block[0]) == previous["fingerprint"]:
+                rows, first_row = block[1:], previous["row"] + 1
+            else:
+                print(f"Watermark row {previous['row']} of {tab_name} changed; re-reading the tab to find new rows.")
+                all_rows = read_range(f"{first_column}1:{last_column}")[1:]
+                indexes = self._new_row_indexes(header, all_rows, previous)
+                rows = [all_rows[index] for index in indexes]
+                since = f"rows submitted after {previous.get('timestamp')}"
+                print(f"{tab_name}: {len(rows)} new rows since the last run ({since}).")
+                if not rows:
+                    return header, rows, None
+                # Every row of the tab is processed now: the watermark moves to its last row and
+                # keeps the newest Timestamp seen, whatever the sort order
+                mark = self.mark_after(spreadsheet_id, tab_name, header, all_rows)
+                row_times = self._row_times(header, all_rows)
+                timed = [index for index, row_time in enumerate(row_times) if row_time is not None]
+                if timed:
+                    timestamp_index = header.index("Timestamp") if "Timestamp" in header else 0
+                    mark["timestamp"] = all_rows[max(timed, key=row_times.__getitem__)][timestamp_index]
+                mark["sheet_rows"] = [index + 2 for index in indexes]
+                return header, rows, mark
+        else:
+            all_rows = read_range(f"{first_column}1:{last_column}")
+            header, rows, first_row = (all_rows[0] if all_rows else []), all_rows[1:], 2
+
+        since = f"watermark row {previous['row']}" if previous else "no watermark yet, read every row"
+        print(f"{tab_name}: {len(rows)} new rows since the last run ({since}).")
+        return header, rows, self.mark_after(spreadsheet_id, tab_name, header, rows, first_row)
+
+    @staticmethod
+    def mark_after(spreadsheet_id, tab_name, header, rows, first_row=2):
+        """
+        Watermark after the last of rows, for commit(); None when rows is empty. rows start at sheet
+        row first_row, and mark["sheet_rows"] has the sheet row of each.
+
+        A full run that read the whole tab (rows from sheet row 2 on) commits this too, so the
+        next incremental run starts after it instead of from the first row.
+        """
+        if not rows:
+            return None
+        last_row = rows[-1]
+        timestamp_index = header.index("Timestamp") if "Timestamp" in header else 0
+        return {
+            "key": f"{spreadsheet_id}/{tab_name}",
+            "row": first_row + len(rows) - 1,
+            "timestamp": last_row[timestamp_index] if len(last_row) > timestamp_index else "",
+            "fingerprint": row_fingerprint(last_row),
+            "sheet_rows": list(range(first_row, first_row + len(rows))),
+        }
@@ -1,44 +1,338 @@
 expanded_rows = []
-import pandas as pd
-from google.oauth2 import service_account
-import googleapiclient.discovery
 import os
 import re
 import time
 import json
+import random
+import threading
+from urllib.parse import parse_qs, unquote, urlencode, urlparse
+import api_metrics
+
+# pandas and the Google client libraries are imported where they are used, so importing this
+# module (e.g. for `cn_creation.py --help`) stays fast
+
+
+# Requests per minute shared by every thread of a run (Sheets allows 60 per minute per user by default)
+SHEETS_REQUESTS_PER_MINUTE = int(os.getenv("SHEETS_REQUESTS_PER_MINUTE", "60"))
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5
+
+# Rows per request when a large tab is read in fixed windows (see iter_sheet_windows)
+SHEET_WINDOW_ROWS = int(os.getenv("SHEET_WINDOW_ROWS", "5000"))
+
+
+class RateLimiter:
+    """Thread-safe token bucket shared by all workers so parallel runs stay within the API quota."""
+
+    def __init__(self, requests_per_minute, burst=None):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = burst or max(1, min(10, requests_per_minute // 6))
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class PdfExportRequest:
+    """
+    One tab exported as PDF through the spreadsheet export URL (not part of the Sheets API).
+
+    Shaped like a googleapiclient request so it goes through GoogleSheetUtils.execute and
+    shares its rate limiting and retries.
+    """
+    method = "GET"
+    operation = "export.pdf"
+    http = None
+
+    def __init__(self, credentials, spreadsheet_id, sheet_id):
+        self.credentials = credentials
+        params = {
+            "format": "pdf",
+            "gid": sheet_id,
+            "size": "A4",
+            "portrait": "true",
+            "fitw": "true",
+            "gridlines": "false",
+            "sheetnames": "false",
+            "printtitle": "false",
+        }
+        self.uri = f"https://docs.google.com/spreadsheets/d/{spreadsheet_id}/export?{urlencode(params)}"
+
+    def execute(self, http=None, num_retries=0):
+        from google.auth.transport.requests import AuthorizedSession
+        from googleapiclient.errors import HttpError
+        import httplib2
+        response = AuthorizedSession(self.credentials).get(self.uri, timeout=120)
+        if response.status_code != 200:
+            raise HttpError(httplib2.Response({"status": response.status_code}), response.content, uri=self.uri)
+        return response.content
 
 
 class GoogleSheetUtils:
+    rate_limiter = RateLimiter(SHEETS_REQUESTS_PER_MINUTE)
+    _thread_local = threading.local()
+    _emulator = None
+    dry_run = False
+
+    @staticmethod
+    def set_dry_run(enabled=True):
+        """In dry-run mode reads go through as usual and every write (any non-GET request) is only printed."""
+        GoogleSheetUtils.dry_run = enabled
+
+    @staticmethod
+    def use_emulator(emulator=None):
+        """
+        Point build_service at an in-process SheetsEmulator instead of the live API.
+
+        Also enabled by setting the SHEETS_EMULATOR environment variable (see sheets_emulator.py).
+        """
+        if emulator is None:
+            from sheets_emulator import SheetsEmulator
+            emulator = SheetsEmulator.from_env()
+        GoogleSheetUtils._emulator = emulator
+        return emulator
+
+    @staticmethod
+    def emulator_enabled():
+        return GoogleSheetUtils._emulator is not None or bool(os.getenv("SHEETS_EMULATOR"))
+
+    @staticmethod
+    def configure_rate_limit(requests_per_minute):
+        """Replace the shared rate limiter, e.g. for a project with a raised quota."""
+        GoogleSheetUtils.rate_limiter = RateLimiter(requests_per_minute)
+
+    @staticmethod
+    def _thread_http(request):
+        """
+        Return an authorized Http object owned by the current thread.
+
+        httplib2 connections are not thread-safe, so the shared service object is used to build
+        requests while every worker thread executes them on its own connection.
+        """
+        credentials = getattr(getattr(request, 'http', None), 'credentials', None)
+        if credentials is None:
+            return None
+        http_by_credentials = getattr(GoogleSheetUtils._thread_local, 'http', None)
+        if http_by_credentials is None:
+            http_by_credentials = GoogleSheetUtils._thread_local.http = {}
+        if id(credentials) not in http_by_credentials:
+            import google_auth_httplib2
+            import httplib2
+            http_by_credentials[id(credentials)] = google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http())
+        return http_by_credentials[id(credentials)]
+
+    @staticmethod
+    def _describe_request(request):
+        """Return (operation, tab names, request body bytes) of a request for api_metrics."""
+        operation = getattr(request, "operation", None) or getattr(request, "methodId", None) or type(request).__name__
+        operation = operation[len("sheets."):] if operation.startswith("sheets.") else operation
+        operation = operation.replace("spreadsheets.values.", "values.")
+
+        body = getattr(request, "body", None)
+        ranges = getattr(request, "ranges", None)
+        if ranges is None:
+            # googleapiclient requests: the range is in the URL path, the batchGet query or the batchUpdate body
+            uri = urlparse(getattr(request, "uri", "") or "")
+            ranges = parse_qs(uri.query).get("ranges", [])
+            if "/values/" in uri.path:
+                ranges.append(unquote(uri.path.split("/values/", 1)[1].split(":", 1)[0]))
+            if operation == "values.batchUpdate" and body:
+                ranges += [data.get("range", "") for data in json.loads(body).get("data", [])]
+        tabs = sorted({r.split("!", 1)[0].strip("'") for r in ranges if r})
+
+        if body is None:
+            body_bytes = 0
+        elif isinstance(body, (str, bytes)):
+            body_bytes = len(body)
+        else:
+            body_bytes = len(json.dumps(body, default=str))
+        return operation, ",".join(tabs) or None, body_bytes
+
+    @staticmethod
+    def _response_bytes(response):
+        """Approximate response size: bytes as is, parsed JSON re-serialised."""
+        if isinstance(response, (bytes, str)):
+            return len(response)
+        return len(json.dumps(response, default=str)) if response else 0
+
+    @staticmethod
+    def execute(request):
+        """
+        Execute an API request through the shared rate limiter, retrying 429s and 5xx errors with backoff.
+
+        Every attempt is counted and timed in api_metrics, tagged with the operation and tab.
+        """
+        from googleapiclient.errors import HttpError
+
+        operation, tab, body_bytes = GoogleSheetUtils._describe_request(request)
+        if GoogleSheetUtils.dry_run and getattr(request, "method", "GET") != "GET":
+            print(f"[dry-run] Skipping {operation}{f' on {tab}' if tab else ''} ({body_bytes} bytes)")
+            return None
+
+        http = GoogleSheetUtils._thread_http(request)
+        for attempt in range(MAX_RETRIES + 1):
+            GoogleSheetUtils.rate_limiter.acquire()
+            started = time.perf_counter()
+            try:
+                response = request.execute(http=http) if http is not None else request.execute()
+            except HttpError as e:
+                api_metrics.record("sheets", operation, time.perf_counter() - started, tab=tab, status=e.resp.status,
+                                   bytes_sent=body_bytes, retry=attempt > 0)
+                if e.resp.status not in RETRYABLE_STATUS_CODES or attempt == MAX_RETRIES:
+                    raise
+                delay = min(64, 2 ** attempt) + random.random()
+                print(f"Sheets API returned {e.resp.status}, retrying in {delay:.1f}s...")
+                time.sleep(delay)
+                continue
+            except Exception:
+                api_metrics.record("sheets", operation, time.perf_counter() - started, tab=tab,
+                                   bytes_sent=body_bytes, retry=attempt > 0)
+                raise
+            api_metrics.record("sheets", operation, time.perf_counter() - started, tab=tab, status=200,
+                               bytes_sent=body_bytes, bytes_received=GoogleSheetUtils._response_bytes(response),
+                               retry=attempt > 0)
+            return response
+
     @staticmethod
     def load_credentials(service_account_file: str):
-        """Load credentials from the service account file."""
+        """
+        Load credentials from the service account file.
+
+        The key is read once per process and access tokens come from the on-disk cache shared
+        with other scripts (see credential_provider.py), so a script start skips the token exchange.
+        """
+        if GoogleSheetUtils.emulator_enabled() and not (service_account_file and os.path.exists(service_account_file)):
+            return None  # The emulator does not authenticate
+
         if not service_account_file or not os.path.exists(service_account_file):
             raise FileNotFoundError(f"Service account file not found: {service_account_file}")
 
-        # Load the service account JSON file
-        with open(service_account_file, 'r') as f:
-            service_account_info = json.load(f)
-
-        # Return credentials using the loaded JSON
-        return service_account.Credentials.from_service_account_info(service_account_info)
+        from credential_provider import load_credentials
+        return load_credentials(service_account_file)
 
     @staticmethod
     def build_service(credentials):
-        """Build the Google Sheets API service."""
+        """Build the Google Sheets API service (or return the emulator when one is enabled)."""
+        if GoogleSheetUtils.emulator_enabled():
+            return GoogleSheetUtils._emulator or GoogleSheetUtils.use_emulator()
+        import googleapiclient.discovery
         return googleapiclient.discovery.build('sheets', 'v4', credentials=credentials)
 
     @staticmethod
-    def fetch_sheet_data(service, spreadsheet_id, tab_name, range_):
-        """Fetch data from a specific tab and range."""
+    def fetch_sheet_data(service, spreadsheet_id, tab_name, range_, major_dimension="ROWS"):
+        """Fetch data from a specific tab and range (one list per column with major_dimension="COLUMNS")."""
         sheet_range = f"{tab_name}!{range_}"
-        response = service.spreadsheets().values().get(
+        response = GoogleSheetUtils.execute(service.spreadsheets().values().get(
             spreadsheetId=spreadsheet_id,
-            range=sheet_range
-        ).execute()
+            range=sheet_range,
+            majorDimension=major_dimension
+        ))
         if isinstance(response, dict) and 'values' in response:
             return response['values']
         return []
 
+    @staticmethod
+    def iter_sheet_windows(service, spreadsheet_id, tab_name, first_column, last_column, header_row=1,
+                           window_rows=SHEET_WINDOW_ROWS, major_dimension="ROWS"):
+        """
+        Read a tab in fixed row windows (A2:Y5001, A5002:Y10001, ...) instead of one open-ended range.
+
+        The first window is fetched together with the header row in one batchGet. Reading goes on
+        up to the tab's row count (gridProperties.rowCount), not just to the first short window:
+        the API leaves out empty rows at the end of a range, so a window whose last rows were
+        cleared comes back short while the tab goes on after it. Empty windows are skipped. With
+        major_dimension="COLUMNS" each window comes as one list per column, which
+        DataFrameUtils.iter_dataframes builds without transposing rows.
+
+        Yields:
+            tuple: (header row, the rows (or columns) of one window, sheet row number of the window's first row)
+        """
+        last_row = GoogleSheetUtils.row_count(service, spreadsheet_id, tab_name)
+        start = header_row + 1
+        header = None
+        while True:
+            window = f"{tab_name}!{first_column}{start}:{last_column}{start + window_rows - 1}"
+            if header is None:
+                header_values, values = GoogleSheetUtils.batch_fetch_sheet_data(service, spreadsheet_id, [
+                    f"{tab_name}!{first_column}{header_row}:{last_column}{header_row}", window
+                ], major_dimension=major_dimension)
+                if major_dimension == "COLUMNS":
+                    header = [column[0] if column else "" for column in header_values]
+                else:
+                    header = header_values[0] if header_values else []
+            else:
+                values = GoogleSheetUtils.fetch_sheet_data(service, spreadsheet_id, tab_name,
+                                                           range_=window.split("!", 1)[1],
+                                                           major_dimension=major_dimension)
+            if values or start == header_row + 1:
+                yield header, values, start
+            start += window_rows
+            if start > last_row:
+                return
+
+    @staticmethod
+    def row_count(service, spreadsheet_id, tab_name):
+        """Number of rows in a tab's grid (gridProperties.rowCount), blank rows at the end included."""
+        sheets = GoogleSheetUtils.execute(service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id,
+            fields="sheets.properties(title,gridProperties.rowCount)"
+        ))
+        for sheet in sheets["sheets"]:
+            if sheet["properties"]["title"] == tab_name:
+                return sheet["properties"].get("gridProperties", {}).get("rowCount", 0)
+        raise KeyError(f'Tab "{tab_name}" not found.')
+
+    @staticmethod
+    def batch_fetch_sheet_data(service, spreadsheet_id, ranges, major_dimension="ROWS"):
+        """Fetch several A1 ranges in one values.batchGet call, returning one list of rows (or columns) per range."""
+        response = GoogleSheetUtils.execute(service.spreadsheets().values().batchGet(
+            spreadsheetId=spreadsheet_id,
+            ranges=ranges,
+            majorDimension=major_dimension
+        ))
+        return [value_range.get('values', []) for value_range in response.get('valueRanges', [])]
+
+    @staticmethod
+    def batch_update_values(service, spreadsheet_id, data, value_input_option="RAW"):
+        """
+        Write several ranges in one values.batchUpdate call.
+
+        Args:
+            data (list): [{"range": "Tab!A1:A3", "values": [[...], ...]}, ...]
+        """
+        if not data:
+            return None
+        body = {
+            "valueInputOption": value_input_option,
+            "data": data,
+        }
+        return GoogleSheetUtils.execute(service.spreadsheets().values().batchUpdate(
+            spreadsheetId=spreadsheet_id,
+            body=body
+        ))
+
+    @staticmethod
+    def column_letter(column_index):
+        """Convert a zero-based column index into its A1 letter (0 -> A, 26 -> AA)."""
+        letters = ""
+        column_index += 1
+        while column_index > 0:
+            column_index, remainder = divmod(column_index - 1, 26)
+            letters = chr(ord('A') + remainder) + letters
+        return letters
+
     @staticmethod
     def update_sheet_with_dataframe(service, dataframe, spreadsheet_id, sheet_name):
         # Convert DataFrame to a list of lists
@@ -48,22 +342,145 @@ class GoogleSheetUtils:
         range_to_update = f"{sheet_name}!A1"
 
         # Clear the existing data
-        service.spreadsheets().values().clear(
+        GoogleSheetUtils.execute(service.spreadsheets().values().clear(
             spreadsheetId=spreadsheet_id,
             range=sheet_name
-        ).execute()
+        ))
 
         # Write the new data
         body = {
             "values": data,
             "majorDimension": "ROWS",
         }
-        service.spreadsheets().values().update(
+        GoogleSheetUtils.execute(service.spreadsheets().values().update(
             spreadsheetId=spreadsheet_id,
             range=range_to_update,
             valueInputOption="RAW",
             body=body
-        ).execute()
+        ))
+
+    @staticmethod
+    def append_dataframe(service, dataframe, spreadsheet_id, sheet_name):
+        """
+        Append the rows of a DataFrame below the data already in a tab (values.append).
+
+        Columns are matched to the tab's header row by name. Columns the tab does not have yet are
+        added to the end of its header. An empty tab gets the DataFrame's header first.
+
+        Returns:
+            dict: The values.append response ("updates" holds the updated range), or None when
+            nothing was written.
+        """
+        if dataframe.empty:
+            return None
+        header_rows = GoogleSheetUtils.fetch_sheet_data(service, spreadsheet_id, sheet_name, range_="1:1")
+        header = [str(column) for column in header_rows[0]] if header_rows else []
+        new_columns = [str(column) for column in dataframe.columns if str(column) not in header]
+        if new_columns:
+            # Header row changes: the new columns start right after the existing ones
+            start = GoogleSheetUtils.column_letter(len(header))
+            GoogleSheetUtils.execute(service.spreadsheets().values().update(
+                spreadsheetId=spreadsheet_id,
+                range=f"{sheet_name}!{start}1",
+                valueInputOption="RAW",
+                body={"values": [new_columns], "majorDimension": "ROWS"}
+            ))
+            header += new_columns
+
+        aligned = dataframe.copy()
+        aligned.columns = [str(column) for column in aligned.columns]
+        aligned = aligned.loc[:, ~aligned.columns.duplicated()].reindex(columns=header).fillna("")
+        response = GoogleSheetUtils.execute(service.spreadsheets().values().append(
+            spreadsheetId=spreadsheet_id,
+            range=f"{sheet_name}!A1",
+            valueInputOption="RAW",
+            insertDataOption="INSERT_ROWS",
+            body={"values": aligned.values.tolist(), "majorDimension": "ROWS"}
+        ))
+        print(f"Appended {len(aligned)} rows to {sheet_name}.")
+        return response
+
+    @staticmethod
+    def append_new_rows(service, dataframe, spreadsheet_id, sheet_name, key_columns, rebuild=False):
+        """
+        Append-only write: add the rows whose key is not in the tab yet, never rewriting the tab.
+
+        Each row carries a fingerprint of its key columns in a hidden last column. The local
+        FingerprintIndex (see fingerprint_index.py) knows which fingerprints the tab already holds,
+        so repeated runs neither duplicate a row nor write an unchanged one again.
+
+        Args:
+            key_columns (list): Columns that identify a row, e.g. ["trip_id", "Invoice: Invoice No."].
+            rebuild (bool): Clear the tab and write every row (the old clear-and-rewrite behaviour).
+
+        Returns:
+            int: Number of rows appended.
+
+        Raises:
+            ValueError: The tab has rows but no fingerprint column (it was written before
+                append-only writes), so its rows cannot be told from new ones; rebuild it once.
+        """
+        from fingerprint_index import FINGERPRINT_COLUMN, FingerprintIndex, key_fingerprint
+
+        def read_range(range_):
+            return GoogleSheetUtils.fetch_sheet_data(service, spreadsheet_id, sheet_name, range_=range_)
+
+        index = FingerprintIndex(spreadsheet_id, sheet_name)
+        if rebuild:
+            GoogleSheetUtils.execute(service.spreadsheets().values().clear(
+                spreadsheetId=spreadsheet_id,
+                range=sheet_name
+            ))
+            if not GoogleSheetUtils.dry_run:
+                index.reset()
+            known = set()
+        else:
+            known = index.known(read_range, GoogleSheetUtils.column_letter)
+            if index.column is None and read_range("2:2"):
+                raise ValueError(
+                    f'{sheet_name} has rows but no "{FINGERPRINT_COLUMN}" column, so appending would write '
+                    f'them all again. Run once with --rebuild to rewrite it with fingerprints.'
+                )
+
+        rows = dataframe.copy()
+        rows[FINGERPRINT_COLUMN] = [key_fingerprint(values) for values in rows[key_columns].values.tolist()]
+        rows = rows.drop_duplicates(subset=[FINGERPRINT_COLUMN])
+        new_rows = rows[~rows[FINGERPRINT_COLUMN].isin(known)]
+        print(f"{sheet_name}: {len(new_rows)} new rows, {len(rows) - len(new_rows)} already in the tab.")
+
+        response = GoogleSheetUtils.append_dataframe(service, new_rows, spreadsheet_id, sheet_name)
+        if response is None:  # nothing new, or a dry run
+            return 0
+
+        if index.column is None:
+            # First append with fingerprints: find the column and hide it from the people using the tab
+            header = read_range("1:1")[0]
+            column_index = header.index(FINGERPRINT_COLUMN)
+            index.column = GoogleSheetUtils.column_letter(column_index)
+            GoogleSheetUtils.hide_column(service, spreadsheet_id, sheet_name, column_index)
+        updated_range = response.get("updates", {}).get("updatedRange", "")
+        last_row = re.search(r"(\d+)$", updated_range)
+        index.record(new_rows[FINGERPRINT_COLUMN].tolist(), int(last_row.group(1)) if last_row else None)
+        index.save()
+        return len(new_rows)
+
+    @staticmethod
+    def hide_column(service, spreadsheet_id, sheet_name, column_index):
+        """Hide one column (zero-based) of a tab; its values are still read and written as usual."""
+        sheets = GoogleSheetUtils.execute(service.spreadsheets().get(spreadsheetId=spreadsheet_id))
+        sheet_id = next(sheet["properties"]["sheetId"] for sheet in sheets["sheets"]
+                        if sheet["properties"]["title"] == sheet_name)
+        GoogleSheetUtils.execute(service.spreadsheets().batchUpdate(
+            spreadsheetId=spreadsheet_id,
+            body={"requests": [{
+                "updateDimensionProperties": {
+                    "range": {"sheetId": sheet_id, "dimension": "COLUMNS",
+                              "startIndex": column_index, "endIndex": column_index + 1},
+                    "properties": {"hiddenByUser": True},
+                    "fields": "hiddenByUser",
+                }
+            }]}
+        ))
 
     @staticmethod
     def update_cells(service_api, spreadsheet_id, sheet_name, value_dict):
@@ -71,17 +488,17 @@ class GoogleSheetUtils:
             body = {
                 "values": [[value]]
             }
-            service_api.spreadsheets().values().update(
+            GoogleSheetUtils.execute(service_api.spreadsheets().values().update(
                 spreadsheetId=spreadsheet_id,
                 range=f"{sheet_name}!{cell}",
                 valueInputOption="RAW",
                 body=body
-            ).execute()
+            ))
 
     @staticmethod
     def copy_sheet(service, spreadsheet_id, template_sheet_name, new_sheet_name):
         # Get the sheet ID of the template sheet
-        sheets = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
+        sheets = GoogleSheetUtils.execute(service.spreadsheets().get(spreadsheetId=spreadsheet_id))
         sheet_id = None
         for sheet in sheets["sheets"]:
             if sheet["properties"]["title"] == template_sheet_name:
@@ -97,25 +514,114 @@ class GoogleSheetUtils:
                 }
             }]
         }
-        service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=request).execute()
+        response = GoogleSheetUtils.execute(service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=request))
+
+        # Return the sheet ID of the new tab (None in dry-run mode, where nothing is copied)
+        if response is None:
+            return None
+        return response["replies"][0]["duplicateSheet"]["properties"]["sheetId"]
+
+    @staticmethod
+    def sheet_ids(service, spreadsheet_id):
+        """Return {tab title: sheet ID} of a spreadsheet (one spreadsheets.get)."""
+        sheets = GoogleSheetUtils.execute(service.spreadsheets().get(spreadsheetId=spreadsheet_id))
+        return {sheet["properties"]["title"]: sheet["properties"]["sheetId"] for sheet in sheets["sheets"]}
 
     @staticmethod
-    def update_cell_with_delay(sheet_id, cell_range, value):
-        service = googleapiclient.discovery.build('sheets', 'v4', credentials=credentials)
+    def ensure_sheet(service, spreadsheet_id, sheet_name):
+        """Add an empty tab named sheet_name unless the spreadsheet has one; returns True when it was added."""
+        if sheet_name in GoogleSheetUtils.sheet_ids(service, spreadsheet_id):
+            return False
+        GoogleSheetUtils.execute(service.spreadsheets().batchUpdate(
+            spreadsheetId=spreadsheet_id,
+            body={"requests": [{"addSheet": {"properties": {"title": sheet_name}}}]}
+        ))
+        print(f"Added the {sheet_name} tab.")
+        return True
+
+    @staticmethod
+    def create_spreadsheet(service, title):
+        """
+        Create an empty spreadsheet (the API adds one blank tab).
+
+        Returns:
+            dict: The spreadsheets.create response, or None in dry-run mode.
+        """
+        return GoogleSheetUtils.execute(service.spreadsheets().create(
+            body={"properties": {"title": title}},
+            fields="spreadsheetId,properties.title,sheets.properties"
+        ))
+
+    @staticmethod
+    def copy_sheet_to(service, spreadsheet_id, sheet_id, destination_spreadsheet_id):
+        """
+        Copy one tab into another spreadsheet (sheets.copyTo); the copy is titled "Copy of <title>".
+
+        Returns:
+            int: Sheet ID of the copy in the destination, or None in dry-run mode.
+        """
+        response = GoogleSheetUtils.execute(service.spreadsheets().sheets().copyTo(
+            spreadsheetId=spreadsheet_id,
+            sheetId=sheet_id,
+            body={"destinationSpreadsheetId": destination_spreadsheet_id}
+        ))
+        return None if response is None else response["sheetId"]
+
+    @staticmethod
+    def rename_and_delete_sheets(service, spreadsheet_id, renames=None, deletes=()):
+        """Rename ({sheet ID: new title}) and delete tabs of one spreadsheet in a single batchUpdate."""
+        requests = [{"updateSheetProperties": {"properties": {"sheetId": sheet_id, "title": title},
+                                               "fields": "title"}}
+                    for sheet_id, title in (renames or {}).items()]
+        requests += [{"deleteSheet": {"sheetId": sheet_id}} for sheet_id in deletes]
+        if requests:
+            GoogleSheetUtils.execute(service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id,
+                                                                         body={"requests": requests}))
+
+    @staticmethod
+    def export_sheet_pdf(service, credentials, spreadsheet_id, sheet_id):
+        """Export one tab (by sheet ID) as PDF and return the bytes, or None when there is no tab (dry run)."""
+        if sheet_id is None:
+            return None
+        if hasattr(service, "export_pdf"):  # The emulator renders its own PDF
+            return GoogleSheetUtils.execute(service.export_pdf(spreadsheetId=spreadsheet_id, sheetId=sheet_id))
+        return GoogleSheetUtils.execute(PdfExportRequest(credentials, spreadsheet_id, sheet_id))
+
+    @staticmethod
+    def update_cell_with_delay(service, sheet_id, cell_range, value):
+        """Update a single cell; pacing comes from the shared rate limiter instead of a fixed sleep."""
         body = {"range": cell_range, "values": [[value]], "majorDimension": "ROWS"}
-        service.spreadsheets().values().update(
+        GoogleSheetUtils.execute(service.spreadsheets().values().update(
             spreadsheetId=sheet_id,
             range=cell_range,
             valueInputOption="USER_ENTERED",
             body=body
-        ).execute()
-        time.sleep(4)  # Add a delay of 1 second
+        ))
+
+
+class SheetsSession:
+    """The spreadsheet ID, credentials and Sheets service shared by the functions of one pipeline run."""
+
+    def __init__(self, spreadsheet_id, credentials, service):
+        self.spreadsheet_id = spreadsheet_id
+        self.credentials = credentials
+        self.service = service
+
+    @classmethod
+    def from_env(cls, service_account_file="inv-cn-creation.json"):
+        """Load .env, then read SPREADSHEET_ID and build the service from the service account file."""
+        from dotenv import load_dotenv
+        load_dotenv()
+        credentials = GoogleSheetUtils.load_credentials(service_account_file)
+        return cls(os.getenv("SPREADSHEET_ID"), credentials, GoogleSheetUtils.build_service(credentials))
 
 
 class DataFrameUtils:
     @staticmethod
     def process_data_to_dataframe(raw_data):
         """Process raw sheet data into a pandas DataFrame."""
+        import pandas as pd
+
         if raw_data:
             df = pd.DataFrame(raw_data)
             new_header = df.iloc[0]  # Use the first row as header
@@ -125,6 +631,120 @@ class DataFrameUtils:
             return df
         raise ValueError("No data available to process into DataFrame.")
 
+    @staticmethod
+    def columns_to_dataframe(header, columns, first_index=1):
+        """
+        Build a DataFrame straight from per-column value lists, padding each column to the longest with "N/A".
+
+        On wide, sparse tabs this skips the row-to-column transpose of building from rows. Every
+        header column is built, empty or not, so windows of one tab share one layout. Columns to
+        the right of the last header cell are left out.
+        """
+        import pandas as pd
+
+        row_count = max(map(len, columns), default=0)
+        names, data = [], {}
+        for position, name in enumerate(header):
+            values = columns[position] if position < len(columns) else []
+            # Keyed by position, so repeated header names keep one column each
+            data[position] = list(values) + ["N/A"] * (row_count - len(values))
+            names.append(name)
+        df = pd.DataFrame(data, index=pd.RangeIndex(first_index, first_index + row_count), dtype=object)
+        df.columns = pd.Index(names)
+        return df
+
+    @staticmethod
+    def iter_dataframes(windows, major_dimension="ROWS"):
+        """
+        Turn the windows of GoogleSheetUtils.iter_sheet_windows into one DataFrame per window.
+
+        Each chunk looks like the matching slice of process_data_to_dataframe on the whole tab:
+        the header row names the columns, missing cells are "N/A" and the index runs on from
+        chunk to chunk. Cells to the right of the last header cell are left out. Windows read
+        with major_dimension="COLUMNS" are built by columns_to_dataframe.
+        """
+        import pandas as pd
+
+        offset = 1
+        for header, values, _ in windows:
+            if not header:
+                raise ValueError("No data available to process into DataFrame.")
+            if major_dimension == "COLUMNS":
+                df = DataFrameUtils.columns_to_dataframe(header, values, first_index=offset)
+            else:
+                width = len(header)
+                df = pd.DataFrame([row[:width] + [None] * (width - len(row)) for row in values],
+                                  columns=pd.Index(header), index=pd.RangeIndex(offset, offset + len(values)))
+                df.fillna("N/A", inplace=True)  # Fill missing values with "N/A"
+            offset += len(df)
+            yield df
+
+    @staticmethod
+    def repeat_rows(df, column, values_per_row):
+        """
+        Repeat each row once per value, with column set to each value in turn.
+
+        Row i of df is repeated len(values_per_row[i]) times; its index label repeats with it, as it
+        would when the DataFrame is built from copied rows.
+        """
+        import numpy as np
+        from itertools import chain
+
+        counts = np.fromiter((len(values) for values in values_per_row), dtype=np.int64, count=len(df))
+        expanded = df.iloc[np.repeat(np.arange(len(df)), counts)].copy()
+        values = np.empty(int(counts.sum()), dtype=object)
+        values[:] = list(chain.from_iterable(values_per_row))
+        expanded[column] = values
+        return expanded
+
+    @staticmethod
+    def explode_trip_ids(df, column, backend=None):
+        """
+        One row per trip ID written in column ("T-250114-3, T-250114-4" gives two rows).
+
+        Rows without a recognizable trip ID are kept as they are. backend: see dataframe_backend.py.
+        """
+        from dataframe_backend import as_strings
+        from trip_index import TRIP_ID_PATTERN
+
+        found = as_strings(df[column], backend).str.findall(TRIP_ID_PATTERN.pattern, flags=TRIP_ID_PATTERN.flags)
+        values = [trip_ids if trip_ids else [original] for trip_ids, original in zip(found, df[column])]
+        return DataFrameUtils.repeat_rows(df, column, values)
+
+    @staticmethod
+    def expand_comma_separated(df, column, backend=None):
+        """
+        One row per comma-separated value in column (e.g. several invoice numbers in one cell).
+
+        The split values are stripped; cells without a comma are kept exactly as they are.
+        """
+        from dataframe_backend import as_strings
+
+        parts = as_strings(df[column], backend).str.split(",")
+        values = [[part.strip() for part in pieces] if len(pieces) > 1 else [original]
+                  for pieces, original in zip(parts, df[column])]
+        return DataFrameUtils.repeat_rows(df, column, values)
+
+    @staticmethod
+    def drop_duplicate_rows(df, subset, backend=None):
+        """
+        drop_duplicates(subset=subset), comparing the key columns as backend strings.
+
+        Key columns holding anything but text (numbers, booleans) are compared as pandas compares
+        them, since 1, 1.0 and True are one value to pandas but three strings.
+        """
+        import numpy as np
+        from pandas.api.types import infer_dtype
+        from dataframe_backend import resolve_backend
+
+        text_keys = all(infer_dtype(df[column], skipna=True) in ("string", "empty") for column in subset)
+        if text_keys and resolve_backend(backend) == "arrow":
+            duplicated = df[subset].astype("string[pyarrow]").duplicated()
+        else:
+            duplicated = df.duplicated(subset=subset)
+        # take() returns a frame of its own, which the callers go on to modify in place
+        return df.take(np.flatnonzero(~duplicated.values))
+
     @staticmethod
     def filter_dataframe(df, column, value, col_range_true, col_range_false):
         """
@@ -153,6 +773,8 @@ class DataFrameUtils:
     @staticmethod
     def merge_columns(df, columns_to_merge):
         """Merge duplicated columns into one column, either with or without values."""
+        import pandas as pd
+
         for column in columns_to_merge:
             if column in df.columns:
                 df[column] = df[columns_to_merge].apply(lambda row: ' '.join([str(x) for x in row if pd.notnull(x)]),
@@ -166,6 +788,8 @@ class DataFrameUtils:
         Process a DataFrame by splitting trip IDs into individual rows,
         then filter out rows with invalid Trip ID values.
         """
+        import pandas as pd
+
         expanded_rows = []  # Initialize a list to store expanded rows
 
         for index, row in df.iterrows():
@@ -193,6 +817,9 @@ class DataFrameUtils:
     @staticmethod
     def match_trip_details(df_1, optinv_df, trip_column):
         """Match trip details from another DataFrame based on a trip column, handling multiple invoices."""
+        import pandas as pd
+        from trip_index import normalize_trip_id, normalize_trip_series
+
         try:
             # Normalize column names for consistency
             df_1.columns = df_1.columns.str.strip().str.lower()
@@ -202,9 +829,10 @@ class DataFrameUtils:
             if trip_column.lower() not in df_1.columns or "trip" not in optinv_df.columns:
                 raise KeyError('Required columns "Trip ID" in df_1 or "Trip" in optinv_df are missing.')
 
-            # Ensure 'Trip ID' and 'Trip' are strings for matching
+            # Ensure 'Trip ID' and 'Trip' are strings; matching uses the shared trip ID normalization
             df_1[trip_column] = df_1[trip_column].astype(str).str.strip()
             optinv_df["trip"] = optinv_df["trip"].astype(str).str.strip()
+            optinv_keys = normalize_trip_series(optinv_df["trip"])
 
             # Initialize the result DataFrame with the same columns as df_1
             result_df = pd.DataFrame(columns=df_1.columns)
@@ -223,7 +851,7 @@ class DataFrameUtils:
                 # Iterate over trip IDs to find matches in optinv_df
                 for trip_id in trip_ids_list:
                     # Get all matching rows in optinv_df for the current trip ID
-                    matched_invoices = optinv_df[optinv_df["trip"] == trip_id]
+                    matched_invoices = optinv_df[optinv_keys == normalize_trip_id(trip_id)]
 
                     if not matched_invoices.empty:
                         # Add a new row to result_df for each match
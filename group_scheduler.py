@@ -0,0 +1,108 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import traceback
+
+
+# Number of notes built at the same time; the API quota is enforced by GoogleSheetUtils.rate_limiter
+MAX_WORKERS = int(os.getenv("CN_MAX_WORKERS", "4"))
+
+
+class GroupResult:
+    """Outcome of one group: the handler's return value, or the error that stopped it."""
+
+    def __init__(self, key, result=None, error=None, details=None):
+        self.key = key
+        self.result = result
+        self.error = error
+        self.details = details
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class GroupScheduler:
+    """
+    Spread independent groups (one credit note or invoice each) over a thread pool.
+
+    All workers share one Sheets service and the GoogleSheetUtils rate limiter, so a run is
+    bounded by the API quota rather than by serial request latency. A failing group is
+    recorded in its GroupResult and does not stop the others.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        self.max_workers = max(1, max_workers)
+
+    @staticmethod
+    def _run_one(handler, key, args):
+        try:
+            return GroupResult(key, result=handler(key, *args))
+        except Exception as e:
+            return GroupResult(key, error=e, details=traceback.format_exc())
+
+    def run(self, jobs, handler):
+        """
+        Run handler(key, *args) for every (key, args) job.
+
+        Args:
+            jobs (iterable): (key, args) tuples, e.g. (email_address, (group, credit_note_number)).
+            handler (callable): Builds one note; its return value is stored in GroupResult.result.
+
+        Returns:
+            list: GroupResult objects in the order the jobs were given.
+        """
+        jobs = list(jobs)
+        if self.max_workers == 1 or len(jobs) <= 1:
+            results = [self._run_one(handler, key, args) for key, args in jobs]
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [executor.submit(self._run_one, handler, key, args) for key, args in jobs]
+                results = [future.result() for future in futures]
+
+        failed = [result for result in results if not result.ok]
+        print(f"Processed {len(results)} groups: {len(results) - len(failed)} succeeded, {len(failed)} failed.")
+        for result in failed:
+            print(f"Group {result.key!r} failed: {result.error}\n{result.details}")
+        return results
+
+
+class NoteNumbers:
+    """
+    Hand out sequential note numbers (CN-CC-001426, RE-240171, ...) as groups create their note.
+
+    A group takes its number only once it is about to create its tab, so a group that fails
+    before that (e.g. on amounts that cannot be read) uses none up. A group that fails after
+    taking one leaves a gap in the numbering; report() lists those numbers at the end of the
+    run. With several workers the numbers follow the order the groups get there, not the
+    order of the jobs.
+    """
+
+    def __init__(self, first_number, number_format):
+        self.next_number = first_number
+        self.number_format = number_format
+        self.taken = {}
+        self.lock = threading.Lock()
+
+    def take(self, key):
+        """The next number, recorded for the group key."""
+        with self.lock:
+            number = self.number_format.format(self.next_number)
+            self.next_number += 1
+            self.taken[key] = number
+        print(f"Generated note number {number} for {key!r}")
+        return number
+
+    def report(self, results):
+        """
+        Print the numbers taken by groups that failed afterwards.
+
+        Returns:
+            dict: {note number: group key} of the numbers no note was finished with.
+        """
+        failed = {result.key for result in results if not result.ok}
+        burned = {number: key for key, number in self.taken.items() if key in failed}
+        if burned:
+            print(f"{len(burned)} note numbers were taken by groups that failed and are not used: "
+                  + ", ".join(f"{number} ({key!r})" for number, key in sorted(burned.items())))
+        return burned
@@ -5,57 +5,515 @@ Download the first PDF file from each invoice.
 Save the file locally or upload it elsewhere (e.g., Google Drive, AWS S3)"""
 
 
-from simple_salesforce import Salesforce
-import requests
+from salesforce_source import BulkQueryClient, REFERENCE_QUERIES, connect
+from pdf_store import PdfStore
+import api_metrics
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+import csv
+import hashlib
+import importlib.util
+import json
 import os
+import random
+import sys
+import tempfile
+import threading
+import time
 
-# Salesforce credentials [it will be added to an .env file and won't be mentioned here]
-SF_USERNAME = "username"
-SF_PASSWORD = "password"
-SF_SECURITY_TOKEN = "security_token"
-SF_DOMAIN = "domain"
+# Salesforce connection, opened on first use so importing this module does not log in
+# (SF_USERNAME, SF_PASSWORD, SF_SECURITY_TOKEN and SF_DOMAIN come from the .env file)
+_salesforce = None
 
-# Connect to Salesforce
-sf = Salesforce(username=SF_USERNAME, password=SF_PASSWORD, security_token=SF_SECURITY_TOKEN, domain=SF_DOMAIN)
 
-def download_invoices(output_folder="invoices"):
-    """Download the first PDF invoice from Salesforce where Payment Method is 'Influencer Invoice' or 'Marketing'."""
+def salesforce():
+    """Return the shared Salesforce connection, connecting the first time it is needed."""
+    global _salesforce
+    if _salesforce is None:
+        _salesforce = connect()
+    return _salesforce
+
+
+# Download engine tuning
+MAX_WORKERS = int(os.getenv("DOWNLOAD_MAX_WORKERS", "8"))
+PER_HOST_LIMIT = int(os.getenv("DOWNLOAD_PER_HOST_LIMIT", "4"))
+MAX_RETRIES = 4
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+PROGRESS_EVERY = 25
+CHUNK_SIZE = 256 * 1024  # bytes held in memory per download at any time
+
+
+class DownloadEngine:
+    """
+    Download files over one pooled requests.Session with a bounded worker pool.
+
+    Connections are reused across downloads, each host gets at most per_host_limit requests
+    in flight, failed requests are retried with exponential backoff (honouring Retry-After),
+    and progress/throughput is printed while the pool drains. With a PdfStore, jobs naming a
+    "store_name" are written into the store, and sources it already holds are not fetched again.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, per_host_limit=PER_HOST_LIMIT, max_retries=MAX_RETRIES,
+                 backoff=1.0, session=None, store=None):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.session = session or requests.Session()
+        self.store = store
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.lock = threading.Lock()
+        self.host_slots = defaultdict(lambda: threading.BoundedSemaphore(self.per_host_limit))
+        self.total = 0
+        self.completed = 0
+        self.failed = 0
+        self.retries = 0
+        self.reused = 0
+        self.bytes_downloaded = 0
+        self.started_at = None
+
+    def _host_slot(self, url):
+        with self.lock:
+            return self.host_slots[urlparse(url).netloc]
+
+    def _retry_delay(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return int(retry_after)
+        return self.backoff * (2 ** attempt) + random.random()
+
+    def fetch(self, url, file_path, headers=None, service="http", operation="download"):
+        """
+        Download one URL to file_path, retrying transient failures. Returns (bytes written, sha256 hex).
+
+        Every attempt is counted and timed (including the body) in api_metrics under service/operation.
+        """
+        import requests
+
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                with self._host_slot(url), api_metrics.track(service, operation) as call:
+                    call.retry = attempt > 0
+                    response = self.session.get(url, headers=headers, stream=True, timeout=(10, 120))
+                    call.status = response.status_code
+                    if response.status_code == 200:
+                        size, sha256 = self._stream_to_file(response, file_path)
+                        call.bytes_received = size
+                        return size, sha256
+                    if response.status_code not in RETRYABLE_STATUS_CODES:
+                        raise requests.HTTPError(f"Status Code: {response.status_code}", response=response)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+            finally:
+                if response is not None:
+                    response.close()
+
+            if attempt == self.max_retries:
+                raise requests.HTTPError(f"Status Code: {response.status_code} after {attempt + 1} attempts",
+                                         response=response)
+            with self.lock:
+                self.retries += 1
+            time.sleep(self._retry_delay(attempt, response))
+
+    @staticmethod
+    def _stream_to_file(response, file_path):
+        """
+        Stream the body to disk in CHUNK_SIZE pieces through a temp file in the same folder,
+        then rename it into place so a file_path never holds a partial download.
+        """
+        folder = os.path.dirname(os.path.abspath(file_path))
+        fd, temp_path = tempfile.mkstemp(dir=folder, prefix=".download-", suffix=".part")
+        written = 0
+        checksum = hashlib.sha256()
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    if chunk:
+                        temp_file.write(chunk)
+                        checksum.update(chunk)
+                        written += len(chunk)
+            os.replace(temp_path, file_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return written, checksum.hexdigest()
+
+    def _fetch_into_store(self, job):
+        """Fetch a job into the store, or just link its name when the source was fetched before."""
+        source_key = job.get("source_key")
+        sha256 = self.store.lookup_source(source_key) if source_key else None
+        if sha256:
+            self.store.link(job["store_name"], sha256, source_key)
+            return dict(job, ok=True, bytes=0, sha256=sha256, reused=True)
+
+        staging_path = self.store.staging_path()
+        try:
+            size, sha256 = self.fetch(job["url"], staging_path, headers=job.get("headers"),
+                                      service=job.get("service", "http"), operation=job.get("operation", "download"))
+        except BaseException:
+            if os.path.exists(staging_path):
+                os.remove(staging_path)
+            raise
+        self.store.add_file(staging_path, job["store_name"], sha256=sha256, source_key=source_key)
+        return dict(job, ok=True, bytes=size, sha256=sha256)
+
+    def _download_one(self, job):
+        url = job["url"]
+        file_path = job.get("store_name") or job["file_path"]
+        try:
+            if self.store is not None and job.get("store_name"):
+                result = self._fetch_into_store(job)
+            else:
+                size, sha256 = self.fetch(url, job["file_path"], headers=job.get("headers"),
+                                          service=job.get("service", "http"), operation=job.get("operation", "download"))
+                result = dict(job, ok=True, bytes=size, sha256=sha256)
+        except Exception as e:
+            result = dict(job, ok=False, error=str(e))
+
+        with self.lock:
+            self.completed += 1
+            if result.get("reused"):
+                self.reused += 1
+            if result["ok"]:
+                self.bytes_downloaded += result["bytes"]
+            else:
+                self.failed += 1
+            if self.completed % PROGRESS_EVERY == 0:
+                self.print_progress()
+        if result.get("reused"):
+            print(f"Already stored: {file_path}")
+        elif result["ok"]:
+            print(f"Downloaded: {file_path}")
+        else:
+            print(f"Failed to download {job.get('name', url)} ({result['error']})")
+        return result
+
+    def print_progress(self):
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        megabytes = self.bytes_downloaded / (1024 * 1024)
+        print(f"Progress: {self.completed}/{self.total} files, {self.failed} failed, {self.reused} already stored, {self.retries} retries, "
+              f"{megabytes:.1f} MB in {elapsed:.1f}s ({megabytes / elapsed:.2f} MB/s, {self.completed / elapsed:.1f} files/s)")
+
+    def download_all(self, jobs, on_result=None):
+        """
+        Download every job concurrently, keeping at most a few jobs per worker queued.
+
+        Args:
+            jobs (iterable): dicts with "url", "file_path" (or "store_name" and "source_key" when
+                the engine has a store) and optionally "headers", "name" and the api_metrics
+                "service"/"operation" tags.
+                May be a generator; it is consumed lazily so memory does not grow with the job count.
+            on_result (callable, optional): called with each job dict plus "ok" and "bytes"/"sha256" or "error".
+
+        Returns:
+            dict: counts of completed, failed and already stored downloads, retries and bytes written.
+        """
+        self.started_at = time.monotonic()
+        in_flight = threading.BoundedSemaphore(self.max_workers * 2)
+
+        def run(job):
+            try:
+                result = self._download_one(job)
+                if on_result:
+                    on_result(result)
+            finally:
+                in_flight.release()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for job in jobs:
+                in_flight.acquire()
+                with self.lock:
+                    self.total += 1
+                executor.submit(run, job)
+
+        if self.total:
+            self.print_progress()
+        return {
+            "completed": self.completed,
+            "failed": self.failed,
+            "reused": self.reused,
+            "retries": self.retries,
+            "bytes": self.bytes_downloaded,
+        }
+
+
+def refresh_reference_data(output_folder="reference_data", bulk_client=None):
+    """
+    Refresh the trip/invoice reference tables (the data behind the SF-INFL and
+    "Opportunties ID + Invoice ID" tabs) through Bulk API 2.0, one Parquet file per query.
+    Falls back to CSV when pyarrow is not installed.
+    """
     os.makedirs(output_folder, exist_ok=True)
+    bulk_client = bulk_client or BulkQueryClient.from_salesforce(salesforce())
+    written = {}
+    use_parquet = importlib.util.find_spec("pyarrow") is not None
+    for name, spec in REFERENCE_QUERIES.items():
+        if use_parquet:
+            file_path = os.path.join(output_folder, f"{name}.parquet")
+            rows = bulk_client.query_to_parquet(spec["query"], file_path, spec["columns"])
+        else:
+            file_path = os.path.join(output_folder, f"{name}.csv")
+            df = bulk_client.query_to_dataframe(spec["query"], spec["columns"])
+            df.to_csv(file_path, index=False, quoting=csv.QUOTE_MINIMAL)
+            rows = len(df)
+        print(f"Refreshed {name}: {rows} rows -> {file_path}")
+        written[name] = file_path
+    return written
+
+
+MANIFEST_FILE = "manifest.json"
+
+
+def load_manifest(output_folder):
+    """
+    Load the local sync manifest:
+    {"watermark": <max LastModifiedDate seen, as a SOQL datetime>, "invoices": {invoice Id: {attachment_id, last_modified, size, sha256, file}}}
+    where file is the name the PDF is indexed under in the PdfStore.
+    """
+    manifest_path = os.path.join(output_folder, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {"watermark": None, "invoices": {}}
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(output_folder, manifest):
+    """Write the manifest atomically so an interrupted run never leaves it half written."""
+    manifest_path = os.path.join(output_folder, MANIFEST_FILE)
+    temp_path = f"{manifest_path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(temp_path, manifest_path)
+
 
-    # Query invoices with required Payment Methods
-    query = """
-    SELECT Id, Name, (SELECT Id, Name, ContentType, Body FROM Attachments ORDER BY CreatedDate ASC)
+def soql_datetime(salesforce_timestamp):
+    """Convert a Salesforce timestamp ("2025-01-31T09:15:00.000+0000") into a SOQL datetime literal."""
+    parsed = datetime.strptime(salesforce_timestamp, "%Y-%m-%dT%H:%M:%S.%f%z")
+    return parsed.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def attachment_source_key(attachment):
+    """Identify one version of an attachment, so the same version is never fetched twice."""
+    return f"Attachment/{attachment['Id']}@{attachment.get('LastModifiedDate')}"
+
+
+def is_unchanged(manifest_entry, attachment, store):
+    """True when the manifest already holds this exact attachment version and the store still has its blob."""
+    return (
+        manifest_entry is not None
+        and manifest_entry.get("attachment_id") == attachment["Id"]
+        and manifest_entry.get("last_modified") == attachment.get("LastModifiedDate")
+        and manifest_entry.get("size") == attachment.get("BodyLength")
+        and store.has(manifest_entry.get("sha256"))
+    )
+
+
+def query_records(query):
+    """Yield the records of a SOQL query page by page, timing every REST call in api_metrics."""
+    sf = salesforce()
+    next_records_url = None
+    while True:
+        with api_metrics.track("salesforce", "rest.queryMore" if next_records_url else "rest.query") as call:
+            if next_records_url:
+                result = sf.query_more(next_records_url, identifier_is_url=True)
+            else:
+                call.bytes_sent = len(query)
+                result = sf.query(query)
+            call.status = 200
+        yield from result["records"]
+        if result.get("done", True):
+            return
+        next_records_url = result["nextRecordsUrl"]
+
+
+# Invoices whose attachments are downloaded
+INVOICE_SCOPE = "Payment_Method__c IN ('Influencer Invoice', 'Marketing')"
+# Invoice Ids per query when re-reading the invoices behind changed attachments
+INVOICE_ID_CHUNK = 200
+
+
+def track_last_modified(sync_state, *timestamps):
+    """Keep the latest of the Salesforce timestamps in sync_state["max_last_modified"] (SOQL datetime)."""
+    modified = [soql_datetime(m) for m in timestamps if m]
+    if sync_state is not None and modified:
+        sync_state["max_last_modified"] = max([sync_state.get("max_last_modified") or ""] + modified)
+
+
+def changed_invoice_ids(since, sync_state=None):
+    """
+    Return the Ids of the invoices in scope with an attachment added or modified after since.
+
+    Attachments are selected on their own LastModifiedDate, so an attachment added later is found
+    even when the invoice record itself was not touched.
+    """
+    query = f"""
+    SELECT ParentId, LastModifiedDate
+    FROM Attachment
+    WHERE LastModifiedDate > {since}
+    AND ParentId IN (SELECT Id FROM Invoice__c WHERE {INVOICE_SCOPE})
+    """
+    invoice_ids = {}
+    for attachment in query_records(query):
+        invoice_ids[attachment['ParentId']] = None
+        track_last_modified(sync_state, attachment.get('LastModifiedDate'))
+    return list(invoice_ids)
+
+
+def iter_invoices(since=None, sync_state=None):
+    """
+    Yield the invoices in scope with their attachment metadata, oldest attachment first.
+
+    Without since every invoice is queried. With since only the invoices with an attachment
+    modified after it are, in chunks of INVOICE_ID_CHUNK Ids.
+    """
+    # Metadata only: selecting Body here would pull every attachment into the query response
+    select = """
+    SELECT Id, Name, LastModifiedDate,
+        (SELECT Id, Name, ContentType, BodyLength, LastModifiedDate FROM Attachments ORDER BY CreatedDate ASC)
     FROM Invoice__c
-    WHERE Payment_Method__c IN ('Influencer Invoice', 'Marketing')
     """
-    invoices = sf.query_all(query)['records']
+    if not since:
+        for invoice in query_records(f"{select} WHERE {INVOICE_SCOPE}"):
+            attachments = (invoice.get('Attachments') or {}).get('records', [])
+            track_last_modified(sync_state, *[a.get('LastModifiedDate') for a in attachments])
+            yield invoice
+        return
+
+    invoice_ids = changed_invoice_ids(since, sync_state=sync_state)
+    print(f"{len(invoice_ids)} invoices have attachments modified after {since}")
+    for start in range(0, len(invoice_ids), INVOICE_ID_CHUNK):
+        id_list = ", ".join(f"'{invoice_id}'" for invoice_id in invoice_ids[start:start + INVOICE_ID_CHUNK])
+        yield from query_records(f"{select} WHERE Id IN ({id_list})")
 
-    for invoice in invoices:
+
+def iter_invoice_jobs(store, manifest=None, since=None, sync_state=None):
+    """
+    Yield one download job per invoice whose first attachment is a PDF, paging through the query lazily.
+
+    Args:
+        store (PdfStore): Store the PDFs are written to.
+        manifest (dict, optional): Sync manifest; attachments it already holds unchanged are skipped.
+        since (str, optional): SOQL datetime ("2025-01-31T09:15:00Z"); only invoices with an attachment
+            added or modified after it are queried, whether or not the invoice record changed.
+        sync_state (dict, optional): Receives "max_last_modified" (SOQL datetime) across the queried attachments.
+    """
+    invoices_in_manifest = (manifest or {}).get("invoices", {})
+    sf = salesforce()
+    for invoice in iter_invoices(since=since, sync_state=sync_state):
         invoice_id = invoice['Id']
         invoice_name = invoice['Name']
-        attachments = invoice.get('Attachments', {}).get('records', [])
+        attachments = (invoice.get('Attachments') or {}).get('records', [])
 
         if attachments:
             first_attachment = attachments[0]
             attachment_id = first_attachment['Id']
             attachment_name = first_attachment['Name']
-            content_type = first_attachment['ContentType']
+            content_type = first_attachment['ContentType'] or ""
 
             # Check if it's a PDF
             if "pdf" in content_type.lower():
-                file_path = os.path.join(output_folder, f"{invoice_name}_{attachment_name}")
+                if is_unchanged(invoices_in_manifest.get(invoice_id), first_attachment, store):
+                    continue
+
+                file_name = f"{invoice_name}_{attachment_name}"
                 pdf_url = f"{sf.base_url}/sobjects/Attachment/{attachment_id}/Body"
 
-                # Download the file
-                response = requests.get(pdf_url, headers={"Authorization": f"Bearer {sf.session_id}"}, stream=True)
-                if response.status_code == 200:
-                    with open(file_path, "wb") as pdf_file:
-                        pdf_file.write(response.content)
-                    print(f"Downloaded: {file_path}")
-                else:
-                    print(f"Failed to download {attachment_name} (Status Code: {response.status_code})")
+                yield {
+                    "url": pdf_url,
+                    "store_name": file_name,
+                    "source_key": attachment_source_key(first_attachment),
+                    "headers": {"Authorization": f"Bearer {sf.session_id}"},
+                    "service": "salesforce",
+                    "operation": "attachment.body",
+                    "name": attachment_name,
+                    "invoice_id": invoice_id,
+                    "attachment_id": attachment_id,
+                    "body_length": first_attachment.get('BodyLength'),
+                    "last_modified": first_attachment.get('LastModifiedDate'),
+                }
         else:
             print(f"No attachments found for Invoice {invoice_name}")
 
-# Run function
-download_invoices()
+
+def download_invoices(output_folder="invoices", incremental=True, store=None, since=None, dry_run=False):
+    """
+    Download the first PDF invoice from Salesforce where Payment Method is 'Influencer Invoice' or 'Marketing'.
+
+    PDFs go into the content-addressed PdfStore under "{invoice name}_{attachment name}"; the
+    manifest in output_folder tracks which attachment version each invoice points at.
+    In incremental mode only invoices with an attachment modified since the manifest watermark are
+    queried, and only attachments that are new or changed are downloaded. The watermark only advances when every
+    download succeeded, so failures are retried on the next run.
+
+    Pass since (SOQL datetime) to query from that point instead of the watermark. With
+    dry_run the pending downloads are listed and nothing is fetched or written.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    store = store or PdfStore()
+    manifest = load_manifest(output_folder)
+    since = since or (manifest.get("watermark") if incremental else None)
+    if since:
+        print(f"Incremental sync: attachments modified after {since}")
+
+    if dry_run:
+        jobs = list(iter_invoice_jobs(store, manifest=manifest, since=since))
+        for job in jobs:
+            print(f"[dry-run] Would download {job['store_name']} ({job['body_length']} bytes)")
+        print(f"[dry-run] {len(jobs)} attachments to download")
+        return {"pending": len(jobs), "completed": 0, "failed": 0, "reused": 0, "retries": 0, "bytes": 0}
+
+    manifest_lock = threading.Lock()
+
+    def record(result):
+        if not result["ok"]:
+            return
+        with manifest_lock:
+            manifest["invoices"][result["invoice_id"]] = {
+                "attachment_id": result["attachment_id"],
+                "last_modified": result["last_modified"],
+                "size": result["body_length"],
+                "sha256": result["sha256"],
+                "file": result["store_name"],
+            }
+
+    # Stream the query results straight into the download pool; bodies are streamed to disk in chunks
+    sync_state = {}
+    try:
+        summary = DownloadEngine(store=store).download_all(
+            iter_invoice_jobs(store, manifest=manifest, since=since, sync_state=sync_state),
+            on_result=record,
+        )
+    finally:
+        store.save()
+
+    if summary["failed"] == 0 and sync_state.get("max_last_modified"):
+        manifest["watermark"] = max(since or "", sync_state["max_last_modified"])
+    save_manifest(output_folder, manifest)
+    print(f"Sync finished: {summary['completed']} downloaded or attempted, {summary['failed']} failed, "
+          f"{summary['reused']} already stored, "
+          f"watermark {manifest.get('watermark')}")
+    return summary
+
+
+def main(full=False, refresh_reference=False, since=None, dry_run=False):
+    """Pass full to ignore the watermark and re-query every invoice, or refresh_reference to
+    refresh the trip/invoice reference data through Bulk API 2.0 instead of downloading."""
+    if refresh_reference:
+        return refresh_reference_data()
+    return download_invoices(incremental=not full, since=since, dry_run=dry_run)
+
+
+if __name__ == "__main__":
+    main(full="--full" in sys.argv, refresh_reference="--refresh-reference" in sys.argv)
+
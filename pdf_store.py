@@ -0,0 +1,201 @@
+"""Content-addressed local store for invoice attachments and generated credit-note PDFs.
+
+Every PDF is kept once as blobs/<sha256[:2]>/<sha256>.pdf, whatever name or how many names it
+is stored under. index.json maps names ("INV-0042_invoice.pdf", "CN-CC-001426.pdf") and source
+keys (a Salesforce attachment version) to blob hashes:
+
+    {"names": {name: sha256}, "sources": {source key: sha256}, "blobs": {sha256: {"size": int, "last_used": float}}}
+
+The store is a working cache: once the blobs exceed max_bytes, the least recently used ones are
+evicted (blobs no name points at go first) and fetched or generated again when next needed.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+PDF_STORE_DIR = os.getenv("PDF_STORE_DIR", "pdf_store")
+PDF_STORE_MAX_MB = float(os.getenv("PDF_STORE_MAX_MB", "2048"))
+INDEX_FILE = "index.json"
+HASH_CHUNK_SIZE = 256 * 1024
+
+
+class PdfStore:
+    """Hash-named PDF blobs plus a name index, safe to share between worker threads."""
+
+    def __init__(self, root=PDF_STORE_DIR, max_bytes=None):
+        self.root = root
+        self.max_bytes = int(PDF_STORE_MAX_MB * 1024 * 1024) if max_bytes is None else max_bytes
+        self.lock = threading.RLock()
+        os.makedirs(os.path.join(self.root, "blobs"), exist_ok=True)
+        os.makedirs(os.path.join(self.root, "tmp"), exist_ok=True)
+        self.index = self._load_index()
+
+    # --- index ---
+
+    def _load_index(self):
+        index_path = os.path.join(self.root, INDEX_FILE)
+        if not os.path.exists(index_path):
+            return {"names": {}, "sources": {}, "blobs": {}}
+        with open(index_path, "r") as f:
+            index = json.load(f)
+        for section in ("names", "sources", "blobs"):
+            index.setdefault(section, {})
+        return index
+
+    def save(self):
+        """Write the index atomically so an interrupted run never leaves it half written."""
+        with self.lock:
+            index_path = os.path.join(self.root, INDEX_FILE)
+            temp_path = f"{index_path}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump(self.index, f, indent=1, sort_keys=True)
+            os.replace(temp_path, index_path)
+
+    # --- lookups ---
+
+    def blob_path(self, sha256):
+        return os.path.join(self.root, "blobs", sha256[:2], f"{sha256}.pdf")
+
+    def has(self, sha256):
+        """True when the blob is indexed and still on disk."""
+        return bool(sha256) and sha256 in self.index["blobs"] and os.path.exists(self.blob_path(sha256))
+
+    def lookup(self, name):
+        """Return the hash stored under name, or None."""
+        sha256 = self.index["names"].get(name)
+        return sha256 if self.has(sha256) else None
+
+    def lookup_source(self, source_key):
+        """Return the hash of the blob already fetched for a source (e.g. an attachment version), or None."""
+        sha256 = self.index["sources"].get(source_key)
+        return sha256 if self.has(sha256) else None
+
+    def path(self, name):
+        """Return the blob path for a name and mark it as recently used; None when it is not stored."""
+        with self.lock:
+            sha256 = self.lookup(name)
+            if sha256 is None:
+                return None
+            self.index["blobs"][sha256]["last_used"] = time.time()
+            return self.blob_path(sha256)
+
+    # --- writes ---
+
+    def staging_path(self):
+        """Reserve a temp file inside the store, on the same filesystem as the blobs so adding it is a rename."""
+        fd, temp_path = tempfile.mkstemp(dir=os.path.join(self.root, "tmp"), prefix="incoming-", suffix=".part")
+        os.close(fd)
+        return temp_path
+
+    @staticmethod
+    def file_sha256(file_path):
+        checksum = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                checksum.update(chunk)
+        return checksum.hexdigest()
+
+    def link(self, name, sha256, source_key=None):
+        """Point name (and optionally a source key) at a blob that is already stored."""
+        with self.lock:
+            if not self.has(sha256):
+                raise KeyError(f"Blob {sha256} is not in the store.")
+            self.index["names"][name] = sha256
+            if source_key:
+                self.index["sources"][source_key] = sha256
+            self.index["blobs"][sha256]["last_used"] = time.time()
+            return sha256
+
+    def add_file(self, file_path, name, sha256=None, source_key=None):
+        """
+        Move a finished file into the store under name.
+
+        Args:
+            file_path (str): File to ingest; it is renamed into place, or deleted when the bytes are already stored.
+            name (str): Name to index the blob under; an existing name is repointed.
+            sha256 (str, optional): Hash computed while the file was written, to avoid reading it again.
+            source_key (str, optional): Key of where the bytes came from, so the same source is not fetched twice.
+
+        Returns:
+            str: The blob hash.
+        """
+        sha256 = sha256 or self.file_sha256(file_path)
+        with self.lock:
+            if self.has(sha256):
+                os.remove(file_path)
+            else:
+                blob_path = self.blob_path(sha256)
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                os.replace(file_path, blob_path)
+                self.index["blobs"][sha256] = {"size": os.path.getsize(blob_path), "last_used": time.time()}
+            self.link(name, sha256, source_key)
+            self.evict()
+            return sha256
+
+    def add_bytes(self, data, name, source_key=None):
+        """Store an in-memory PDF (e.g. a credit note exported from Sheets) under name."""
+        sha256 = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            if self.has(sha256):
+                return self.link(name, sha256, source_key)
+        temp_path = self.staging_path()
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        return self.add_file(temp_path, name, sha256=sha256, source_key=source_key)
+
+    def export(self, name, destination):
+        """Materialise a stored PDF at destination, hard-linking when possible instead of copying."""
+        blob_path = self.path(name)
+        if blob_path is None:
+            raise KeyError(f"{name} is not in the store.")
+        if os.path.exists(destination):
+            os.remove(destination)
+        try:
+            os.link(blob_path, destination)
+        except OSError:
+            shutil.copyfile(blob_path, destination)
+        return destination
+
+    # --- eviction ---
+
+    def total_bytes(self):
+        return sum(blob["size"] for blob in self.index["blobs"].values())
+
+    def evict(self, max_bytes=None):
+        """
+        Delete blobs until the store fits in max_bytes (defaults to the store limit).
+
+        Blobs no name points at go first, then the least recently used ones. Names and source keys
+        of evicted blobs are dropped with them. Returns the number of bytes freed.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        with self.lock:
+            total = self.total_bytes()
+            if total <= max_bytes:
+                return 0
+
+            referenced = set(self.index["names"].values())
+            candidates = sorted(
+                self.index["blobs"].items(),
+                key=lambda item: (item[0] in referenced, item[1].get("last_used", 0)),
+            )
+            evicted = set()
+            freed = 0
+            for sha256, blob in candidates:
+                if total - freed <= max_bytes:
+                    break
+                if os.path.exists(self.blob_path(sha256)):
+                    os.remove(self.blob_path(sha256))
+                freed += blob["size"]
+                evicted.add(sha256)
+
+            for sha256 in evicted:
+                del self.index["blobs"][sha256]
+            for section in ("names", "sources"):
+                self.index[section] = {key: sha256 for key, sha256 in self.index[section].items() if sha256 not in evicted}
+            print(f"Evicted {len(evicted)} PDFs ({freed / (1024 * 1024):.1f} MB) from {self.root}")
+            return freed
@@ -0,0 +1,128 @@
+"""Local HTTP stand-in for the Salesforce Bulk API 2.0 query endpoints.
+
+Serves jobs/query (create, status, paged CSV results) from in-memory tables so BulkQueryClient
+and the reference-data refresh can run without an org:
+
+    tables = {"Invoice__c": [{"Id": "a0B1", "Name": "INV-1", "Trip_Detail__r.Trip_Confirmation__r.Trip__c": "T-1"}]}
+    with BulkApiStandIn(tables) as stand_in:
+        client = BulkQueryClient(stand_in.url, "token")
+        df = client.query_to_dataframe("SELECT Id, Name FROM Invoice__c")
+
+The FROM object picks the table and the SELECT list picks the columns (dotted relationship paths
+are plain keys); WHERE clauses are ignored.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import csv
+import io
+import itertools
+import json
+import re
+import threading
+
+
+class _BulkHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b"", content_type="application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, payload):
+        self._send(status, json.dumps(payload).encode())
+
+    def _job_path(self):
+        match = re.fullmatch(r"/services/data/v[\d.]+/jobs/query(?:/([^/]+))?(/results)?", urlparse(self.path).path)
+        return match.groups() if match else None
+
+    def do_POST(self):
+        stand_in = self.server.stand_in
+        stand_in.request_count += 1
+        path = self._job_path()
+        if path is None or path[0] is not None:
+            return self._send_json(404, [{"errorCode": "NOT_FOUND"}])
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        try:
+            job_id = stand_in.create_job(body.get("query", ""))
+        except ValueError as e:
+            return self._send_json(400, [{"errorCode": "INVALID_QUERY", "message": str(e)}])
+        self._send_json(200, {"id": job_id, "operation": "query", "state": "UploadComplete"})
+
+    def do_GET(self):
+        stand_in = self.server.stand_in
+        stand_in.request_count += 1
+        path = self._job_path()
+        if path is None or path[0] not in stand_in.jobs:
+            return self._send_json(404, [{"errorCode": "NOT_FOUND"}])
+        job_id, results = path
+        job = stand_in.jobs[job_id]
+        if not results:
+            return self._send_json(200, {"id": job_id, "state": "JobComplete",
+                                         "numberRecordsProcessed": len(job["rows"])})
+
+        params = parse_qs(urlparse(self.path).query)
+        max_records = int(params.get("maxRecords", [stand_in.page_size])[0])
+        offset = int(params.get("locator", ["0"])[0])
+        page = job["rows"][offset:offset + max_records]
+        next_offset = offset + max_records
+
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator="\n")
+        writer.writerow(job["fields"])
+        writer.writerows([[row.get(field, "") for field in job["fields"]] for row in page])
+        self._send(200, output.getvalue().encode(), content_type="text/csv", headers={
+            "Sforce-Locator": str(next_offset) if next_offset < len(job["rows"]) else "null",
+            "Sforce-NumberOfRecords": str(len(page)),
+        })
+
+
+class BulkApiStandIn:
+    """Threaded localhost server implementing the Bulk API 2.0 query job lifecycle."""
+
+    def __init__(self, tables, host="127.0.0.1", port=0, page_size=50000):
+        self.tables = tables
+        self.page_size = page_size
+        self.jobs = {}
+        self.request_count = 0
+        self._job_ids = itertools.count(1)
+        self.server = ThreadingHTTPServer((host, port), _BulkHandler)
+        self.server.stand_in = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def create_job(self, query):
+        match = re.match(r"\s*SELECT\s+(.+?)\s+FROM\s+(\w+)", query, re.I | re.S)
+        if not match:
+            raise ValueError(f"Unable to parse query: {query}")
+        fields = [field.strip() for field in match.group(1).split(",")]
+        sobject = match.group(2)
+        if sobject not in self.tables:
+            raise ValueError(f"sObject type '{sobject}' is not supported.")
+        job_id = f"750{next(self._job_ids):012d}"
+        self.jobs[job_id] = {"fields": fields, "rows": list(self.tables[sobject])}
+        return job_id
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
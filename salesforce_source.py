@@ -0,0 +1,319 @@
+"""Salesforce as a direct data source for the merge stages.
+
+Returns the trip -> invoice/opportunity tables that used to be exported by hand into the
+"SF-INFL" and "Opportunties ID + Invoice ID" tabs as typed DataFrames, fetched through
+Bulk API 2.0 and cached locally. The column names match the sheet tabs, so CC.py,
+RICC_INFL.py, RITP.py and ITP.py merge them exactly as before.
+
+The merge stages read the tables through the trip index (trip_index.py): refresh_trip_index()
+feeds the latest rows into it, and lookup_reference_rows() returns only the rows of the trips
+a stage is merging.
+
+Set SF_SOURCE=sheets to keep reading the exported tabs instead (the default when no
+Salesforce credentials are configured).
+"""
+from trip_index import TripIndex
+import api_metrics
+import io
+import os
+import time
+
+CACHE_DIR = os.getenv("CN_CACHE_DIR", ".cache")
+CACHE_TTL_HOURS = float(os.getenv("SF_CACHE_TTL_HOURS", "12"))
+
+# Sheet tab and range each table replaces
+SHEET_FALLBACKS = {
+    "sf_infl": ("SF-INFL", "A2:F"),
+    "opportunities": ("Opportunties ID + Invoice ID", "A2:R"),
+}
+
+# Columns converted to numbers; everything else stays text, stripped of surrounding whitespace
+NUMERIC_COLUMNS = {
+    "sf_infl": ["Amount"],
+    "opportunities": ["Amount"],
+}
+
+# Bulk API 2.0 query jobs
+BULK_API_VERSION = "59.0"
+BULK_MAX_RECORDS_PER_PAGE = 50000
+BULK_POLL_INTERVAL = 2
+BULK_TIMEOUT = 1800
+
+# Trip/invoice reference data, refreshed through Bulk API 2.0. Each query's columns are renamed to the
+# labels of the exported sheet tabs so the merge stages see the same column names. Field API names
+# follow the Invoice__c schema used above and must match the org if it changes.
+REFERENCE_QUERIES = {
+    "sf_infl": {
+        "query": """
+            SELECT Trip_Detail__r.Trip_Confirmation__r.Trip__c, Trip_Detail__r.RecordType.Name, Name,
+                   Amount__c, Payment_Method__c, CreatedDate
+            FROM Invoice__c
+            WHERE Payment_Method__c IN ('Influencer Invoice', 'Marketing')
+        """,
+        "columns": {
+            "Trip_Detail__r.Trip_Confirmation__r.Trip__c": "Invoice: Trip Detail: Trip Confirmation: Trip",
+            "Trip_Detail__r.RecordType.Name": "Invoice: Trip Detail: Record Type",
+            "Name": "Invoice: Invoice No.",
+            "Amount__c": "Amount",
+            "Payment_Method__c": "Invoice: Payment Method",
+            "CreatedDate": "Created Date",
+        },
+    },
+    "opportunities": {
+        "query": """
+            SELECT Opportunity__c, Opportunity__r.Name, Trip_Detail__r.Trip_Confirmation__r.Trip__c, Id, Name,
+                   Opportunity__r.StageName, Opportunity__r.CloseDate, Opportunity__r.Amount
+            FROM Invoice__c
+        """,
+        "columns": {
+            "Opportunity__c": "Opportunity ID",
+            "Opportunity__r.Name": "Opportunity Name",
+            "Trip_Detail__r.Trip_Confirmation__r.Trip__c": "Trip",
+            "Id": "Invoice ID",
+            "Name": "Invoice: Invoice No.",
+            "Opportunity__r.StageName": "Stage",
+            "Opportunity__r.CloseDate": "Close Date",
+            "Opportunity__r.Amount": "Amount",
+        },
+    },
+}
+
+
+class BulkQueryClient:
+    """
+    Minimal Salesforce Bulk API 2.0 query client.
+
+    A query runs as an asynchronous job; its CSV results are fetched page by page (Sforce-Locator)
+    and parsed straight from the response stream, so large Invoice__c volumes cost a handful of
+    API calls instead of one REST call per 2,000 records. instance_url can point at the local
+    stand-in in salesforce_emulator.py.
+    """
+
+    def __init__(self, instance_url, session_id, api_version=BULK_API_VERSION, session=None):
+        import requests
+
+        self.base_url = f"{instance_url.rstrip('/')}/services/data/v{api_version}/jobs/query"
+        self.session = session or requests.Session()
+        self.session.headers.update({"Authorization": f"Bearer {session_id}"})
+
+    @classmethod
+    def from_salesforce(cls, sf_client):
+        return cls(f"https://{sf_client.sf_instance}", sf_client.session_id, sf_client.sf_version)
+
+    def _request(self, method, url, operation, **kwargs):
+        """Send one request, counted and timed in api_metrics (streamed bodies are timed to the headers)."""
+        with api_metrics.track("salesforce", operation) as call:
+            response = self.session.request(method, url, **kwargs)
+            call.status = response.status_code
+            call.bytes_sent = len(response.request.body or b"")
+            call.bytes_received = int(response.headers.get("Content-Length") or 0)
+        return response
+
+    def submit(self, query):
+        """Create a query job and return its Id."""
+        response = self._request("POST", self.base_url, "bulk.submit", json={
+            "operation": "query",
+            "query": " ".join(query.split()),
+            "contentType": "CSV",
+            "columnDelimiter": "COMMA",
+            "lineEnding": "LF",
+        }, timeout=60)
+        response.raise_for_status()
+        return response.json()["id"]
+
+    def wait(self, job_id, poll_interval=BULK_POLL_INTERVAL, timeout=BULK_TIMEOUT):
+        """Poll the job until Salesforce has finished processing it."""
+        deadline = time.monotonic() + timeout
+        while True:
+            response = self._request("GET", f"{self.base_url}/{job_id}", "bulk.status", timeout=60)
+            response.raise_for_status()
+            job = response.json()
+            if job["state"] == "JobComplete":
+                return job
+            if job["state"] in ("Failed", "Aborted"):
+                raise RuntimeError(f"Bulk query job {job_id} {job['state']}: {job.get('errorMessage')}")
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Bulk query job {job_id} still {job['state']} after {timeout}s")
+            time.sleep(poll_interval)
+
+    def iter_result_pages(self, job_id, max_records=BULK_MAX_RECORDS_PER_PAGE):
+        """Yield one streamed results response per page; the caller reads and closes it."""
+        locator = None
+        while True:
+            params = {"maxRecords": max_records}
+            if locator:
+                params["locator"] = locator
+            response = self._request("GET", f"{self.base_url}/{job_id}/results", "bulk.results", params=params,
+                                     stream=True, timeout=300)
+            response.raise_for_status()
+            locator = response.headers.get("Sforce-Locator")
+            yield response
+            if not locator or locator == "null":
+                return
+
+    def iter_dataframes(self, query, columns=None):
+        """Run a query job and yield one DataFrame (all columns as strings) per result page."""
+        import pandas as pd
+
+        job_id = self.submit(query)
+        job = self.wait(job_id)
+        print(f"Bulk query job {job_id} finished with {job.get('numberRecordsProcessed')} records")
+        for response in self.iter_result_pages(job_id):
+            with response:
+                response.raw.decode_content = True
+                page = pd.read_csv(io.TextIOWrapper(response.raw, encoding="utf-8"), dtype=str,
+                                   keep_default_na=False)
+            yield page.rename(columns=columns) if columns else page
+
+    def query_to_dataframe(self, query, columns=None):
+        """Run a query job and return all result pages as one DataFrame."""
+        import pandas as pd
+
+        pages = list(self.iter_dataframes(query, columns))
+        return pd.concat(pages, ignore_index=True) if pages else pd.DataFrame(columns=list((columns or {}).values()))
+
+    def query_to_parquet(self, query, file_path, columns=None):
+        """Stream a query job into a Parquet file one page at a time (requires pyarrow)."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        temp_path = f"{file_path}.tmp"
+        writer = None
+        rows = 0
+        try:
+            for page in self.iter_dataframes(query, columns):
+                table = pa.Table.from_pandas(page, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(temp_path, table.schema)
+                writer.write_table(table)
+                rows += len(page)
+        finally:
+            if writer is not None:
+                writer.close()
+        if writer is None:
+            return 0
+        os.replace(temp_path, file_path)
+        return rows
+
+
+def connect():
+    """Log in to Salesforce with the SF_* environment variables (loading .env first)."""
+    from dotenv import load_dotenv
+    from simple_salesforce import Salesforce
+
+    load_dotenv()
+
+    return Salesforce(
+        username=os.getenv("SF_USERNAME"),
+        password=os.getenv("SF_PASSWORD"),
+        security_token=os.getenv("SF_SECURITY_TOKEN"),
+        domain=os.getenv("SF_DOMAIN", "login"),
+    )
+
+
+def salesforce_configured():
+    """True when SF_* credentials are set (in the environment or .env) and SF_SOURCE is not "sheets"."""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    return os.getenv("SF_SOURCE", "").lower() != "sheets" and bool(os.getenv("SF_USERNAME"))
+
+
+class SalesforceSource:
+    """Typed, locally cached reference tables fetched from Salesforce."""
+
+    def __init__(self, bulk_client=None, cache_dir=CACHE_DIR, ttl_hours=CACHE_TTL_HOURS):
+        self._bulk_client = bulk_client
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_hours * 3600
+
+    @property
+    def bulk_client(self):
+        if self._bulk_client is None:
+            self._bulk_client = BulkQueryClient.from_salesforce(connect())
+        return self._bulk_client
+
+    def _cache_path(self, name):
+        return os.path.join(self.cache_dir, f"salesforce_{name}.pkl")
+
+    def _read_cache(self, name):
+        import pandas as pd
+
+        cache_path = self._cache_path(name)
+        if os.path.exists(cache_path) and time.time() - os.path.getmtime(cache_path) < self.ttl_seconds:
+            return pd.read_pickle(cache_path)
+        return None
+
+    def _write_cache(self, name, df):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cache_path = self._cache_path(name)
+        df.to_pickle(f"{cache_path}.tmp")
+        os.replace(f"{cache_path}.tmp", cache_path)
+
+    @staticmethod
+    def to_typed(name, df):
+        """Strip text columns and convert the amount columns to numbers."""
+        import pandas as pd
+
+        df = df.copy()
+        for column in df.columns:
+            if column in NUMERIC_COLUMNS.get(name, []):
+                df[column] = pd.to_numeric(df[column], errors="coerce")
+            else:
+                df[column] = df[column].fillna("").astype(str).str.strip()
+        return df
+
+    def table(self, name, refresh=False):
+        """Return a reference table, from the local cache when it is fresher than the TTL."""
+        if not refresh:
+            cached = self._read_cache(name)
+            if cached is not None:
+                print(f"Loaded {name} from cache ({len(cached)} rows)")
+                return cached
+
+        spec = REFERENCE_QUERIES[name]
+        df = self.to_typed(name, self.bulk_client.query_to_dataframe(spec["query"], spec["columns"]))
+        self._write_cache(name, df)
+        print(f"Fetched {name} from Salesforce ({len(df)} rows)")
+        return df
+
+    def sf_infl(self, refresh=False):
+        """Trip -> invoice number, record type and amount (the SF-INFL tab)."""
+        return self.table("sf_infl", refresh)
+
+    def opportunities(self, refresh=False):
+        """Opportunity -> trip and invoice (the "Opportunties ID + Invoice ID" tab)."""
+        return self.table("opportunities", refresh)
+
+
+def refresh_trip_index(name, gsheet_utils, service_api, spreadsheet_id, index=None):
+    """
+    Bring the trip index of a reference table up to date and return the index.
+
+    From Salesforce, the table is fetched again once the index is older than SF_CACHE_TTL_HOURS.
+    The exported tab is read on every call, since it can be re-exported at any time, but only
+    as raw rows: the index stores just what changed.
+    """
+    index = index or TripIndex()
+    if salesforce_configured():
+        refreshed_at = index.refreshed_at(name)
+        if refreshed_at is not None and time.time() - refreshed_at < CACHE_TTL_HOURS * 3600:
+            return index
+        df = SalesforceSource().table(name)
+        index.update(name, df.columns.tolist(), df.values.tolist())
+        return index
+
+    tab_name, range_ = SHEET_FALLBACKS[name]
+    sheet_data = gsheet_utils.fetch_sheet_data(service_api, spreadsheet_id, tab_name, range_=range_)
+    if not sheet_data:
+        raise ValueError(f"No data available in the {tab_name} tab.")
+    # Cells the API leaves out become "N/A", as in DataFrameUtils.process_data_to_dataframe
+    header = sheet_data[0]
+    rows = [row + ["N/A"] * (len(header) - len(row)) for row in sheet_data[1:]]
+    index.update(name, header, rows)
+    return index
+
+
+def lookup_reference_rows(name, trip_ids, gsheet_utils, service_api, spreadsheet_id):
+    """Rows of a reference table for the given trips only, keyed for trip_index.merge_on_trip."""
+    return refresh_trip_index(name, gsheet_utils, service_api, spreadsheet_id).lookup_frame(name, trip_ids)
@@ -0,0 +1,229 @@
+"""Local SQLite mirror of the pipeline tabs, for joins and ad-hoc queries without the Sheets API.
+
+`python cn_creation.py sync` copies the tabs in MIRRORED_TABS into CN_CACHE_DIR/mirror.sqlite,
+one table per tab, with the columns named the way the scripts standardize them ("Agent Code"
+-> agent_code) and indexes on the join columns. Queries then run locally:
+
+    python cn_creation.py query "SELECT agent_code, COUNT(*) FROM ritp GROUP BY agent_code"
+
+    mirror = SheetMirror()
+    mirror.sync(session, ["Performance", "RITP"])
+    df = mirror.query_frame("SELECT ... FROM performance p LEFT JOIN ritp r ON r.agent_code = p.agent_code")
+
+Syncs are incremental. Form-response tabs only grow, so their sync reads the header and the
+rows from the last mirrored row on, in one batchGet, and checks that row's fingerprint before
+appending what follows. The other tabs, and form tabs whose last row changed, are read whole
+and only the rows that changed are written. Every row keeps its sheet row number in _row.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from form_watermark import row_fingerprint
+
+MIRROR_FILE = os.path.join(os.getenv("CN_CACHE_DIR", ".cache"), "mirror.sqlite")
+
+# Tab -> SQL table, columns read, header row, whether rows are only ever appended, indexed columns
+MIRRORED_TABS = {
+    "RITP": {"table": "ritp", "columns": ("A", "AA"), "header_row": 1, "append_only": True,
+             "indexes": ["email_address", "trip_id", "agent_code", "timestamp"]},
+    "RICC": {"table": "ricc", "columns": ("A", "BJ"), "header_row": 1, "append_only": True,
+             "indexes": ["email_address", "trip_id", "timestamp"]},
+    "RINV": {"table": "rinv", "columns": ("A", "AZ"), "header_row": 1, "append_only": True,
+             "indexes": ["email_address", "timestamp"]},
+    "Performance": {"table": "performance", "columns": ("A", "I"), "header_row": 4, "append_only": False,
+                    "indexes": ["agent_code", "opportunity_id"]},
+    "SF-INFL": {"table": "sf_infl", "columns": ("A", "F"), "header_row": 2, "append_only": False,
+                "indexes": ["invoice:_trip_detail:_trip_confirmation:_trip", "invoice:_invoice_no."]},
+    "Opportunties ID + Invoice ID": {"table": "opportunities", "columns": ("A", "R"), "header_row": 2,
+                                     "append_only": False, "indexes": ["opportunity_id", "trip", "invoice_id"]},
+    "DB": {"table": "db", "columns": ("A", "ZZ"), "header_row": 1, "append_only": False,
+           "indexes": ["trip_id", "email_address", "agent_code", "opportunity_id"]},
+    "DB-RITP": {"table": "db_ritp", "columns": ("A", "ZZ"), "header_row": 1, "append_only": False,
+                "indexes": ["trip_id", "email_address", "agent_code"]},
+}
+
+META_SCHEMA = """
+CREATE TABLE IF NOT EXISTS _tabs (
+    tab TEXT PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    columns TEXT NOT NULL,
+    last_row INTEGER,
+    last_fingerprint TEXT,
+    synced_at REAL NOT NULL
+);
+"""
+
+
+def standardize_columns(header):
+    """Column names as the scripts standardize them; blanks get their position, repeats a suffix."""
+    columns = []
+    for position, name in enumerate(header, start=1):
+        column = str(name).strip().lower().replace(" ", "_") or f"column_{position}"
+        candidate, repeat = column, 2
+        while candidate in columns:
+            candidate, repeat = f"{column}_{repeat}", repeat + 1
+        columns.append(candidate)
+    return columns
+
+
+def quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+class SheetMirror:
+    """The mirrored tabs in one SQLite database."""
+
+    def __init__(self, path=MIRROR_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def connect(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        db = sqlite3.connect(self.path)
+        db.executescript(META_SCHEMA)
+        return db
+
+    def status(self):
+        """{tab: {"table", "rows", "synced_at"}} of every mirrored tab."""
+        db = self.connect()
+        try:
+            status = {}
+            for tab, table_name, synced_at in db.execute("SELECT tab, table_name, synced_at FROM _tabs").fetchall():
+                rows = db.execute(f"SELECT COUNT(*) FROM {quote(table_name)}").fetchone()[0]
+                status[tab] = {"table": table_name, "rows": rows, "synced_at": synced_at}
+            return status
+        finally:
+            db.close()
+
+    def sync(self, session, tabs=None, full=False):
+        """
+        Bring the mirror of the given tabs (default: all of MIRRORED_TABS) up to date.
+
+        Args:
+            session (SheetsSession): Spreadsheet to read from.
+            tabs (list, optional): Tab names, keys of MIRRORED_TABS.
+            full (bool): Read every tab whole, even the form-response tabs.
+
+        Returns:
+            dict: {tab: (rows written, rows deleted)}
+        """
+        from google_sheet_processor import GoogleSheetUtils
+
+        def read_ranges(ranges):
+            return GoogleSheetUtils.batch_fetch_sheet_data(session.service, session.spreadsheet_id, ranges)
+
+        return {tab: self.sync_tab(read_ranges, tab, full=full) for tab in (tabs or MIRRORED_TABS)}
+
+    def sync_tab(self, read_ranges, tab, full=False):
+        """
+        Sync one tab.
+
+        Args:
+            read_ranges (callable): Returns one list of rows per A1 range ("Tab!A1:AA1").
+        """
+        spec = MIRRORED_TABS[tab]
+        first, last = spec["columns"]
+        header_row = spec["header_row"]
+        quoted_tab = "'" + tab.replace("'", "''") + "'"
+
+        with self.lock:
+            db = self.connect()
+            try:
+                stored = db.execute("SELECT columns, last_row, last_fingerprint FROM _tabs WHERE tab = ?",
+                                    (tab,)).fetchone()
+                if spec["append_only"] and stored and stored[1] and not full:
+                    header_rows, block = read_ranges([f"{quoted_tab}!{first}{header_row}:{last}{header_row}",
+                                                      f"{quoted_tab}!{first}{stored[1]}:{last}"])
+                    columns = standardize_columns(header_rows[0] if header_rows else [])
+                    if columns == json.loads(stored[0]) and block and row_fingerprint(block[0]) == stored[2]:
+                        rows = list(enumerate(block[1:], start=stored[1] + 1))
+                        result = self._apply(db, tab, spec, columns, rows, replace=False)
+                        print(f"Mirror {tab}: {result[0]} new rows.")
+                        return result
+                    print(f"Mirror {tab}: the last mirrored row changed; reading the whole tab.")
+
+                values = read_ranges([f"{quoted_tab}!{first}{header_row}:{last}"])[0]
+                columns = standardize_columns(values[0] if values else [])
+                if not columns:
+                    print(f"Mirror {tab}: no header row, nothing to mirror.")
+                    return 0, 0
+                rows = list(enumerate(values[1:], start=header_row + 1))
+                result = self._apply(db, tab, spec, columns, rows, replace=True)
+                print(f"Mirror {tab}: {result[0]} rows written, {result[1]} deleted, {len(rows)} read.")
+                return result
+            finally:
+                db.close()
+
+    def _apply(self, db, tab, spec, columns, rows, replace):
+        """
+        Write rows ((sheet row, cells) pairs) into the tab's table.
+
+        With replace, rows is the whole tab: rows that changed are rewritten and rows that are
+        gone are deleted. Otherwise rows are appended.
+        """
+        table = quote(spec["table"])
+        rows = [(row_number, (list(cells) + [None] * len(columns))[:len(columns)])
+                for row_number, cells in rows if any(str(cell).strip() for cell in cells)]
+        incoming = {row_number: (row_fingerprint(["" if cell is None else cell for cell in cells]), cells)
+                    for row_number, cells in rows}
+
+        with db:
+            stored = db.execute("SELECT columns FROM _tabs WHERE tab = ?", (tab,)).fetchone()
+            if stored is None or json.loads(stored[0]) != columns:
+                # New tab or a changed header: (re)create the table
+                db.execute(f"DROP TABLE IF EXISTS {table}")
+                column_sql = ", ".join(f"{quote(column)} TEXT" for column in columns)
+                db.execute(f'CREATE TABLE {table} ("_row" INTEGER PRIMARY KEY, "_fingerprint" TEXT, {column_sql})')
+                for column in spec["indexes"]:
+                    if column in columns:
+                        index_name = quote(f"{spec['table']}_{re.sub(r'[^a-z0-9]+', '_', column)}")
+                        db.execute(f"CREATE INDEX {index_name} ON {table} ({quote(column)})")
+
+            existing = dict(db.execute(f'SELECT "_row", "_fingerprint" FROM {table}'))
+            changed = [row_number for row_number, (fingerprint, _) in incoming.items()
+                       if existing.get(row_number) != fingerprint]
+            deleted = [row_number for row_number in existing if row_number not in incoming] if replace else []
+
+            db.executemany(f'DELETE FROM {table} WHERE "_row" = ?', [(row_number,) for row_number in deleted])
+            db.executemany(
+                f"INSERT OR REPLACE INTO {table} VALUES ({', '.join('?' * (len(columns) + 2))})",
+                [[row_number, incoming[row_number][0]] + incoming[row_number][1] for row_number in changed]
+            )
+
+            last_row, last_fingerprint = db.execute(
+                f'SELECT "_row", "_fingerprint" FROM {table} ORDER BY "_row" DESC LIMIT 1'
+            ).fetchone() or (None, None)
+            db.execute("INSERT OR REPLACE INTO _tabs VALUES (?, ?, ?, ?, ?, ?)",
+                       (tab, spec["table"], json.dumps(columns), last_row, last_fingerprint, time.time()))
+        return len(changed), len(deleted)
+
+    def query(self, sql, params=()):
+        """Run a query on a read-only connection; returns (column names, rows)."""
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"No mirror at {self.path} yet; run `python cn_creation.py sync` first.")
+        db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        try:
+            cursor = db.execute(sql, params)
+            return [description[0] for description in cursor.description or []], cursor.fetchall()
+        finally:
+            db.close()
+
+    def query_frame(self, sql, params=()):
+        """Run a query and return the result set as a DataFrame."""
+        import pandas as pd
+
+        columns, rows = self.query(sql, params)
+        return pd.DataFrame(rows, columns=columns)
+
+    def columns(self, tab):
+        """Mirrored column names of a tab (without _row and _fingerprint), or None before its first sync."""
+        db = self.connect()
+        try:
+            stored = db.execute("SELECT columns FROM _tabs WHERE tab = ?", (tab,)).fetchone()
+        finally:
+            db.close()
+        return json.loads(stored[0]) if stored else None
@@ -0,0 +1,516 @@
+"""In-process stand-in for the subset of the Google Sheets v4 API used by this project.
+
+GoogleSheetUtils.build_service returns a SheetsEmulator instead of the real client when the
+SHEETS_EMULATOR environment variable is set, so whole pipelines can run offline:
+
+    SHEETS_EMULATOR=state.json                 # "1" keeps everything in memory only
+    SHEETS_EMULATOR_LATENCY=0.05               # seconds added to every request
+    SHEETS_EMULATOR_QUOTA=300                  # requests per minute before 429s are returned
+    SHEETS_EMULATOR_ERROR_RATE=0.01            # fraction of requests failing with an injected 429
+
+Supported: values get/batchGet/update/batchUpdate/clear/append, spreadsheets get/create/batchUpdate
+(duplicateSheet, updateCells, addSheet, deleteSheet, updateSheetProperties, updateDimensionProperties),
+sheets copyTo and the per-tab PDF export (a plain text rendering of the tab's values).
+"""
+from collections import Counter, deque
+import atexit
+import copy
+import json
+import os
+import random
+import re
+import threading
+import time
+
+
+DEFAULT_ROW_COUNT = 1000
+DEFAULT_COLUMN_COUNT = 26
+
+
+def column_index(letters):
+    """Convert an A1 column ("A", "AZ") into a zero-based index."""
+    index = 0
+    for char in letters:
+        index = index * 26 + (ord(char) - ord('A') + 1)
+    return index - 1
+
+
+def column_letter(index):
+    """Convert a zero-based column index into its A1 letter."""
+    letters = ""
+    index += 1
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def parse_range(a1_range):
+    """
+    Split an A1 range into (tab, first_row, first_col, last_row, last_col).
+
+    Rows and columns are zero-based; open ends ("A2:F", "A:AZ", a bare tab name) are None.
+    """
+    if "!" in a1_range:
+        tab_name, cells = a1_range.rsplit("!", 1)
+    else:
+        tab_name, cells = a1_range, ""
+    if len(tab_name) > 1 and tab_name.startswith("'") and tab_name.endswith("'"):
+        tab_name = tab_name[1:-1].replace("''", "'")
+    if not cells:
+        return tab_name, 0, 0, None, None
+
+    def parse_cell(cell):
+        match = re.fullmatch(r"([A-Za-z]*)(\d*)", cell.strip())
+        if not match:
+            raise ValueError(f"Unable to parse range: {a1_range}")
+        letters, digits = match.groups()
+        return (int(digits) - 1 if digits else None), (column_index(letters.upper()) if letters else None)
+
+    start, _, end = cells.partition(":")
+    first_row, first_col = parse_cell(start)
+    if not end:
+        return tab_name, first_row or 0, first_col or 0, first_row, first_col
+    last_row, last_col = parse_cell(end)
+    return tab_name, first_row or 0, first_col or 0, last_row, last_col
+
+
+def format_value(value):
+    """Render a stored value the way the API returns it (FORMATTED_VALUE strings)."""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class EmulatedRequest:
+    """Mimics googleapiclient's HttpRequest: built lazily, runs on execute()."""
+
+    def __init__(self, emulator, operation, method, handler, ranges=(), body=None):
+        self.emulator = emulator
+        self.operation = operation
+        self.method = method
+        self.handler = handler
+        self.ranges = list(ranges)  # A1 ranges and body are kept for api_metrics tagging
+        self.body = body
+        self.http = None
+
+    def execute(self, http=None, num_retries=0):
+        return self.emulator._dispatch(self.operation, self.handler)
+
+
+class _Values:
+    def __init__(self, emulator):
+        self.emulator = emulator
+
+    def get(self, spreadsheetId, range, majorDimension="ROWS", **kwargs):
+        return EmulatedRequest(self.emulator, "values.get", "GET",
+                               lambda: self.emulator._get_values(spreadsheetId, range, majorDimension),
+                               ranges=[range])
+
+    def batchGet(self, spreadsheetId, ranges, majorDimension="ROWS", **kwargs):
+        ranges = [ranges] if isinstance(ranges, str) else list(ranges)
+        return EmulatedRequest(self.emulator, "values.batchGet", "GET", lambda: {
+            "spreadsheetId": spreadsheetId,
+            "valueRanges": [self.emulator._get_values(spreadsheetId, r, majorDimension) for r in ranges],
+        }, ranges=ranges)
+
+    def update(self, spreadsheetId, range, body, valueInputOption="RAW", **kwargs):
+        return EmulatedRequest(self.emulator, "values.update", "PUT",
+                               lambda: self.emulator._update_values(spreadsheetId, range, body),
+                               ranges=[range], body=body)
+
+    def batchUpdate(self, spreadsheetId, body, **kwargs):
+        def handler():
+            responses = [self.emulator._update_values(spreadsheetId, data["range"], data) for data in body.get("data", [])]
+            return {
+                "spreadsheetId": spreadsheetId,
+                "totalUpdatedCells": sum(response["updatedCells"] for response in responses),
+                "responses": responses,
+            }
+        return EmulatedRequest(self.emulator, "values.batchUpdate", "POST", handler,
+                               ranges=[data["range"] for data in body.get("data", [])], body=body)
+
+    def clear(self, spreadsheetId, range, body=None, **kwargs):
+        return EmulatedRequest(self.emulator, "values.clear", "POST",
+                               lambda: self.emulator._clear_values(spreadsheetId, range), ranges=[range])
+
+    def append(self, spreadsheetId, range, body, valueInputOption="RAW", insertDataOption=None, **kwargs):
+        return EmulatedRequest(self.emulator, "values.append", "POST",
+                               lambda: self.emulator._append_values(spreadsheetId, range, body),
+                               ranges=[range], body=body)
+
+
+class _Sheets:
+    def __init__(self, emulator):
+        self.emulator = emulator
+
+    def copyTo(self, spreadsheetId, sheetId, body, **kwargs):
+        return EmulatedRequest(self.emulator, "spreadsheets.sheets.copyTo", "POST",
+                               lambda: self.emulator._copy_sheet_to(spreadsheetId, sheetId,
+                                                                    body["destinationSpreadsheetId"]),
+                               body=body)
+
+
+class _Spreadsheets:
+    def __init__(self, emulator):
+        self.emulator = emulator
+
+    def values(self):
+        return _Values(self.emulator)
+
+    def sheets(self):
+        return _Sheets(self.emulator)
+
+    def create(self, body=None, **kwargs):
+        return EmulatedRequest(self.emulator, "spreadsheets.create", "POST",
+                               lambda: self.emulator._create_spreadsheet(body or {}), body=body)
+
+    def get(self, spreadsheetId, **kwargs):
+        return EmulatedRequest(self.emulator, "spreadsheets.get", "GET",
+                               lambda: self.emulator._get_spreadsheet(spreadsheetId))
+
+    def batchUpdate(self, spreadsheetId, body, **kwargs):
+        return EmulatedRequest(self.emulator, "spreadsheets.batchUpdate", "POST",
+                               lambda: self.emulator._batch_update(spreadsheetId, body), body=body)
+
+
+class SheetsEmulator:
+    """
+    Keeps spreadsheets as {spreadsheet_id: {tab title: {"sheetId": int, "rows": [[...]]}}} in memory.
+
+    Every request goes through the same latency, quota and 429-injection checks, and is counted
+    per operation in call_counts so runs can be measured without touching the real API.
+    """
+
+    def __init__(self, latency=0.0, requests_per_minute=None, error_rate=0.0, state_file=None, seed=None):
+        self.latency = latency
+        self.requests_per_minute = requests_per_minute
+        self.error_rate = error_rate
+        self.state_file = state_file
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.request_times = deque()
+        self.call_counts = Counter()
+        self.spreadsheets_data = {}
+        self.titles = {}
+        self.next_sheet_id = 1
+
+        if state_file and os.path.exists(state_file):
+            self.load(state_file)
+
+    @classmethod
+    def from_env(cls):
+        """Create an emulator from the SHEETS_EMULATOR* environment variables."""
+        target = os.getenv("SHEETS_EMULATOR", "")
+        quota = os.getenv("SHEETS_EMULATOR_QUOTA")
+        emulator = cls(
+            latency=float(os.getenv("SHEETS_EMULATOR_LATENCY", "0")),
+            requests_per_minute=int(quota) if quota else None,
+            error_rate=float(os.getenv("SHEETS_EMULATOR_ERROR_RATE", "0")),
+            state_file=None if target.lower() in {"", "1", "true", "memory"} else target,
+        )
+        if emulator.state_file:
+            atexit.register(emulator.save)
+        return emulator
+
+    # --- googleapiclient-compatible surface ---
+
+    def spreadsheets(self):
+        return _Spreadsheets(self)
+
+    def export_pdf(self, spreadsheetId, sheetId):
+        """Stand-in for GoogleSheetUtils.export_sheet_pdf's export URL."""
+        return EmulatedRequest(self, "export.pdf", "GET", lambda: self._export_pdf(spreadsheetId, sheetId))
+
+    # --- seeding and inspection helpers ---
+
+    def add_tab(self, spreadsheet_id, tab_name, rows=None):
+        """Create (or replace) a tab with the given rows."""
+        with self.lock:
+            tabs = self.spreadsheets_data.setdefault(spreadsheet_id, {})
+            sheet_id = tabs[tab_name]["sheetId"] if tab_name in tabs else self._new_sheet_id()
+            tabs[tab_name] = {"sheetId": sheet_id, "rows": [list(row) for row in rows or []]}
+            return sheet_id
+
+    def tab_values(self, spreadsheet_id, tab_name):
+        """Return the formatted rows of a tab."""
+        return self._get_values(spreadsheet_id, tab_name, "ROWS").get("values", [])
+
+    def load(self, state_file):
+        with open(state_file, "r") as f:
+            state = json.load(f)
+        self.spreadsheets_data = state.get("spreadsheets", {})
+        self.call_counts = Counter(state.get("call_counts", {}))
+        self.next_sheet_id = state.get("next_sheet_id", 1)
+        self.titles = state.get("titles", {})
+
+    def save(self, state_file=None):
+        state_file = state_file or self.state_file
+        if not state_file:
+            return
+        with self.lock:
+            state = {
+                "spreadsheets": self.spreadsheets_data,
+                "call_counts": dict(self.call_counts),
+                "next_sheet_id": self.next_sheet_id,
+                "titles": self.titles,
+            }
+            temp_file = f"{state_file}.tmp"
+            with open(temp_file, "w") as f:
+                json.dump(state, f)
+            os.replace(temp_file, state_file)
+
+    # --- request pipeline ---
+
+    @staticmethod
+    def _http_error(status, message):
+        import httplib2
+        from googleapiclient.errors import HttpError
+        content = json.dumps({"error": {"code": status, "message": message}}).encode()
+        return HttpError(httplib2.Response({"status": status}), content)
+
+    def _dispatch(self, operation, handler):
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self.lock:
+            self.call_counts[operation] += 1
+            if self.requests_per_minute:
+                now = time.monotonic()
+                while self.request_times and now - self.request_times[0] > 60:
+                    self.request_times.popleft()
+                if len(self.request_times) >= self.requests_per_minute:
+                    self.call_counts["429"] += 1
+                    raise self._http_error(429, "Quota exceeded for quota metric 'Requests per minute'")
+                self.request_times.append(now)
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.call_counts["429"] += 1
+                raise self._http_error(429, "Injected rate limit error")
+            return handler()
+
+    def _new_sheet_id(self):
+        sheet_id = self.next_sheet_id
+        self.next_sheet_id += 1
+        return sheet_id
+
+    def _tab(self, spreadsheet_id, tab_name):
+        tab = self.spreadsheets_data.get(spreadsheet_id, {}).get(tab_name)
+        if tab is None:
+            raise self._http_error(400, f"Unable to parse range: {tab_name}")
+        return tab
+
+    def _tab_by_id(self, spreadsheet_id, sheet_id):
+        for title, tab in self.spreadsheets_data.get(spreadsheet_id, {}).items():
+            if tab["sheetId"] == sheet_id:
+                return title, tab
+        raise self._http_error(400, f"No grid with id: {sheet_id}")
+
+    def _get_values(self, spreadsheet_id, a1_range, major_dimension):
+        tab_name, first_row, first_col, last_row, last_col = parse_range(a1_range)
+        rows = self._tab(spreadsheet_id, tab_name)["rows"]
+        last_row = len(rows) - 1 if last_row is None else min(last_row, len(rows) - 1)
+
+        values = []
+        for row in rows[first_row:last_row + 1]:
+            cells = row[first_col:] if last_col is None else row[first_col:last_col + 1]
+            cells = [format_value(cell) for cell in cells]
+            while cells and cells[-1] == "":
+                cells.pop()
+            values.append(cells)
+        while values and not values[-1]:
+            values.pop()
+
+        if major_dimension == "COLUMNS" and values:
+            width = max(len(row) for row in values)
+            columns = [[row[i] if i < len(row) else "" for row in values] for i in range(width)]
+            for column in columns:
+                while column and column[-1] == "":
+                    column.pop()
+            values = columns
+
+        response = {"range": a1_range, "majorDimension": major_dimension}
+        if values:
+            response["values"] = values
+        return response
+
+    def _write(self, rows, first_row, first_col, values):
+        for r, row_values in enumerate(values):
+            row_index = first_row + r
+            while len(rows) <= row_index:
+                rows.append([])
+            row = rows[row_index]
+            needed = first_col + len(row_values)
+            if len(row) < needed:
+                row.extend([""] * (needed - len(row)))
+            row[first_col:needed] = list(row_values)
+        return sum(len(row_values) for row_values in values)
+
+    def _update_values(self, spreadsheet_id, a1_range, body):
+        tab_name, first_row, first_col, _, _ = parse_range(a1_range)
+        values = body.get("values", [])
+        if body.get("majorDimension") == "COLUMNS":
+            width = max((len(column) for column in values), default=0)
+            values = [[column[i] if i < len(column) else "" for column in values] for i in range(width)]
+        updated = self._write(self._tab(spreadsheet_id, tab_name)["rows"], first_row, first_col, values)
+        return {"spreadsheetId": spreadsheet_id, "updatedRange": a1_range,
+                "updatedRows": len(values), "updatedCells": updated}
+
+    def _clear_values(self, spreadsheet_id, a1_range):
+        tab_name, first_row, first_col, last_row, last_col = parse_range(a1_range)
+        rows = self._tab(spreadsheet_id, tab_name)["rows"]
+        if first_row == 0 and first_col == 0 and last_row is None and last_col is None:
+            rows.clear()
+        else:
+            for row in rows[first_row:None if last_row is None else last_row + 1]:
+                end = len(row) if last_col is None else min(len(row), last_col + 1)
+                for i in range(first_col, end):
+                    row[i] = ""
+        return {"spreadsheetId": spreadsheet_id, "clearedRange": a1_range}
+
+    def _append_values(self, spreadsheet_id, a1_range, body):
+        tab_name, first_row, first_col, _, _ = parse_range(a1_range)
+        rows = self._tab(spreadsheet_id, tab_name)["rows"]
+        last_used = len(rows)
+        while last_used > first_row and not any(str(cell) != "" for cell in rows[last_used - 1][first_col:]):
+            last_used -= 1
+        values = body.get("values", [])
+        updated = self._write(rows, max(last_used, first_row), first_col, values)
+        start = max(last_used, first_row) + 1
+        updated_range = f"{tab_name}!{column_letter(first_col)}{start}:{column_letter(first_col + max((len(v) for v in values), default=1) - 1)}{start + len(values) - 1}"
+        return {"spreadsheetId": spreadsheet_id, "tableRange": a1_range,
+                "updates": {"updatedRange": updated_range, "updatedRows": len(values), "updatedCells": updated}}
+
+    def _export_pdf(self, spreadsheet_id, sheet_id):
+        """Render the tab's values as a one-page PDF, one text line per row."""
+        title, tab = self._tab_by_id(spreadsheet_id, sheet_id)
+        lines = [title] + [" | ".join(format_value(cell) for cell in row) for row in tab["rows"]]
+        text = "".join(
+            "({}) Tj T*\n".format(line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)"))
+            for line in lines
+        )
+        stream = f"BT /F1 9 Tf 11 TL 36 806 Td\n{text}ET".encode("latin-1", "replace")
+        objects = [
+            b"<< /Type /Catalog /Pages 2 0 R >>",
+            b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents 4 0 R "
+            b"/Resources << /Font << /F1 5 0 R >> >> >>",
+            b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream),
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        ]
+        pdf = b"%PDF-1.4\n"
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(len(pdf))
+            pdf += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+        xref_offset = len(pdf)
+        pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+        pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+        pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+        return pdf
+
+    def _sheet_properties(self, title, tab, index):
+        rows = tab["rows"]
+        return {
+            "sheetId": tab["sheetId"],
+            "title": title,
+            "index": index,
+            "sheetType": "GRID",
+            "gridProperties": {
+                "rowCount": max(DEFAULT_ROW_COUNT, len(rows)),
+                "columnCount": max([DEFAULT_COLUMN_COUNT] + [len(row) for row in rows]),
+            },
+        }
+
+    def _get_spreadsheet(self, spreadsheet_id):
+        if spreadsheet_id not in self.spreadsheets_data:
+            raise self._http_error(404, f"Requested entity was not found: {spreadsheet_id}")
+        tabs = self.spreadsheets_data[spreadsheet_id]
+        return {
+            "spreadsheetId": spreadsheet_id,
+            "properties": {"title": self.titles.get(spreadsheet_id, spreadsheet_id)},
+            "sheets": [{"properties": self._sheet_properties(title, tab, index)}
+                       for index, (title, tab) in enumerate(tabs.items())],
+        }
+
+    def _create_spreadsheet(self, body):
+        title = body.get("properties", {}).get("title") or "Untitled spreadsheet"
+        spreadsheet_id = f"emulated-{len(self.spreadsheets_data) + 1}"
+        while spreadsheet_id in self.spreadsheets_data:
+            spreadsheet_id += "-1"
+        titles = [sheet["properties"]["title"] for sheet in body.get("sheets", [])] or ["Sheet1"]
+        self.spreadsheets_data[spreadsheet_id] = {name: {"sheetId": self._new_sheet_id(), "rows": []} for name in titles}
+        self.titles[spreadsheet_id] = title
+        return self._get_spreadsheet(spreadsheet_id)
+
+    def _copy_sheet_to(self, spreadsheet_id, sheet_id, destination_spreadsheet_id):
+        title, source = self._tab_by_id(spreadsheet_id, sheet_id)
+        if destination_spreadsheet_id not in self.spreadsheets_data:
+            raise self._http_error(404, f"Requested entity was not found: {destination_spreadsheet_id}")
+        tabs = self.spreadsheets_data[destination_spreadsheet_id]
+        copy_title, number = f"Copy of {title}", 2
+        while copy_title in tabs:
+            copy_title, number = f"Copy of {title} {number}", number + 1
+        tabs[copy_title] = {"sheetId": self._new_sheet_id(), "rows": copy.deepcopy(source["rows"])}
+        return self._sheet_properties(copy_title, tabs[copy_title], len(tabs) - 1)
+
+    def _batch_update(self, spreadsheet_id, body):
+        tabs = self.spreadsheets_data.setdefault(spreadsheet_id, {})
+        replies = []
+        for request in body.get("requests", []):
+            if "duplicateSheet" in request:
+                params = request["duplicateSheet"]
+                _, source = self._tab_by_id(spreadsheet_id, params["sourceSheetId"])
+                title = params.get("newSheetName") or f"Copy {len(tabs)}"
+                if title in tabs:
+                    raise self._http_error(400, f'A sheet with the name "{title}" already exists.')
+                tabs[title] = {"sheetId": params.get("newSheetId") or self._new_sheet_id(),
+                               "rows": copy.deepcopy(source["rows"])}
+                replies.append({"duplicateSheet": {"properties": self._sheet_properties(title, tabs[title], len(tabs) - 1)}})
+            elif "addSheet" in request:
+                properties = request["addSheet"].get("properties", {})
+                title = properties.get("title") or f"Sheet{len(tabs) + 1}"
+                if title in tabs:
+                    raise self._http_error(400, f'A sheet with the name "{title}" already exists.')
+                tabs[title] = {"sheetId": properties.get("sheetId") or self._new_sheet_id(), "rows": []}
+                replies.append({"addSheet": {"properties": self._sheet_properties(title, tabs[title], len(tabs) - 1)}})
+            elif "deleteSheet" in request:
+                title, _ = self._tab_by_id(spreadsheet_id, request["deleteSheet"]["sheetId"])
+                del tabs[title]
+                replies.append({})
+            elif "updateSheetProperties" in request:
+                properties = request["updateSheetProperties"]["properties"]
+                title, tab = self._tab_by_id(spreadsheet_id, properties["sheetId"])
+                if "title" in properties:
+                    self.spreadsheets_data[spreadsheet_id] = {
+                        (properties["title"] if key == title else key): value for key, value in tabs.items()
+                    }
+                    tabs = self.spreadsheets_data[spreadsheet_id]
+                replies.append({})
+            elif "updateDimensionProperties" in request:
+                # Hiding or resizing rows/columns does not change any values
+                self._tab_by_id(spreadsheet_id, request["updateDimensionProperties"]["range"]["sheetId"])
+                replies.append({})
+            elif "updateCells" in request:
+                params = request["updateCells"]
+                if "start" in params:
+                    sheet_id = params["start"]["sheetId"]
+                    first_row = params["start"].get("rowIndex", 0)
+                    first_col = params["start"].get("columnIndex", 0)
+                else:
+                    sheet_id = params["range"]["sheetId"]
+                    first_row = params["range"].get("startRowIndex", 0)
+                    first_col = params["range"].get("startColumnIndex", 0)
+                _, tab = self._tab_by_id(spreadsheet_id, sheet_id)
+                values = [
+                    [next(iter(cell.get("userEnteredValue", {"stringValue": ""}).values())) for cell in row.get("values", [])]
+                    for row in params.get("rows", [])
+                ]
+                self._write(tab["rows"], first_row, first_col, values)
+                replies.append({})
+            else:
+                raise self._http_error(400, f"Unsupported request: {', '.join(request)}")
+        return {"spreadsheetId": spreadsheet_id, "replies": replies}
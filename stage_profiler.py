@@ -0,0 +1,189 @@
+"""Wall time, CPU time and memory per logical stage of a pipeline script.
+
+Stages are marked with profile_stage, as a context manager or a decorator:
+
+    with profile_stage("fetch"):
+        sheet_data = gsheet_utils.fetch_sheet_data(...)
+
+    @profile_stage("expand")
+    def expand_rows(df): ...
+
+    for chunk in profile_iter("fetch", chunks): ...
+
+Profiling is off unless the script runs with --profile (or CN_PROFILE=1), so the stages cost
+nothing in normal runs. When on, every stage records wall and CPU time, the tracemalloc peak
+above the memory held when it started, and the growth of the process's peak RSS. The table is
+printed and written as JSON to PROFILE_DIR (default "profiles/") when the script exits.
+Add --profile-stage <name> to also run that one stage under cProfile; its stats are dumped
+next to the report and the top functions are printed.
+"""
+from contextlib import ContextDecorator
+from datetime import datetime
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is not available
+    resource = None
+
+
+def _argument_value(flag):
+    """Return the value after flag in sys.argv ("--flag value" or "--flag=value"), or None."""
+    for i, argument in enumerate(sys.argv):
+        if argument == flag and i + 1 < len(sys.argv):
+            return sys.argv[i + 1]
+        if argument.startswith(f"{flag}="):
+            return argument.split("=", 1)[1]
+    return None
+
+
+CPROFILE_STAGE = _argument_value("--profile-stage") or os.getenv("CN_PROFILE_STAGE")
+PROFILING_ENABLED = "--profile" in sys.argv or os.getenv("CN_PROFILE", "") == "1" or bool(CPROFILE_STAGE)
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+CPROFILE_TOP_FUNCTIONS = 25
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return 0.0
+    # ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class StageProfiler:
+    """Collects the measurements of every stage run in this process."""
+
+    def __init__(self):
+        self.results = []
+        self.stack = []
+        self.started = 0
+        self.script = os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0]
+        self.report_registered = False
+
+    def enter(self, name):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        frame = {
+            "name": "/".join([entry["name"] for entry in self.stack] + [name]),
+            "depth": len(self.stack),
+            "order": self.started,
+            "wall_start": time.perf_counter(),
+            "cpu_start": time.process_time(),
+            "memory_start": current,
+            "child_peak": 0,
+            "rss_peak_start": _peak_rss_mb(),
+            "cprofile": None,
+        }
+        if CPROFILE_STAGE and name == CPROFILE_STAGE:
+            import cProfile
+            frame["cprofile"] = cProfile.Profile()
+            frame["cprofile"].enable()
+        self.started += 1
+        self.stack.append(frame)
+
+    def exit(self):
+        frame = self.stack.pop()
+        if frame["cprofile"] is not None:
+            frame["cprofile"].disable()
+        wall = time.perf_counter() - frame["wall_start"]
+        cpu = time.process_time() - frame["cpu_start"]
+
+        # reset_peak() in nested stages hides their peaks from this one, so children report them back
+        current, peak = tracemalloc.get_traced_memory()
+        peak = max(peak, frame["child_peak"])
+        if self.stack:
+            self.stack[-1]["child_peak"] = max(self.stack[-1]["child_peak"], peak)
+
+        self.results.append({
+            "stage": frame["name"],
+            "depth": frame["depth"],
+            "order": frame["order"],
+            "wall_s": round(wall, 4),
+            "cpu_s": round(cpu, 4),
+            "peak_alloc_mb": round((peak - frame["memory_start"]) / (1024 * 1024), 2),
+            "retained_mb": round((current - frame["memory_start"]) / (1024 * 1024), 2),
+            "peak_rss_growth_mb": round(_peak_rss_mb() - frame["rss_peak_start"], 2),
+        })
+        if frame["cprofile"] is not None:
+            self.dump_cprofile(frame["name"], frame["cprofile"])
+
+        if not self.report_registered:
+            self.report_registered = True
+            atexit.register(self.finish)
+
+    def dump_cprofile(self, stage_name, profiler):
+        import pstats
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stats_path = os.path.join(PROFILE_DIR, f"{self.script}_{stage_name.replace('/', '.')}.prof")
+        profiler.dump_stats(stats_path)
+        print(f"\ncProfile of stage '{stage_name}' (full stats in {stats_path}, open with snakeviz or pstats):")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(CPROFILE_TOP_FUNCTIONS)
+
+    def print_summary(self):
+        print(f"\nStage profile for {self.script} (peak alloc is tracemalloc, RSS growth is the process high-water mark):")
+        print(f"  {'wall s':>9} {'cpu s':>9} {'peak MB':>9} {'kept MB':>9} {'RSS +MB':>9}  stage")
+        # Results are appended as stages finish; show them in start order with nesting
+        for result in sorted(self.results, key=lambda result: result["order"]):
+            print(f"  {result['wall_s']:>9.3f} {result['cpu_s']:>9.3f} {result['peak_alloc_mb']:>9.2f} "
+                  f"{result['retained_mb']:>9.2f} {result['peak_rss_growth_mb']:>9.2f}  "
+                  f"{'  ' * result['depth']}{result['stage'].rsplit('/', 1)[-1]}")
+
+    def finish(self):
+        """Print the stage table and write it as JSON (registered at exit once a stage finished)."""
+        if not self.results:
+            return None
+        self.print_summary()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        report_path = os.path.join(PROFILE_DIR, f"{self.script}_{datetime.now():%Y%m%d-%H%M%S}.json")
+        with open(report_path, "w") as f:
+            json.dump({"script": self.script, "stages": self.results}, f, indent=2)
+        print(f"Stage profile report: {report_path}")
+        return report_path
+
+
+PROFILER = StageProfiler()
+
+
+def profile_iter(name, iterable):
+    """Yield the items of iterable, measuring the work behind each one as the stage name."""
+    iterator = iter(iterable)
+    while True:
+        with profile_stage(name):
+            item = next(iterator, StopIteration)
+        if item is StopIteration:
+            return
+        yield item
+
+
+class profile_stage(ContextDecorator):
+    """
+    Measure the enclosed block (or decorated function) as one stage; a no-op unless profiling is on.
+
+    Stages nest, and are only measured on the main thread (worker threads share its process-wide
+    counters, so their time shows up in the enclosing stage).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.active = []
+
+    def __enter__(self):
+        active = PROFILING_ENABLED and threading.current_thread() is threading.main_thread()
+        self.active.append(active)
+        if active:
+            PROFILER.enter(self.name)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.active.pop():
+            PROFILER.exit()
+        return False
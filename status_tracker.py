@@ -0,0 +1,107 @@
+import os
+import threading
+from google_sheet_processor import GoogleSheetUtils
+
+# 0 (the default) writes every status in one request when the run calls flush(). Set N to also
+# write them every N notes, so a run that is killed halfway keeps the "Done" marks of the notes it
+# finished and the rerun does not create them again, at one more request per N notes.
+STATUS_FLUSH_EVERY = int(os.getenv("STATUS_FLUSH_EVERY", "0"))
+
+
+class StatusTracker:
+    """
+    Collect processed rows during a run and write their status back in bulk.
+
+    The Status column letter of every tab is resolved from the header row once, rows are
+    gathered as notes are created (from any worker thread), and flush() writes all of them
+    to every tab in a single values.batchUpdate made of contiguous runs. With flush_every
+    (STATUS_FLUSH_EVERY by default), the rows gathered so far are also flushed every flush_every notes.
+    """
+
+    def __init__(self, service, spreadsheet_id, tab_names, status_column="Status", status_value="Done",
+                 flush_every=STATUS_FLUSH_EVERY):
+        self.service = service
+        self.spreadsheet_id = spreadsheet_id
+        self.tab_names = list(tab_names)
+        self.status_column = status_column
+        self.status_value = status_value
+        self.flush_every = flush_every
+        self.column_letters = None
+        self.pending = {tab_name: set() for tab_name in self.tab_names}
+        self.notes_since_flush = 0
+        self.lock = threading.RLock()
+
+    def resolve_column_letters(self):
+        """Read the header row of every tab in one batchGet and find the Status column."""
+        if self.column_letters is not None:
+            return self.column_letters
+
+        headers = GoogleSheetUtils.batch_fetch_sheet_data(
+            self.service, self.spreadsheet_id, [f"{tab_name}!1:1" for tab_name in self.tab_names]
+        )
+        self.column_letters = {}
+        for tab_name, header in zip(self.tab_names, headers):
+            header_row = [str(cell).strip() for cell in (header[0] if header else [])]
+            if self.status_column not in header_row:
+                raise KeyError(f'Column "{self.status_column}" not found in the header of tab "{tab_name}".')
+            self.column_letters[tab_name] = GoogleSheetUtils.column_letter(header_row.index(self.status_column))
+        return self.column_letters
+
+    def mark(self, row_index, tab_names=None, sheet_rows=None):
+        """
+        Record one processed note.
+
+        Args:
+            row_index (int): Zero-based DataFrame row; the header is sheet row 1, so data starts at row 2.
+            tab_names (list, optional): Tabs to mark at that row; defaults to every tracked tab.
+            sheet_rows (dict, optional): {tab: sheet row} for tabs where the note sits on another
+                row, e.g. the form response an InvDB product row came from.
+        """
+        with self.lock:
+            for tab_name in tab_names or self.tab_names:
+                self.pending[tab_name].add(row_index + 2)
+            for tab_name, sheet_row in (sheet_rows or {}).items():
+                self.pending[tab_name].add(sheet_row)
+
+            self.notes_since_flush += 1
+            if self.flush_every and self.notes_since_flush >= self.flush_every:
+                self.flush()
+
+    @staticmethod
+    def contiguous_runs(rows):
+        """Group sorted sheet rows into (first, last) runs, e.g. [2, 3, 4, 7] -> [(2, 4), (7, 7)]."""
+        runs = []
+        for row in sorted(rows):
+            if runs and row == runs[-1][1] + 1:
+                runs[-1][1] = row
+            else:
+                runs.append([row, row])
+        return [tuple(run) for run in runs]
+
+    def flush(self):
+        """Write every pending status to all tabs in one values.batchUpdate request."""
+        with self.lock:
+            return self._flush()
+
+    def _flush(self):
+        if not any(self.pending.values()):
+            return 0
+
+        column_letters = self.resolve_column_letters()
+        data = []
+        for tab_name, rows in self.pending.items():
+            letter = column_letters[tab_name]
+            for first, last in self.contiguous_runs(rows):
+                data.append({
+                    "range": f"{tab_name}!{letter}{first}:{letter}{last}",
+                    "majorDimension": "ROWS",
+                    "values": [[self.status_value]] * (last - first + 1),
+                })
+
+        GoogleSheetUtils.batch_update_values(self.service, self.spreadsheet_id, data)
+        marked = sum(len(rows) for rows in self.pending.values())
+        print(f"Marked {marked} rows as '{self.status_value}' in {', '.join(self.tab_names)} ({len(data)} ranges).")
+
+        self.pending = {tab_name: set() for tab_name in self.tab_names}
+        self.notes_since_flush = 0
+        return marked
@@ -0,0 +1,155 @@
+"""Local store of partner details (address, tax and bank fields) keyed by email address.
+
+Returning partners answer "No" to "first time submitting this form" and leave their details
+blank; the pipelines fill them in from the partner's earlier submissions. Those used to be
+looked up in the rows of the same fetch, so once a first submission was no longer in it the
+fill failed. Every run now records the details it reads, and the fill is one indexed lookup:
+
+    profiles = SubmitterProfiles()
+    profiles.record(df, email_column="email_address", timestamp_column="timestamp")
+    profiles.fill(df, email_column="email_address", rows=df["is_returning"], overwrite=True)
+
+Each field keeps its latest non-blank value together with the Timestamp of the submission it
+came from, so an older or blank answer never replaces a newer one. The store is
+CN_CACHE_DIR/submitter_profiles.sqlite.
+"""
+import os
+import sqlite3
+import threading
+
+from form_watermark import parse_timestamp
+
+PROFILE_FILE = os.path.join(os.getenv("CN_CACHE_DIR", ".cache"), "submitter_profiles.sqlite")
+
+# Details a returning partner does not fill in again (RITP form columns, standardized)
+PROFILE_FIELDS = [
+    'location', 'address_line_1', 'city', 'post_code/zip_code', 'country',
+    'file_of_contract', 'signed_date', 'tax_status',
+    'taxpayer_identification_number_(tin)', 'vat_id', 'iban', 'bic', 'account_number', 'swift'
+]
+
+# Cell values that count as "not answered"
+BLANK_VALUES = {"", "n/a", "#n/a", "nan", "none"}
+
+# SQLite allows 999 bound parameters per statement in older builds
+LOOKUP_CHUNK = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profile_fields (
+    email TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value TEXT NOT NULL,
+    submitted_at TEXT NOT NULL,
+    PRIMARY KEY (email, field)
+);
+"""
+
+
+def is_blank(value):
+    return value is None or str(value).strip().lower() in BLANK_VALUES
+
+
+def normalize_email(value):
+    return "" if is_blank(value) else str(value).strip().lower()
+
+
+class SubmitterProfiles:
+    """Latest partner details per email address, with the Timestamp each one was submitted at."""
+
+    def __init__(self, path=PROFILE_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def connect(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        db = sqlite3.connect(self.path)
+        db.executescript(SCHEMA)
+        return db
+
+    def record(self, df, email_column="email_address", timestamp_column="timestamp", fields=PROFILE_FIELDS):
+        """
+        Store the non-blank details of every row, keeping the newest value of each field.
+
+        Rows without a readable Timestamp count as the oldest submissions.
+
+        Returns:
+            int: Number of field values stored or replaced.
+        """
+        fields = [field for field in fields if field in df.columns]
+        if email_column not in df.columns or not fields:
+            return 0
+        timestamps = df[timestamp_column] if timestamp_column in df.columns else [None] * len(df)
+
+        values = []
+        for email, timestamp, (_, row) in zip(df[email_column], timestamps, df[fields].iterrows()):
+            email = normalize_email(email)
+            if not email:
+                continue
+            parsed = parse_timestamp(timestamp) if timestamp is not None else None
+            submitted_at = parsed.strftime("%Y-%m-%d %H:%M:%S") if parsed else ""
+            values += [(email, field, str(row[field]).strip(), submitted_at)
+                       for field in fields if not is_blank(row[field])]
+
+        with self.lock:
+            db = self.connect()
+            try:
+                with db:
+                    changes_before = db.total_changes
+                    db.executemany(
+                        "INSERT INTO profile_fields VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT (email, field) DO UPDATE SET value = excluded.value, "
+                        "submitted_at = excluded.submitted_at "
+                        "WHERE excluded.submitted_at >= profile_fields.submitted_at",
+                        values
+                    )
+                    stored = db.total_changes - changes_before
+            finally:
+                db.close()
+        print(f"Submitter profiles: {stored} field values stored from {len(df)} rows.")
+        return stored
+
+    def lookup(self, emails, fields=PROFILE_FIELDS):
+        """Return {email: {field: value}} for the given addresses (normalized) that have a profile."""
+        keys = sorted({normalize_email(email) for email in emails} - {""})
+        profiles = {}
+        db = self.connect()
+        try:
+            for start in range(0, len(keys), LOOKUP_CHUNK):
+                chunk = keys[start:start + LOOKUP_CHUNK]
+                for email, field, value in db.execute(
+                    f"SELECT email, field, value FROM profile_fields WHERE email IN ({', '.join('?' * len(chunk))})",
+                    chunk
+                ):
+                    if field in fields:
+                        profiles.setdefault(email, {})[field] = value
+        finally:
+            db.close()
+        return profiles
+
+    def fill(self, df, email_column="email_address", rows=None, overwrite=False, fields=PROFILE_FIELDS):
+        """
+        Fill in partner details in place from the store; only fields df already has are filled.
+
+        Args:
+            df (pd.DataFrame): Rows to fill; must have email_column.
+            rows (pd.Series, optional): Boolean mask of the rows to fill (default: all).
+            overwrite (bool): Replace every stored field, not only the blank cells.
+
+        Returns:
+            list: Normalized email addresses of the selected rows that have no profile.
+        """
+        fields = [field for field in fields if field in df.columns]
+        if email_column not in df.columns or not fields:
+            return []
+        selected = df.index if rows is None else df.index[rows.values]
+        emails = df.loc[selected, email_column].map(normalize_email)
+        profiles = self.lookup(emails.values, fields)
+
+        for field in fields:
+            values = emails.map(lambda email: profiles.get(email, {}).get(field))
+            values = values[values.notna()]
+            if not overwrite:
+                values = values[df.loc[values.index, field].map(is_blank)]
+            if len(values):
+                df.loc[values.index, field] = values
+        return sorted(set(emails) - set(profiles) - {""})
@@ -0,0 +1,260 @@
+"""Moves finished credit note and invoice tabs out of the working spreadsheet into period shards.
+
+Every note is a new tab (CN-CC-001426, CN-INFL-..., CN-ITP_..., Invoice-RE-...) in SPREADSHEET_ID,
+so the workbook keeps growing toward the cell limit and every spreadsheets.get, recalculation
+and page load gets slower. `python cn_creation.py archive` moves the note tabs whose PDF is
+already in the PDF store into one archive spreadsheet per month (ARCHIVE_PERIOD=quarter for
+one per quarter):
+
+    archive = TabArchive()
+    archive.archive(session, PdfStore())
+    archive.locate("CN-CC-001426")   # {"spreadsheet_id": ..., "sheet_id": ..., "period": "2025-01", ...}
+
+A tab is copied with sheets.copyTo, renamed back to its own title in the shard, recorded in
+the local index and only then deleted from the working spreadsheet, so an interrupted run
+loses nothing; the next run finds the copy in the shard and finishes the move.
+
+With SHARD_NEW_NOTES=1 (or `run --shard-notes`), the template scripts create new notes
+straight in the current period's shard through create_note_tab, and the working spreadsheet
+never holds them. The shards are created by the service account; share them with the people
+who need them. The index is CN_CACHE_DIR/tab_archive.sqlite.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from google_sheet_processor import GoogleSheetUtils, SheetsSession
+
+ARCHIVE_FILE = os.path.join(os.getenv("CN_CACHE_DIR", ".cache"), "tab_archive.sqlite")
+
+# One archive spreadsheet per "month" or "quarter"
+ARCHIVE_PERIOD = os.getenv("ARCHIVE_PERIOD", "month")
+ARCHIVE_TITLE = os.getenv("ARCHIVE_TITLE", "Credit notes and invoices {period}")
+
+# Create new notes in the current period's shard instead of the working spreadsheet
+SHARD_NEW_NOTES = os.getenv("SHARD_NEW_NOTES", "").lower() in {"1", "true", "yes"}
+
+# Tabs the template scripts create
+NOTE_TAB_PATTERN = re.compile(r'^(CN-|Invoice-)')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shards (
+    period TEXT PRIMARY KEY,
+    spreadsheet_id TEXT NOT NULL,
+    placeholder_sheet_id INTEGER,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tabs (
+    tab TEXT PRIMARY KEY,
+    spreadsheet_id TEXT NOT NULL,
+    sheet_id INTEGER,
+    period TEXT NOT NULL,
+    created_at REAL,
+    archived_at REAL
+);
+"""
+
+
+def period_of(timestamp, period=None):
+    """Archive period of a Unix time: "2025-01" per month, "2025-Q1" per quarter."""
+    moment = datetime.fromtimestamp(timestamp)
+    if (period or ARCHIVE_PERIOD) == "quarter":
+        return f"{moment.year}-Q{(moment.month - 1) // 3 + 1}"
+    return moment.strftime("%Y-%m")
+
+
+def spreadsheet_url(spreadsheet_id, sheet_id=None):
+    url = f"https://docs.google.com/spreadsheets/d/{spreadsheet_id}/edit"
+    return url if sheet_id is None else f"{url}#gid={sheet_id}"
+
+
+class TabArchive:
+    """Local index of the archive shards (period -> spreadsheet) and of where every note tab lives."""
+
+    def __init__(self, path=ARCHIVE_FILE, period=None):
+        self.path = path
+        self.period = period or ARCHIVE_PERIOD
+        self.lock = threading.RLock()
+        self.template_ids = {}
+
+    def connect(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        db = sqlite3.connect(self.path)
+        db.executescript(SCHEMA)
+        return db
+
+    def locate(self, tab):
+        """Where a note tab lives: {"spreadsheet_id", "sheet_id", "period", "archived_at", "url"}, or None."""
+        db = self.connect()
+        try:
+            stored = db.execute("SELECT spreadsheet_id, sheet_id, period, archived_at FROM tabs WHERE tab = ?",
+                                (tab,)).fetchone()
+        finally:
+            db.close()
+        if stored is None:
+            return None
+        spreadsheet_id, sheet_id, period, archived_at = stored
+        return {"spreadsheet_id": spreadsheet_id, "sheet_id": sheet_id, "period": period,
+                "archived_at": archived_at, "url": spreadsheet_url(spreadsheet_id, sheet_id)}
+
+    def shards(self):
+        """{period: spreadsheet ID} of every shard created so far."""
+        db = self.connect()
+        try:
+            return dict(db.execute("SELECT period, spreadsheet_id FROM shards ORDER BY period"))
+        finally:
+            db.close()
+
+    def record(self, tab, spreadsheet_id, sheet_id, period, created_at=None, archived_at=None):
+        """Store where a tab is; the creation time of an earlier record is kept."""
+        with self.lock:
+            db = self.connect()
+            try:
+                with db:
+                    db.execute(
+                        "INSERT INTO tabs VALUES (?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (tab) DO UPDATE SET spreadsheet_id = excluded.spreadsheet_id, "
+                        "sheet_id = excluded.sheet_id, period = excluded.period, "
+                        "created_at = COALESCE(tabs.created_at, excluded.created_at), "
+                        "archived_at = excluded.archived_at",
+                        (tab, spreadsheet_id, sheet_id, period, created_at, archived_at)
+                    )
+            finally:
+                db.close()
+
+    def shard(self, service, period):
+        """
+        Spreadsheet ID of a period's shard, created on first use.
+
+        Returns None in dry-run mode when the shard does not exist yet.
+        """
+        with self.lock:
+            db = self.connect()
+            try:
+                stored = db.execute("SELECT spreadsheet_id FROM shards WHERE period = ?", (period,)).fetchone()
+                if stored:
+                    return stored[0]
+                response = GoogleSheetUtils.create_spreadsheet(service, ARCHIVE_TITLE.format(period=period))
+                if response is None:  # dry run
+                    return None
+                # The blank tab the API adds is deleted once the first note is in
+                placeholder = response["sheets"][0]["properties"]["sheetId"] if response.get("sheets") else None
+                with db:
+                    db.execute("INSERT INTO shards VALUES (?, ?, ?, ?)",
+                               (period, response["spreadsheetId"], placeholder, time.time()))
+                print(f"Created archive spreadsheet for {period}: {spreadsheet_url(response['spreadsheetId'])}")
+                return response["spreadsheetId"]
+            finally:
+                db.close()
+
+    def _take_placeholder(self, period):
+        """Sheet ID of the shard's blank tab, if it still has one; forgotten once returned."""
+        with self.lock:
+            db = self.connect()
+            try:
+                with db:
+                    stored = db.execute("SELECT placeholder_sheet_id FROM shards WHERE period = ?",
+                                        (period,)).fetchone()
+                    db.execute("UPDATE shards SET placeholder_sheet_id = NULL WHERE period = ?", (period,))
+            finally:
+                db.close()
+        return stored[0] if stored else None
+
+    def _move_into_shard(self, service, source_spreadsheet_id, sheet_ids, period):
+        """
+        Copy tabs ({title: sheet ID in the source}) into a period's shard under their own titles.
+
+        Returns:
+            tuple: (shard spreadsheet ID, {title: sheet ID in the shard})
+        """
+        shard_id = self.shard(service, period)
+        in_shard = GoogleSheetUtils.sheet_ids(service, shard_id)
+        renames, moved = {}, {}
+        for title, sheet_id in sheet_ids.items():
+            if title in in_shard:
+                # Copied by an earlier run that stopped before deleting the source tab
+                moved[title] = in_shard[title]
+                continue
+            copy_id = GoogleSheetUtils.copy_sheet_to(service, source_spreadsheet_id, sheet_id, shard_id)
+            renames[copy_id] = title
+            moved[title] = copy_id
+        placeholder = self._take_placeholder(period) if moved else None
+        GoogleSheetUtils.rename_and_delete_sheets(service, shard_id, renames,
+                                                  [placeholder] if placeholder is not None else [])
+        return shard_id, moved
+
+    def create_note_tab(self, session, template_sheet_name, new_sheet_name):
+        """
+        Copy a template tab into a new note tab, in the working spreadsheet or (with SHARD_NEW_NOTES)
+        straight into the current period's shard.
+
+        Returns:
+            tuple: (SheetsSession of the spreadsheet that holds the note, sheet ID of the note or
+            None in dry-run mode)
+        """
+        now = time.time()
+        period = period_of(now, self.period)
+        shard_id = self.shard(session.service, period) if SHARD_NEW_NOTES else None
+        if shard_id is None:
+            sheet_id = GoogleSheetUtils.copy_sheet(session.service, session.spreadsheet_id, template_sheet_name,
+                                                   new_sheet_name)
+            target = session
+        else:
+            with self.lock:
+                if template_sheet_name not in self.template_ids:
+                    self.template_ids[template_sheet_name] = GoogleSheetUtils.sheet_ids(
+                        session.service, session.spreadsheet_id)[template_sheet_name]
+            _, moved = self._move_into_shard(session.service, session.spreadsheet_id,
+                                             {new_sheet_name: self.template_ids[template_sheet_name]}, period)
+            sheet_id = moved[new_sheet_name]
+            target = SheetsSession(shard_id, session.credentials, session.service)
+        if sheet_id is not None:
+            self.record(new_sheet_name, target.spreadsheet_id, sheet_id, period, created_at=now,
+                        archived_at=now if target is not session else None)
+        return target, sheet_id
+
+    def archive(self, session, pdf_store, pattern=NOTE_TAB_PATTERN):
+        """
+        Move the finished note tabs of the working spreadsheet into their period's shard.
+
+        A tab is finished once its PDF ("<tab>.pdf") is in the PDF store. Tabs the index saw being
+        created go to the shard of their creation period, the others to the current one.
+
+        Returns:
+            dict: {period: [tab titles moved]} (what would be moved, in dry-run mode)
+        """
+        service, spreadsheet_id = session.service, session.spreadsheet_id
+        sheet_ids = GoogleSheetUtils.sheet_ids(service, spreadsheet_id)
+        notes = [title for title in sheet_ids if pattern.match(title)]
+        finished = [title for title in notes if f"{title}.pdf" in pdf_store.index["names"]]
+        if len(finished) < len(notes):
+            print(f"Keeping {len(notes) - len(finished)} note tabs without an exported PDF.")
+
+        now = time.time()
+        plan = {}
+        for title in finished:
+            known = self.locate(title)
+            period = known["period"] if known else period_of(now, self.period)
+            plan.setdefault(period, []).append(title)
+
+        if GoogleSheetUtils.dry_run:
+            for period, titles in sorted(plan.items()):
+                print(f"[dry-run] Would archive {len(titles)} tabs into the {period} shard: {', '.join(titles)}")
+            return plan
+
+        archived = []
+        for period, titles in sorted(plan.items()):
+            shard_id, moved = self._move_into_shard(service, spreadsheet_id,
+                                                    {title: sheet_ids[title] for title in titles}, period)
+            for title, sheet_id in moved.items():
+                self.record(title, shard_id, sheet_id, period, archived_at=time.time())
+            archived += titles
+            print(f"Archived {len(titles)} tabs into {period}: {spreadsheet_url(shard_id)}")
+
+        # Every copy is recorded; now the working spreadsheet can let go of them, in one request
+        GoogleSheetUtils.rename_and_delete_sheets(service, spreadsheet_id,
+                                                  deletes=[sheet_ids[title] for title in archived])
+        return plan
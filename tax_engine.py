@@ -0,0 +1,191 @@
+from decimal import Decimal, ROUND_HALF_UP
+import math
+import re
+
+
+# VAT rates in percent, keyed by (country, tax status). None is a wildcard, so a
+# tax-status rule applies to every country and a country rule to every status.
+# Lookups try (country, status), then (None, status), then (country, None).
+VAT_RATE_TABLE = {
+    (None, "within germany"): Decimal("19"),
+    (None, "outside germany"): Decimal("0"),
+    ("germany", None): Decimal("19"),
+    ("deutschland", None): Decimal("19"),
+}
+
+DEFAULT_VAT_RATE = Decimal("0")
+CENT = Decimal("0.01")
+
+TAX_COLUMNS = ["net_total", "vat_rate", "vat_percentage", "vat_amount", "gross_total"]
+
+# Why a group has no totals (missing amount column, unreadable amount); None for the others
+ERROR_COLUMN = "tax_error"
+
+# Currency symbols and codes written next to amounts
+CURRENCY_PATTERN = re.compile(r"[€$£]|\b(EUR|USD|GBP|CHF)\b", re.IGNORECASE)
+
+
+class TaxEngine:
+    @staticmethod
+    def to_decimal(value):
+        """
+        Parse a sheet cell ("1,234.50", "€ 80", "1.234,50", "80,5") into an exact Decimal; blanks count as zero.
+
+        Raises:
+            ValueError: The cell holds something that is not an amount ("N/A", "12-").
+        """
+        if isinstance(value, Decimal):
+            return value
+        if value is None or isinstance(value, bool):
+            return Decimal("0")
+        if isinstance(value, int):
+            return Decimal(value)
+        if isinstance(value, float):
+            return Decimal("0") if math.isnan(value) else Decimal(str(value))
+
+        text = CURRENCY_PATTERN.sub("", str(value)).replace(" ", "").replace("\u00a0", "")
+        if not text:
+            return Decimal("0")
+
+        sign = ""
+        if text[0] in "+-":
+            sign, text = text[0].replace("+", ""), text[1:]
+        if re.fullmatch(r"\d{1,3}(,\d{3})+(\.\d+)?", text):      # 1,234.50 / 1,234
+            text = text.replace(",", "")
+        elif re.fullmatch(r"\d{1,3}(\.\d{3})+,\d+", text):        # 1.234,50
+            text = text.replace(".", "").replace(",", ".")
+        elif re.fullmatch(r"\d{1,3}(\.\d{3}){2,}", text):          # 1.234.567
+            text = text.replace(".", "")
+        elif re.fullmatch(r"\d+,\d+", text):                       # 80,5 / 80,50
+            text = text.replace(",", ".")
+        elif not re.fullmatch(r"(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?", text):  # 80 / 80.5 / 1e3
+            raise ValueError(f"Cannot read {value!r} as an amount.")
+        return Decimal(sign + text)
+
+    @staticmethod
+    def resolve_vat_rates(countries, tax_statuses, rate_table=VAT_RATE_TABLE):
+        """Look up the VAT rate for each (country, tax status) pair in the rate table."""
+        import pandas as pd
+
+        countries = countries.fillna("").astype(str).str.strip().str.lower()
+        tax_statuses = tax_statuses.fillna("").astype(str).str.strip().str.lower()
+
+        exact = {key: rate for key, rate in rate_table.items() if key[0] is not None and key[1] is not None}
+        by_status = {key[1]: rate for key, rate in rate_table.items() if key[0] is None and key[1] is not None}
+        by_country = {key[0]: rate for key, rate in rate_table.items() if key[0] is not None and key[1] is None}
+
+        rates = pd.Series(
+            [exact.get(pair) for pair in zip(countries, tax_statuses)], index=countries.index, dtype=object
+        )
+        rates = rates.where(rates.notna(), tax_statuses.map(lambda status: by_status.get(status)))
+        rates = rates.where(rates.notna(), countries.map(lambda country: by_country.get(country)))
+        return rates.where(rates.notna(), DEFAULT_VAT_RATE)
+
+    @staticmethod
+    def parse_amounts(column):
+        """
+        to_decimal of every cell of a Series.
+
+        Returns:
+            tuple: (amounts, errors) as lists in row order; a cell that cannot be read counts as
+            zero and has its error message in errors, the others have None.
+        """
+        amounts, errors = [], []
+        for value in column:
+            try:
+                amounts.append(TaxEngine.to_decimal(value))
+                errors.append(None)
+            except ValueError as e:
+                amounts.append(Decimal("0"))
+                errors.append(str(e))
+        return amounts, errors
+
+    @staticmethod
+    def compute(df, group_by, amount_column, quantity_column=None, country_column=None,
+                tax_status_column=None, rate_table=VAT_RATE_TABLE):
+        """
+        Compute net, VAT rate, VAT amount and gross per group of line items in one groupby pass.
+
+        A group whose amounts cannot be read (or a frame without the amount column) does not
+        stop the others: its totals are left empty and ERROR_COLUMN says why, so the note built
+        from it fails on its own in TaxEngine.check.
+
+        Args:
+            df (pd.DataFrame): Line items, one row per note line.
+            group_by (str | list | None): Column(s) identifying a note. None treats every row as its own note.
+            amount_column (str): Line amount (or unit price when quantity_column is given).
+            quantity_column (str, optional): Quantity multiplied into the line amount.
+            country_column (str, optional): Country used for the rate lookup (first value per group).
+            tax_status_column (str, optional): Tax status used for the rate lookup (first value per group).
+            rate_table (dict): (country, tax status) -> VAT rate in percent.
+
+        Returns:
+            pd.DataFrame: One row per group with the TAX_COLUMNS, amounts as Decimal, and ERROR_COLUMN.
+        """
+        import pandas as pd
+
+        if amount_column in df.columns:
+            line_net, line_errors = TaxEngine.parse_amounts(df[amount_column])
+        else:
+            line_net = [Decimal("0")] * len(df)
+            line_errors = [f'Column "{amount_column}" not found.'] * len(df)
+        if quantity_column and quantity_column in df.columns:
+            quantities, quantity_errors = TaxEngine.parse_amounts(df[quantity_column])
+            line_net = [net * quantity for net, quantity in zip(line_net, quantities)]
+            line_errors = [error or quantity_error for error, quantity_error in zip(line_errors, quantity_errors)]
+
+        work = pd.DataFrame({
+            "net_total": line_net,
+            "error": line_errors,
+            "country": df[country_column] if country_column in df.columns else "",
+            "tax_status": df[tax_status_column] if tax_status_column in df.columns else "",
+        }, index=df.index)
+
+        if group_by is None:
+            keys = df.index
+        elif isinstance(group_by, str):
+            keys = df[group_by]
+        else:
+            keys = [df[column] for column in group_by]
+        # dropna=False: a row with a blank key is a note of its own, not left out of the totals
+        totals = work.groupby(keys, sort=False, dropna=False).agg(
+            net_total=("net_total", "sum"),
+            error=("error", "first"),
+            country=("country", "first"),
+            tax_status=("tax_status", "first"),
+        )
+
+        totals["net_total"] = [Decimal(net).quantize(CENT, ROUND_HALF_UP) for net in totals["net_total"]]
+        totals["vat_rate"] = TaxEngine.resolve_vat_rates(totals["country"], totals["tax_status"], rate_table)
+        totals["vat_percentage"] = [f"VAT {rate.normalize():f}%" for rate in totals["vat_rate"]]
+        totals["vat_amount"] = [
+            (net * rate / 100).quantize(CENT, ROUND_HALF_UP)
+            for net, rate in zip(totals["net_total"], totals["vat_rate"])
+        ]
+        totals["gross_total"] = [net + vat for net, vat in zip(totals["net_total"], totals["vat_amount"])]
+
+        failed = totals["error"].notna()
+        if failed.any():
+            print(f"Could not compute the totals of {int(failed.sum())} groups; their notes will fail.")
+        totals = totals.astype({column: object for column in TAX_COLUMNS})
+        totals.loc[failed, TAX_COLUMNS] = None
+        totals[ERROR_COLUMN] = totals["error"].where(failed, None)
+        return totals[TAX_COLUMNS + [ERROR_COLUMN]]
+
+    @staticmethod
+    def check(tax_row):
+        """
+        The totals of one group, without ERROR_COLUMN.
+
+        Raises:
+            ValueError: The group's totals could not be computed.
+        """
+        error = tax_row.get(ERROR_COLUMN)
+        if isinstance(error, str) and error:
+            raise ValueError(f"No tax totals: {error}")
+        return tax_row.drop(ERROR_COLUMN, errors="ignore")
+
+    @staticmethod
+    def to_sheet_values(tax_df):
+        """Convert Decimal amounts to plain strings so they can be written to the sheet like any other value."""
+        return tax_df.apply(lambda column: column.map(lambda value: f"{value:f}" if isinstance(value, Decimal) else value))
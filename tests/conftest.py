@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The modules under test live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# No API metrics report from test runs
+os.environ.setdefault("API_METRICS", "0")
@@ -0,0 +1,62 @@
+"""GoogleSheetUtils.append_new_rows against the Sheets emulator."""
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("googleapiclient")
+
+from fingerprint_index import FINGERPRINT_COLUMN  # noqa: E402
+from google_sheet_processor import GoogleSheetUtils, RateLimiter  # noqa: E402
+from sheets_emulator import SheetsEmulator  # noqa: E402
+
+SPREADSHEET_ID = "sheet"
+KEY = ["trip_id", "Invoice: Invoice No."]
+
+
+@pytest.fixture
+def emulator(tmp_path, monkeypatch):
+    # The fingerprint index lives under .cache/ in the working directory
+    monkeypatch.chdir(tmp_path)
+    # The emulator has no quota; do not wait for the live API's
+    monkeypatch.setattr(GoogleSheetUtils, "rate_limiter", RateLimiter(60000))
+    return SheetsEmulator()
+
+
+def db_rows():
+    return pd.DataFrame({"trip_id": ["T-250114-3", "T-250114-4"], "Invoice: Invoice No.": ["INV-1", "INV-2"],
+                         "Amount": ["80", "120"]})
+
+
+def test_appends_to_an_empty_tab_and_skips_rows_already_written(emulator):
+    emulator.add_tab(SPREADSHEET_ID, "DB-INFL")
+
+    assert GoogleSheetUtils.append_new_rows(emulator, db_rows(), SPREADSHEET_ID, "DB-INFL", KEY) == 2
+    assert GoogleSheetUtils.append_new_rows(emulator, db_rows(), SPREADSHEET_ID, "DB-INFL", KEY) == 0
+
+    values = emulator.tab_values(SPREADSHEET_ID, "DB-INFL")
+    assert values[0] == ["trip_id", "Invoice: Invoice No.", "Amount", FINGERPRINT_COLUMN]
+    assert len(values) == 3
+
+
+def test_refuses_a_tab_written_without_fingerprints(emulator):
+    old_rows = [["trip_id", "Invoice: Invoice No.", "Amount"], ["T-250114-3", "INV-1", "80"]]
+    emulator.add_tab(SPREADSHEET_ID, "DB-INFL", old_rows)
+
+    with pytest.raises(ValueError, match="--rebuild"):
+        GoogleSheetUtils.append_new_rows(emulator, db_rows(), SPREADSHEET_ID, "DB-INFL", KEY)
+
+    assert emulator.tab_values(SPREADSHEET_ID, "DB-INFL") == old_rows
+
+
+def test_rebuild_rewrites_a_tab_without_fingerprints_once(emulator):
+    emulator.add_tab(SPREADSHEET_ID, "DB-INFL", [["trip_id", "Invoice: Invoice No.", "Amount"],
+                                                 ["T-250114-3", "INV-1", "80"]])
+
+    assert GoogleSheetUtils.append_new_rows(emulator, db_rows(), SPREADSHEET_ID, "DB-INFL", KEY, rebuild=True) == 2
+    assert GoogleSheetUtils.append_new_rows(emulator, db_rows(), SPREADSHEET_ID, "DB-INFL", KEY) == 0
+    assert len(emulator.tab_values(SPREADSHEET_ID, "DB-INFL")) == 3
+
+
+def test_header_only_tab_is_appended_to(emulator):
+    emulator.add_tab(SPREADSHEET_ID, "DB-RITP", [["trip_id", "Invoice: Invoice No.", "Amount"]])
+
+    assert GoogleSheetUtils.append_new_rows(emulator, db_rows(), SPREADSHEET_ID, "DB-RITP", KEY) == 2
@@ -0,0 +1,200 @@
+"""Both DataFrame backends (dataframe_backend.py) give the results the row-by-row code gave.
+
+    python -m pytest tests
+
+The arrow cases are skipped when pyarrow is not installed.
+"""
+import importlib.util
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+np = pytest.importorskip("numpy")
+
+from google_sheet_processor import DataFrameUtils  # noqa: E402
+from trip_index import TRIP_KEY, merge_on_trip  # noqa: E402
+
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+
+@pytest.fixture(params=[
+    "pandas",
+    pytest.param("arrow", marks=pytest.mark.skipif(not HAS_PYARROW, reason="pyarrow is not installed")),
+])
+def backend(request):
+    return request.param
+
+
+def frame(columns, index=None):
+    """An all-object DataFrame, the way the form tabs are read."""
+    return pd.DataFrame({name: np.array(values, dtype=object) for name, values in columns.items()}, index=index)
+
+
+# --- explode_trip_ids ---
+
+def test_explode_trip_ids_one_row_per_trip_id(backend):
+    df = frame({"trip_id": ["T-250114-3, T-250114-4", "Trip T-250114-5 (rebooked)"], "name": ["a", "b"]})
+
+    result = DataFrameUtils.explode_trip_ids(df, "trip_id", backend=backend)
+
+    expected = frame({"trip_id": ["T-250114-3", "T-250114-4", "T-250114-5"], "name": ["a", "a", "b"]},
+                     index=[0, 0, 1])
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_explode_trip_ids_keeps_cells_without_trip_id(backend):
+    df = frame({"trip_id": ["", np.nan, None, 42, "none", "t-250114-6"], "name": list("abcdef")})
+
+    result = DataFrameUtils.explode_trip_ids(df, "trip_id", backend=backend)
+
+    expected = frame({"trip_id": ["", np.nan, None, 42, "none", "t-250114-6"], "name": list("abcdef")})
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_explode_trip_ids_repeats_duplicate_index_labels(backend):
+    df = frame({"trip_id": ["T-250114-3, T-250114-4", "T-250114-5", "x"], "name": ["a", "b", "c"]},
+               index=[7, 7, 2])
+
+    result = DataFrameUtils.explode_trip_ids(df, "trip_id", backend=backend)
+
+    expected = frame({"trip_id": ["T-250114-3", "T-250114-4", "T-250114-5", "x"], "name": ["a", "a", "b", "c"]},
+                     index=[7, 7, 7, 2])
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_explode_trip_ids_empty_frame(backend):
+    df = frame({"trip_id": [], "name": []})
+
+    result = DataFrameUtils.explode_trip_ids(df, "trip_id", backend=backend)
+
+    pd.testing.assert_frame_equal(result, df)
+
+
+# --- expand_comma_separated ---
+
+def test_expand_comma_separated_strips_values(backend):
+    df = frame({"invoice": ["INV-1, INV-2", "INV-3", "INV-4,"], "trip_id": ["T-1", "T-2", "T-3"]})
+
+    result = DataFrameUtils.expand_comma_separated(df, "invoice", backend=backend)
+
+    expected = frame({"invoice": ["INV-1", "INV-2", "INV-3", "INV-4", ""],
+                      "trip_id": ["T-1", "T-1", "T-2", "T-3", "T-3"]},
+                     index=[0, 0, 1, 2, 2])
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_expand_comma_separated_keeps_cells_without_comma(backend):
+    df = frame({"invoice": ["", np.nan, 7, 1.5, " INV-5 "], "trip_id": list("abcde")})
+
+    result = DataFrameUtils.expand_comma_separated(df, "invoice", backend=backend)
+
+    pd.testing.assert_frame_equal(result, df)
+
+
+def test_expand_comma_separated_repeats_duplicate_index_labels(backend):
+    df = frame({"invoice": ["INV-1,INV-2", "INV-3"], "trip_id": ["T-1", "T-2"]}, index=[3, 3])
+
+    result = DataFrameUtils.expand_comma_separated(df, "invoice", backend=backend)
+
+    expected = frame({"invoice": ["INV-1", "INV-2", "INV-3"], "trip_id": ["T-1", "T-1", "T-2"]}, index=[3, 3, 3])
+    pd.testing.assert_frame_equal(result, expected)
+
+
+# --- drop_duplicate_rows ---
+
+def test_drop_duplicate_rows_keeps_first(backend):
+    df = frame({"trip_id": ["T-1", "T-1", "T-2", "T-1"], "invoice": ["INV-1", "INV-1", "INV-1", "INV-2"],
+                "note": ["first", "second", "third", "fourth"]})
+
+    result = DataFrameUtils.drop_duplicate_rows(df, ["trip_id", "invoice"], backend=backend)
+
+    pd.testing.assert_frame_equal(result, df.drop_duplicates(subset=["trip_id", "invoice"]))
+    assert result["note"].tolist() == ["first", "third", "fourth"]
+
+
+def test_drop_duplicate_rows_empty_and_missing_cells(backend):
+    df = frame({"trip_id": ["", "", np.nan, np.nan, None, "nan"], "invoice": ["INV-1"] * 6})
+
+    result = DataFrameUtils.drop_duplicate_rows(df, ["trip_id", "invoice"], backend=backend)
+
+    pd.testing.assert_frame_equal(result, df.drop_duplicates(subset=["trip_id", "invoice"]))
+
+
+def test_drop_duplicate_rows_non_string_values(backend):
+    df = frame({"trip_id": [1, "1", 1, 1.0, True, "True"], "invoice": ["INV-1"] * 6})
+
+    result = DataFrameUtils.drop_duplicate_rows(df, ["trip_id", "invoice"], backend=backend)
+
+    pd.testing.assert_frame_equal(result, df.drop_duplicates(subset=["trip_id", "invoice"]))
+
+
+def test_drop_duplicate_rows_duplicate_index_labels(backend):
+    df = frame({"trip_id": ["T-1", "T-1", "T-2"], "invoice": ["INV-1", "INV-1", "INV-1"]}, index=[5, 5, 5])
+
+    result = DataFrameUtils.drop_duplicate_rows(df, ["trip_id", "invoice"], backend=backend)
+
+    pd.testing.assert_frame_equal(result, df.iloc[[0, 2]])
+    # A frame of its own: the callers go on to modify it in place
+    result.loc[:, "invoice"] = "changed"
+    assert df["invoice"].tolist() == ["INV-1", "INV-1", "INV-1"]
+
+
+# --- merge_on_trip ---
+
+def reference_rows(rows):
+    """Reference rows as TripIndex.lookup_frame returns them: the normalized trip key plus the stored columns."""
+    return pd.DataFrame(rows, columns=[TRIP_KEY, "Invoice: Invoice No.", "Record Type"], dtype=object)
+
+
+def test_merge_on_trip_matches_normalized_trip_ids(backend):
+    df = frame({"trip_id": [" 'T-250114-3", "t-250114-4 ", "T-250114-9"], "name": ["a", "b", "c"]})
+    reference = reference_rows([["t-250114-3", "INV-1", "Influencer"], ["t-250114-4", "INV-2", "Marketing"]])
+
+    result = merge_on_trip(df, reference, "trip_id", backend=backend)
+
+    expected = frame({"trip_id": [" 'T-250114-3", "t-250114-4 ", "T-250114-9"], "name": ["a", "b", "c"],
+                      "Invoice: Invoice No.": ["INV-1", "INV-2", np.nan],
+                      "Record Type": ["Influencer", "Marketing", np.nan]})
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_merge_on_trip_one_row_per_reference_match(backend):
+    df = frame({"trip_id": ["T-250114-3"], "name": ["a"]}, index=[4])
+    reference = reference_rows([["t-250114-3", "INV-1", "Influencer"], ["t-250114-3", "INV-2", "Influencer"]])
+
+    result = merge_on_trip(df, reference, "trip_id", backend=backend)
+
+    assert result["Invoice: Invoice No."].tolist() == ["INV-1", "INV-2"]
+    assert result["trip_id"].tolist() == ["T-250114-3", "T-250114-3"]
+
+
+def test_merge_on_trip_empty_and_non_string_trip_ids(backend):
+    df = frame({"trip_id": ["", np.nan, None, "none", 42], "name": list("abcde")}, index=[0, 0, 1, 1, 1])
+    reference = reference_rows([["42", "INV-42", "Marketing"], ["t-250114-3", "INV-1", "Influencer"]])
+
+    result = merge_on_trip(df, reference, "trip_id", backend=backend)
+
+    expected = frame({"trip_id": ["", np.nan, None, "none", 42], "name": list("abcde"),
+                      "Invoice: Invoice No.": [np.nan, np.nan, np.nan, np.nan, "INV-42"],
+                      "Record Type": [np.nan, np.nan, np.nan, np.nan, "Marketing"]})
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_merge_on_trip_without_reference_rows(backend):
+    df = frame({"trip_id": ["T-250114-3"], "name": ["a"]})
+
+    result = merge_on_trip(df, reference_rows([]), "trip_id", backend=backend)
+
+    expected = frame({"trip_id": ["T-250114-3"], "name": ["a"], "Invoice: Invoice No.": [np.nan],
+                      "Record Type": [np.nan]})
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_merge_on_trip_suffixes_clashing_columns(backend):
+    df = frame({"trip_id": ["T-250114-3"], "Record Type": ["form"]})
+    reference = reference_rows([["t-250114-3", "INV-1", "Influencer"]])
+
+    result = merge_on_trip(df, reference, "trip_id", backend=backend)
+
+    assert list(result.columns) == ["trip_id", "Record Type", "Invoice: Invoice No.", "Record Type_sf"]
+    assert result.loc[0, "Record Type_sf"] == "Influencer"
@@ -0,0 +1,91 @@
+"""FormWatermark picks only the responses submitted since the last run."""
+from form_watermark import FormWatermark
+
+HEADER = ["Timestamp", "Email Address", "Trip ID"]
+
+
+def response(day, email):
+    return [f"01/{day:02}/2025 09:00:00", email, f"T-2501{day:02}-1"]
+
+
+class Tab:
+    """A form-response tab that read_new_rows reads A1 ranges from."""
+
+    def __init__(self, rows):
+        self.rows = [HEADER] + rows
+
+    def read_range(self, range_):
+        start, end = (cell.lstrip("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for cell in range_.split(":"))
+        first_row, last_row = int(start), int(end) if end else len(self.rows)
+        return self.rows[first_row - 1:last_row]
+
+
+def read(watermark, tab):
+    return watermark.read_new_rows(tab.read_range, "sheet", "RITP", "A", "C")
+
+
+def test_first_run_reads_every_row(tmp_path):
+    watermark = FormWatermark(str(tmp_path / "watermarks.json"))
+    tab = Tab([response(1, "a"), response(2, "b")])
+
+    header, rows, mark = read(watermark, tab)
+
+    assert header == HEADER
+    assert rows == [response(1, "a"), response(2, "b")]
+    assert mark["row"] == 3 and mark["sheet_rows"] == [2, 3]
+
+
+def test_next_run_reads_only_appended_rows(tmp_path):
+    watermark = FormWatermark(str(tmp_path / "watermarks.json"))
+    tab = Tab([response(1, "a"), response(2, "b")])
+    watermark.commit(read(watermark, tab)[2])
+    tab.rows += [response(3, "c"), response(4, "d")]
+
+    _, rows, mark = read(watermark, tab)
+
+    assert rows == [response(3, "c"), response(4, "d")]
+    assert mark["row"] == 5 and mark["sheet_rows"] == [4, 5]
+    watermark.commit(mark)
+    assert read(watermark, tab)[1] == []
+
+
+def test_resorted_tab_reads_only_rows_submitted_after_the_watermark(tmp_path):
+    watermark = FormWatermark(str(tmp_path / "watermarks.json"))
+    tab = Tab([response(1, "a"), response(2, "b"), response(3, "c")])
+    watermark.commit(read(watermark, tab)[2])
+
+    # Sorted by email address, newest first, with one new response in between
+    tab.rows = [HEADER, response(3, "c"), response(4, "d"), response(2, "b"), response(1, "a")]
+    _, rows, mark = read(watermark, tab)
+
+    assert rows == [response(4, "d")]
+    assert mark["sheet_rows"] == [3]
+    assert mark["row"] == 5 and mark["timestamp"] == response(4, "d")[0]
+
+    # The watermark row is now the tab's last row; a new submission is appended after it
+    watermark.commit(mark)
+    tab.rows.append(response(5, "e"))
+    _, rows, mark = read(watermark, tab)
+    assert rows == [response(5, "e")] and mark["sheet_rows"] == [6]
+
+
+def test_resorted_tab_without_new_rows(tmp_path):
+    watermark = FormWatermark(str(tmp_path / "watermarks.json"))
+    tab = Tab([response(1, "a"), response(2, "b")])
+    watermark.commit(read(watermark, tab)[2])
+    tab.rows = [HEADER, response(2, "b"), response(1, "a")]
+
+    _, rows, mark = read(watermark, tab)
+
+    assert rows == [] and mark is None
+
+
+def test_full_run_mark_lets_the_next_incremental_run_skip_every_row(tmp_path):
+    watermark = FormWatermark(str(tmp_path / "watermarks.json"))
+    tab = Tab([response(1, "a"), response(2, "b")])
+    watermark.commit(FormWatermark.mark_after("sheet", "RITP", HEADER, tab.rows[1:]))
+    tab.rows.append(response(3, "c"))
+
+    _, rows, _ = read(watermark, tab)
+
+    assert rows == [response(3, "c")]
@@ -0,0 +1,33 @@
+"""DataFrameUtils.iter_dataframes builds every window of a tab with the same columns."""
+import pytest
+
+pd = pytest.importorskip("pandas")
+
+from google_sheet_processor import DataFrameUtils  # noqa: E402
+
+HEADER = ["Timestamp", "Trip ID", "Comment", "Trip ID"]
+
+
+def test_column_windows_keep_every_header_column():
+    # Comment is empty in the first window only; the API leaves out empty cells at the end
+    windows = [
+        (HEADER, [["t1", "t2"], ["T-250114-3", "T-250114-4"], [], ["x"]], None),
+        (HEADER, [["t3"], ["T-250114-5"], ["late note"]], None),
+    ]
+
+    first, second = DataFrameUtils.iter_dataframes(windows, major_dimension="COLUMNS")
+
+    assert list(first.columns) == HEADER and list(second.columns) == HEADER
+    assert first["Comment"].tolist() == ["N/A", "N/A"]
+    assert second["Comment"].tolist() == ["late note"]
+    assert list(first.index) == [1, 2] and list(second.index) == [3]
+
+
+def test_row_and_column_windows_build_the_same_frame():
+    rows = [["t1", "T-250114-3", "", "x"], ["t2", "T-250114-4"]]
+    columns = [["t1", "t2"], ["T-250114-3", "T-250114-4"], [""], ["x"]]
+
+    (by_rows,) = DataFrameUtils.iter_dataframes([(HEADER, rows, None)])
+    (by_columns,) = DataFrameUtils.iter_dataframes([(HEADER, columns, None)], major_dimension="COLUMNS")
+
+    pd.testing.assert_frame_equal(by_rows, by_columns, check_dtype=False)
@@ -0,0 +1,81 @@
+"""TaxEngine amounts, VAT rates and per-note totals."""
+from decimal import Decimal
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+np = pytest.importorskip("numpy")
+
+from tax_engine import ERROR_COLUMN, TaxEngine  # noqa: E402
+
+
+@pytest.mark.parametrize("cell, amount", [
+    ("1,234.50", "1234.50"),
+    ("1.234,50", "1234.50"),
+    ("1.234.567", "1234567"),
+    ("80,5", "80.5"),
+    ("€ 80", "80"),
+    ("-12.5 EUR", "-12.5"),
+    ("1e3", "1E+3"),
+    ("", "0"),
+    (np.nan, "0"),
+    (7, "7"),
+])
+def test_to_decimal_reads_amounts(cell, amount):
+    assert TaxEngine.to_decimal(cell) == Decimal(amount)
+
+
+@pytest.mark.parametrize("cell", ["N/A", "12-", "-"])
+def test_to_decimal_rejects_non_amounts(cell):
+    with pytest.raises(ValueError):
+        TaxEngine.to_decimal(cell)
+
+
+def test_invoice_vat_follows_tax_status_only():
+    # The INV_TEMPLATE call: no country column, so only "Within Germany" charges VAT
+    df = pd.DataFrame({"Unit Price": ["100", "100", "100"], "Quantity": ["1", "2", "1"],
+                       "Country": ["Germany", "Germany", "France"],
+                       "Tax Status": ["", "Within Germany", "Outside Germany"]})
+
+    totals = TaxEngine.compute(df, group_by=None, amount_column="Unit Price", quantity_column="Quantity",
+                               tax_status_column="Tax Status")
+
+    assert totals["vat_amount"].tolist() == [Decimal("0.00"), Decimal("38.00"), Decimal("0.00")]
+    assert totals["gross_total"].tolist() == [Decimal("100.00"), Decimal("238.00"), Decimal("100.00")]
+
+
+def test_country_rate_applies_without_tax_status():
+    df = pd.DataFrame({"email_address": ["a", "b"], "Amount": ["100", "100"], "country": ["Deutschland", "Spain"]})
+
+    totals = TaxEngine.compute(df, group_by="email_address", amount_column="Amount", country_column="country")
+
+    assert totals.loc["a", "vat_percentage"] == "VAT 19%"
+    assert totals.loc["b", "vat_percentage"] == "VAT 0%"
+
+
+def test_rows_with_a_blank_group_key_keep_their_totals():
+    df = pd.DataFrame({"agent_code": ["A1", np.nan, "A1", np.nan], "Amount": ["10", "5", "2.5", "1"]})
+
+    totals = TaxEngine.compute(df, group_by="agent_code", amount_column="Amount")
+
+    assert len(totals) == 2
+    assert totals["net_total"].tolist() == [Decimal("12.50"), Decimal("6.00")]
+
+
+def test_failed_group_does_not_stop_the_others():
+    df = pd.DataFrame({"email_address": ["a", "a", "b"], "Amount": ["10", "N/A", "20"]})
+
+    totals = TaxEngine.compute(df, group_by="email_address", amount_column="Amount")
+
+    assert TaxEngine.check(totals.loc["b"])["net_total"] == Decimal("20.00")
+    assert ERROR_COLUMN not in TaxEngine.check(totals.loc["b"]).index
+    with pytest.raises(ValueError, match="No tax totals"):
+        TaxEngine.check(totals.loc["a"])
+
+
+def test_missing_amount_column_fails_every_group():
+    df = pd.DataFrame({"email_address": ["a", "b"]})
+
+    totals = TaxEngine.compute(df, group_by="email_address", amount_column="Amount")
+
+    assert totals[ERROR_COLUMN].tolist() == ['Column "Amount" not found.'] * 2
@@ -0,0 +1,264 @@
+"""Persistent trip ID index over the Salesforce reference tables (SF-INFL and the opportunities).
+
+Trip IDs are the join key of every merge stage. The reference rows are kept in a local SQLite
+database keyed by the normalized trip ID, so a merge stage looks up the trips of its own form
+rows instead of loading and re-normalizing the whole export:
+
+    index = TripIndex()
+    index.update("sf_infl", header, rows)
+    sf_df = index.lookup_frame("sf_infl", ricc_df["trip_id"])
+    merged = merge_on_trip(ricc_df, sf_df, "trip_id")
+
+update() is incremental: every reference row is fingerprinted, rows that are new are inserted
+and rows that are gone from the export are deleted; unchanged rows are not touched.
+normalize_trip_id() is the one normalization rule used by the index, CC.py, RICC_INFL.py,
+RITP.py and DataFrameUtils.match_trip_details. The database is CN_CACHE_DIR/trip_index.sqlite.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from dataframe_backend import as_objects, as_strings
+from form_watermark import row_fingerprint
+
+TRIP_INDEX_FILE = os.path.join(os.getenv("CN_CACHE_DIR", ".cache"), "trip_index.sqlite")
+
+# Normalized trip ID column added to looked-up reference rows; merge on it, then drop it
+TRIP_KEY = "_trip_key"
+
+# Trip IDs as typed into the forms, e.g. "T-250114-3"
+TRIP_ID_PATTERN = re.compile(r'T-\d{6}-\d+', re.IGNORECASE)
+
+# Placeholders that mean "no trip ID"
+EMPTY_TRIP_IDS = {"", "none", "nan", "n/a"}
+
+# Reference table -> the columns indexed for lookups (the labels of the exported tabs)
+SOURCE_FIELDS = {
+    "sf_infl": {
+        "trip": "Invoice: Trip Detail: Trip Confirmation: Trip",
+        "invoice_no": "Invoice: Invoice No.",
+        "record_type": "Invoice: Trip Detail: Record Type",
+    },
+    "opportunities": {
+        "trip": "Trip",
+        "invoice_no": "Invoice: Invoice No.",
+        "opportunity_id": "Opportunity ID",
+    },
+}
+
+# SQLite allows 999 bound parameters per statement in older builds
+LOOKUP_CHUNK = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reference_rows (
+    source TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    trip_key TEXT NOT NULL,
+    invoice_no TEXT,
+    record_type TEXT,
+    opportunity_id TEXT,
+    row TEXT NOT NULL,
+    PRIMARY KEY (source, fingerprint)
+);
+CREATE INDEX IF NOT EXISTS reference_rows_trip ON reference_rows (source, trip_key);
+CREATE INDEX IF NOT EXISTS reference_rows_opportunity ON reference_rows (source, opportunity_id);
+CREATE TABLE IF NOT EXISTS sources (
+    source TEXT PRIMARY KEY,
+    columns TEXT NOT NULL,
+    refreshed_at REAL NOT NULL
+);
+"""
+
+
+def normalize_trip_id(value):
+    """Join key of a trip ID: no whitespace, no leading quote, lowercase; "" for placeholders."""
+    if value is None:
+        return ""
+    key = re.sub(r'\s+', '', str(value)).lstrip("'").lower()
+    return "" if key in EMPTY_TRIP_IDS else key
+
+
+def _trip_keys(series, backend=None):
+    """Normalized trip IDs in the backend's string dtype (see dataframe_backend.py)."""
+    keys = as_strings(series, backend, na_value="").str.replace(r'\s+', '', regex=True).str.lstrip("'").str.lower()
+    return keys.where(~keys.isin(EMPTY_TRIP_IDS), "")
+
+
+def normalize_trip_series(series, backend=None):
+    """normalize_trip_id for a whole pandas Series."""
+    return as_objects(_trip_keys(series, backend))
+
+
+def extract_trip_ids(text):
+    """All trip IDs written in one form cell ("T-250114-3, T-250114-4")."""
+    return TRIP_ID_PATTERN.findall(str(text))
+
+
+def merge_on_trip(df, reference, trip_column, suffixes=("", "_sf"), backend=None):
+    """
+    Left-merge reference rows from TripIndex.lookup_frame onto df by normalized trip ID.
+
+    df keeps its own trip_column values; the result has the same columns as a merge on the
+    trip column would have had. The join keys are compared as backend strings.
+    """
+    left = df.assign(**{TRIP_KEY: _trip_keys(df[trip_column], backend)})
+    reference = reference.assign(**{TRIP_KEY: as_strings(reference[TRIP_KEY], backend, na_value="")})
+    merged = left.merge(reference, on=TRIP_KEY, how="left", suffixes=suffixes)
+    return merged.drop(columns=[TRIP_KEY])
+
+
+class TripIndex:
+    """Reference rows of every source table, indexed by normalized trip ID and opportunity ID."""
+
+    def __init__(self, path=TRIP_INDEX_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def connect(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        db = sqlite3.connect(self.path)
+        db.executescript(SCHEMA)
+        return db
+
+    def columns(self, source):
+        """Columns of a source's rows, or None when it was never indexed."""
+        db = self.connect()
+        try:
+            stored = db.execute("SELECT columns FROM sources WHERE source = ?", (source,)).fetchone()
+        finally:
+            db.close()
+        return json.loads(stored[0]) if stored else None
+
+    def refreshed_at(self, source):
+        """Unix time of the source's last update(), or None."""
+        db = self.connect()
+        try:
+            stored = db.execute("SELECT refreshed_at FROM sources WHERE source = ?", (source,)).fetchone()
+        finally:
+            db.close()
+        return stored[0] if stored else None
+
+    def update(self, source, columns, rows):
+        """
+        Bring a source up to date with its latest export.
+
+        Args:
+            source (str): Reference table name, a key of SOURCE_FIELDS.
+            columns (list): Header of the export.
+            rows (iterable): Rows of the export, in header order (short rows are padded with "").
+
+        Returns:
+            tuple: (rows added, rows removed)
+        """
+        columns = [str(column) for column in columns]
+        fields = SOURCE_FIELDS[source]
+        if fields["trip"] not in columns:
+            raise KeyError(f'Column "{fields["trip"]}" is missing from the {source} data.')
+        positions = {field: columns.index(column) for field, column in fields.items() if column in columns}
+
+        incoming = {}
+        for row in rows:
+            row = (list(row) + [""] * len(columns))[:len(columns)]
+            incoming[row_fingerprint(row)] = row
+
+        with self.lock:
+            db = self.connect()
+            try:
+                with db:
+                    stored = db.execute("SELECT columns FROM sources WHERE source = ?", (source,)).fetchone()
+                    if stored and json.loads(stored[0]) != columns:
+                        # Stored rows are positional; a changed header means indexing everything again
+                        db.execute("DELETE FROM reference_rows WHERE source = ?", (source,))
+                    existing = {fingerprint for (fingerprint,) in
+                                db.execute("SELECT fingerprint FROM reference_rows WHERE source = ?", (source,))}
+
+                    added = [fingerprint for fingerprint in incoming if fingerprint not in existing]
+                    removed = [fingerprint for fingerprint in existing if fingerprint not in incoming]
+                    db.executemany(
+                        "INSERT INTO reference_rows VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        [self._record(source, fingerprint, incoming[fingerprint], positions) for fingerprint in added]
+                    )
+                    db.executemany("DELETE FROM reference_rows WHERE source = ? AND fingerprint = ?",
+                                   [(source, fingerprint) for fingerprint in removed])
+                    db.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?)",
+                               (source, json.dumps(columns), time.time()))
+            finally:
+                db.close()
+        print(f"Trip index {source}: {len(added)} rows added, {len(removed)} removed, {len(incoming)} indexed.")
+        return len(added), len(removed)
+
+    @staticmethod
+    def _record(source, fingerprint, row, positions):
+        def field(name):
+            return str(row[positions[name]]).strip() if name in positions else None
+
+        return (source, fingerprint, normalize_trip_id(row[positions["trip"]]), field("invoice_no"),
+                field("record_type"), field("opportunity_id"), json.dumps(row, default=str))
+
+    def _select(self, source, key_column, keys):
+        """Stored rows whose key_column is one of keys, fetched through the index in chunks."""
+        keys = sorted({key for key in keys if key})
+        rows = []
+        db = self.connect()
+        try:
+            for start in range(0, len(keys), LOOKUP_CHUNK):
+                chunk = keys[start:start + LOOKUP_CHUNK]
+                rows += db.execute(
+                    f"SELECT trip_key, row FROM reference_rows WHERE source = ? AND {key_column} IN "
+                    f"({', '.join('?' * len(chunk))}) ORDER BY rowid",
+                    [source] + chunk
+                ).fetchall()
+        finally:
+            db.close()
+        return [(trip_key, json.loads(row)) for trip_key, row in rows]
+
+    def lookup(self, source, trip_ids):
+        """Reference rows (lists in the source's column order) of the given trips, by normalized trip ID."""
+        return [row for _, row in self._select(source, "trip_key", map(normalize_trip_id, trip_ids))]
+
+    def lookup_frame(self, source, trip_ids):
+        """
+        Reference rows of the given trips as a DataFrame, ready for merge_on_trip.
+
+        The source's trip column is replaced by TRIP_KEY, the normalized trip ID.
+        """
+        import pandas as pd
+
+        columns = self.columns(source)
+        if columns is None:
+            raise ValueError(f"The trip index has no {source} data yet.")
+        matches = self._select(source, "trip_key", map(normalize_trip_id, trip_ids))
+        frame = pd.DataFrame([row for _, row in matches], columns=columns)
+        frame = frame.drop(columns=[SOURCE_FIELDS[source]["trip"]])
+        frame[TRIP_KEY] = [trip_key for trip_key, _ in matches]
+        return frame
+
+    def opportunity_frame(self, source, opportunity_ids):
+        """Reference rows of the given opportunities as a DataFrame with the source's columns."""
+        import pandas as pd
+
+        columns = self.columns(source)
+        if columns is None:
+            raise ValueError(f"The trip index has no {source} data yet.")
+        keys = (str(opportunity_id).strip() for opportunity_id in opportunity_ids)
+        return pd.DataFrame([row for _, row in self._select(source, "opportunity_id", keys)], columns=columns)
+
+    def trip(self, trip_id):
+        """Invoice numbers, record types and opportunity IDs of one trip across every source."""
+        db = self.connect()
+        try:
+            matches = db.execute(
+                f"SELECT invoice_no, record_type, opportunity_id FROM reference_rows "
+                f"WHERE source IN ({', '.join('?' * len(SOURCE_FIELDS))}) AND trip_key = ?",
+                list(SOURCE_FIELDS) + [normalize_trip_id(trip_id)]
+            ).fetchall()
+        finally:
+            db.close()
+        return {
+            "invoice_numbers": sorted({match[0] for match in matches if match[0]}),
+            "record_types": sorted({match[1] for match in matches if match[1]}),
+            "opportunity_ids": sorted({match[2] for match in matches if match[2]}),
+        }